@@ -9,12 +9,17 @@ config = Config()
 
 LOGLEVELSTR = os.environ.get('ODYBCL2FASTQ_LOG_LEVEL', 'INFO')
 
-logging.basicConfig(
-    level=logging.getLevelName(LOGLEVELSTR),
-    format='%(message)s'
-)
-
 # Setup loggers
+def setupLogging():
+    '''
+    log to stderr at ODYBCL2FASTQ_LOG_LEVEL, called by the scripts and the
+    snakefiles rather than on import
+    '''
+    logging.basicConfig(
+        level=logging.getLevelName(LOGLEVELSTR),
+        format='%(message)s'
+    )
+
 def setupMainLogger():
     logger  = logging.getLogger('odybcl2fastq10x')
     logfilename = os.environ.get('ODYBCL2FASTQ_LOG_FILE', 'odybcl2fastq10x.log')
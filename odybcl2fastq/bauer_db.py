@@ -1,6 +1,5 @@
 import json
 import logging
-import requests
 import os
 from odybcl2fastq import config
 from odybcl2fastq.parsers.parse_runinfoxml import get_readinfo_from_runinfo, get_runinfo
@@ -85,6 +84,7 @@ class BauerDB(object):
             return False
 
     def send_data(self, endpoint, data, method = 'POST'):
+        import requests
         url = self.seq_api + endpoint + '/'
         headers = {'Authorization': 'Token %s' % self.token}
         if method == 'PATCH':
@@ -103,6 +103,7 @@ class BauerDB(object):
         return item_id
 
     def get_data(self, endpoint):
+        import requests
         url = self.root_api + endpoint + '/'
         headers = {'Authorization': 'Token %s' % self.token}
         r = requests.get(url = url, headers=headers)
@@ -0,0 +1,141 @@
+'''
+admission control for new workflows based on how busy the cluster is
+
+Before a run is launched the pending and running job counts for our
+partitions are sampled with a single squeue call.  While either count is at
+or over its threshold runs stay in the scheduler, the time each run was held
+is reported when it is finally admitted.  Setting
+ODYBCL2FASTQ_OCCUPANCY_SOURCE=file:<path> reads the counts from a json file
+({"PENDING": n, "RUNNING": n}) instead, for tests and for draining by hand.
+'''
+import os
+import json
+import time
+import logging
+import subprocess
+
+PARTITIONS = os.getenv('ODYBCL2FASTQ_PARTITIONS', 'bos-info_priority,bos-info').split(',')
+MAX_PENDING = int(os.getenv('ODYBCL2FASTQ_MAX_PENDING_JOBS', 20))
+MAX_RUNNING = int(os.getenv('ODYBCL2FASTQ_MAX_RUNNING_JOBS', 60))
+OCCUPANCY_SOURCE = os.getenv('ODYBCL2FASTQ_OCCUPANCY_SOURCE', 'squeue')
+# reuse a sample for this long, a new sample is taken each time a run exits
+SAMPLE_SECONDS = int(os.getenv('ODYBCL2FASTQ_OCCUPANCY_SECONDS', 30))
+SQUEUE_TIMEOUT = 30
+# each admitted workflow submits at least this many jobs straight away
+JOBS_PER_RUN = 1
+
+
+class SqueueOccupancy(object):
+    '''
+    count jobs by state in partitions with one squeue call
+    '''
+
+    def __init__(self, partitions=PARTITIONS):
+        self.partitions = partitions
+
+    def __call__(self):
+        cmd = ['squeue', '--noheader', '--partition', ','.join(self.partitions), '--format', '%T']
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                universal_newlines=True, timeout=SQUEUE_TIMEOUT)
+        if proc.returncode != 0:
+            raise OSError('squeue failed with code %i: %s' % (proc.returncode, proc.stderr.strip()))
+        counts = {'PENDING': 0, 'RUNNING': 0}
+        for line in proc.stdout.splitlines():
+            state = line.strip()
+            if state:
+                counts[state] = counts.get(state, 0) + 1
+        return counts
+
+
+class FileOccupancy(object):
+    '''
+    read job counts by state from a json file
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self):
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+
+def get_occupancy_source(source=OCCUPANCY_SOURCE):
+    if source.startswith('file:'):
+        return FileOccupancy(source[len('file:'):])
+    elif source == 'squeue':
+        return SqueueOccupancy()
+    raise ValueError('unknown occupancy source: %s' % source)
+
+
+class AdmissionController(object):
+
+    def __init__(self, source=None, max_pending=MAX_PENDING, max_running=MAX_RUNNING,
+            sample_seconds=SAMPLE_SECONDS):
+        self.source = get_occupancy_source() if source is None else source
+        self.max_pending = max_pending
+        self.max_running = max_running
+        self.sample_seconds = sample_seconds
+        self.occupancy = None
+        self.sampled = 0
+        self.held = {}
+        self.holding = False
+
+    def sample(self, force=False):
+        '''
+        return the job counts by state, None if they could not be read
+        '''
+        now = time.time()
+        if force or now - self.sampled >= self.sample_seconds:
+            try:
+                self.occupancy = self.source()
+            except Exception as e:
+                logging.warning('Could not sample cluster occupancy, admitting runs: %s' % e)
+                self.occupancy = None
+            self.sampled = now
+        return self.occupancy
+
+    def invalidate(self):
+        self.sampled = 0
+
+    def has_room(self):
+        '''
+        True if the cluster is below both thresholds
+        '''
+        occupancy = self.sample()
+        if occupancy is None:
+            return True
+        pending = occupancy.get('PENDING', 0)
+        running = occupancy.get('RUNNING', 0)
+        room = pending < self.max_pending and running < self.max_running
+        if room == self.holding:
+            self.holding = not room
+            logging.info('%s runs, cluster has %i pending and %i running jobs (limits %i and %i)'
+                    % ('Admitting' if room else 'Holding', pending, running, self.max_pending, self.max_running))
+        return room
+
+    def hold(self, names):
+        '''
+        note runs that were ready but held back
+        '''
+        now = time.time()
+        for name in names:
+            self.held.setdefault(name, now)
+
+    def admit(self, name):
+        '''
+        record run as admitted, returns the decision for the run log
+        '''
+        held_since = self.held.pop(name, None)
+        waited = time.time() - held_since if held_since else 0
+        occupancy = self.occupancy or {}
+        decision = {
+            'decision': 'admitted after hold' if held_since else 'admitted',
+            'waited': int(waited),
+            'pending': occupancy.get('PENDING'),
+            'running': occupancy.get('RUNNING')
+        }
+        # count the new run's jobs until the next sample sees them
+        if self.occupancy is not None:
+            self.occupancy['PENDING'] = occupancy.get('PENDING', 0) + JOBS_PER_RUN
+        return decision
@@ -1,35 +1,69 @@
 import json
 import os
-import subprocess
+
+# required directories, and whether they must be writable
+REQUIRED_DIRS = [
+    ('/sequencing/source', False),
+    ('/sequencing/analysis', True),
+    ('/sequencing/published', True),
+    ('/ref', False)
+]
 
 class Config(object):
+    '''
+    settings from the ODY_* environment variables, read on first use so
+    importing odybcl2fastq does no work, call validate() for the pre-flight
+    checks of the required directories
+    '''
 
     def __init__(self):
-        self.data = {}
-        self.data['EMAIL_ADMIN'] = json.loads(os.environ['ODY_EMAIL_ADMIN'])
-        self.data['EMAIL_FROM'] = os.environ['ODY_EMAIL_FROM']
-        self.data['EMAIL_SMTP'] = os.environ['ODY_EMAIL_SMTP']
-        self.data['EMAIL_TO'] = json.loads(os.environ['ODY_EMAIL_TO'])
-        self.data['FASTQ_URL'] = os.environ.get('ODY_FASTQ_URL', 'https://software.rc.fas.harvard.edu/ngsdata/')
-        self.data['GLOBUS_URL'] = os.environ['ODY_GLOBUS_URL']
-        self.data['PUBLISHED_CLUSTER_PATH'] = os.environ['ODY_PUBLISHED_CLUSTER_PATH']
-        self.data['ANALYSIS_DIR'] = os.environ['ODY_ANALYSIS_DIR']
-        # pre-flight checks to ensure existence and accessibility of required directories
-        self.check_dir('/sequencing/source')
-        self.check_dir('/sequencing/analysis', check_is_writable=True)
-        self.check_dir('/sequencing/published', check_is_writable=True)
-        self.check_dir('/ref')
-        self.data['TEST'] = os.environ.get('ODY_TEST', 'FALSE') == 'TRUE'
+        self._data = None
+        self._validated = False
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self.load()
+        return self._data
+
+    def load(self):
+        data = {}
+        data['EMAIL_ADMIN'] = json.loads(os.environ['ODY_EMAIL_ADMIN'])
+        data['EMAIL_FROM'] = os.environ['ODY_EMAIL_FROM']
+        data['EMAIL_SMTP'] = os.environ['ODY_EMAIL_SMTP']
+        data['EMAIL_TO'] = json.loads(os.environ['ODY_EMAIL_TO'])
+        data['FASTQ_URL'] = os.environ.get('ODY_FASTQ_URL', 'https://software.rc.fas.harvard.edu/ngsdata/')
+        data['GLOBUS_URL'] = os.environ['ODY_GLOBUS_URL']
+        data['PUBLISHED_CLUSTER_PATH'] = os.environ['ODY_PUBLISHED_CLUSTER_PATH']
+        data['ANALYSIS_DIR'] = os.environ['ODY_ANALYSIS_DIR']
+        data['TEST'] = os.environ.get('ODY_TEST', 'FALSE') == 'TRUE'
         # default to empty for db connection variables for now since they are
         # not used in when TEST is true
-        self.data['STATUS_DB_HOST'] = os.environ.get('ODY_STATUS_DB_HOST', '')
-        self.data['STATUS_DB_NAME'] = os.environ.get('ODY_STATUS_DB_NAME', '')
-        self.data['STATUS_DB_USER'] = os.environ.get('ODY_STATUS_DB_USER', '')
-        self.data['STATUS_DB_PASSWORD'] = os.environ.get('ODY_STATUS_DB_PASSWORD', '')
-        self.data['BAUER_API'] = os.environ.get('ODY_BAUER_API', '')
-        self.data['BAUER_TOKEN'] = os.environ.get('ODY_BAUER_TOKEN', '')
+        data['STATUS_DB_HOST'] = os.environ.get('ODY_STATUS_DB_HOST', '')
+        data['STATUS_DB_NAME'] = os.environ.get('ODY_STATUS_DB_NAME', '')
+        data['STATUS_DB_USER'] = os.environ.get('ODY_STATUS_DB_USER', '')
+        data['STATUS_DB_PASSWORD'] = os.environ.get('ODY_STATUS_DB_PASSWORD', '')
+        data['BAUER_API'] = os.environ.get('ODY_BAUER_API', '')
+        data['BAUER_TOKEN'] = os.environ.get('ODY_BAUER_TOKEN', '')
+        return data
+
+    def validate(self):
+        '''
+        read the settings and run the pre-flight checks to ensure existence
+        and accessibility of required directories, once per process
+        '''
+        if not self._validated:
+            # missing settings raise KeyError here rather than on first use
+            self.data
+            for path, check_is_writable in REQUIRED_DIRS:
+                self.check_dir(path, check_is_writable)
+            self._validated = True
+        return self
 
     def __getattr__(self, attr):
+        # private and special names are not settings
+        if attr.startswith('_'):
+            raise AttributeError(attr)
         if attr in self.data:
             return self.data[attr]
         else:
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+'''
+index of the disk usage of each run on the source, analysis and published
+volumes
+
+Every directory of a run has a row with the bytes and inodes of the files
+directly in it, its mtime and the names of its subdirs.  A refresh stats each
+directory and only scans the ones whose mtime changed (a file was added,
+removed or renamed in it), so an unchanged run costs a stat per directory
+rather than one per file.  A file that grows in place keeps its old size until
+its dir changes or a full refresh is made.  Bytes are allocated blocks divided
+by the number of links to the file so a fastq hard-linked from analysis to
+published is counted once between them, the bytes before dividing are kept as
+apparent_bytes.  The bytes of files with a single link, which deleting the
+run would free, are kept as freed_bytes.  Usage is summed per run and per
+top-level subdir (fastq, QC, count, InterOp, ...).
+
+Linking or unlinking a file changes its link count without changing the
+mtime of its dir, so bytes and freed_bytes of a dir that is not scanned again
+can be stale.  For the analysis and published volumes, whose runs are
+hard-linked to each other, each run keeps a signature of the dirs of the same
+run on the other volume as last indexed, and a run whose signature changed
+(it was published, published again or its other copy was removed) is scanned
+in full.  refresh_all refreshes a volume again if a volume linked to it was
+refreshed after it, so the link counts seen by one refresh of all volumes are
+current.  Links made from anywhere else are only seen when the dir changes or
+with a full refresh.
+
+Created on  2026-10-17
+
+@copyright: 2026 The Presidents and Fellows of Harvard College. All rights reserved.
+@license: GPL v2.0
+'''
+import os
+import sys
+import json
+import time
+import sqlite3
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+DISK_USAGE_DB = os.getenv('ODYBCL2FASTQ_DISK_USAGE_DB', '/sequencing/log/ody_disk_usage.db')
+VOLUMES = {
+    'source': '/sequencing/source',
+    'analysis': '/sequencing/analysis',
+    'published': '/sequencing/published'
+}
+VOLUMES.update(json.loads(os.getenv('ODYBCL2FASTQ_DISK_USAGE_VOLUMES', '{}')))
+WORKERS = int(os.getenv('ODYBCL2FASTQ_DISK_USAGE_WORKERS', 8))
+GB = 1024 ** 3
+# volumes whose runs are hard-linked to the same run on the other
+LINKED_VOLUMES = {
+    'analysis': ['published'],
+    'published': ['analysis']
+}
+
+SCHEMA = ['''
+create table if not exists dirs (
+    path text primary key,
+    volume text not null,
+    run text not null,
+    part text not null,
+    mtime real not null,
+    bytes real not null,
+    apparent_bytes integer not null,
+    inodes integer not null,
+    subdirs text not null,
+    freed_bytes integer not null default 0
+)
+''', '''
+create index if not exists dirs_run on dirs (volume, run)
+''', '''
+create table if not exists runs (
+    volume text not null,
+    run text not null,
+    run_date text,
+    mtime real not null,
+    refreshed real not null,
+    links text,
+    primary key (volume, run)
+)
+''']
+
+
+# the signature of a run with no dirs on the linked volumes
+NO_LINKS = json.dumps([0, None, 0.0])
+
+
+def get_run_date(run):
+    '''
+    return the yymmdd the run name starts with, None if it doesn't
+    '''
+    date = run.split('_')[0]
+    return date if len(date) == 6 and date.isdigit() else None
+
+
+def scan_dir(path):
+    '''
+    return (bytes, apparent bytes, inodes, subdir names, bytes of files
+    with one link) for the entries directly in path
+    '''
+    size = 0
+    apparent = 0
+    freed = 0
+    inodes = 0
+    subdirs = []
+    seen = set()
+    for entry in os.scandir(path):
+        inodes += 1
+        if entry.is_dir(follow_symlinks=False):
+            subdirs.append(entry.name)
+            continue
+        st = entry.stat(follow_symlinks=False)
+        if st.st_ino in seen:
+            continue
+        seen.add(st.st_ino)
+        blocks = st.st_blocks * 512
+        apparent += blocks
+        size += blocks / st.st_nlink
+        if st.st_nlink == 1:
+            freed += blocks
+    return size, apparent, inodes, sorted(subdirs), freed
+
+
+def refresh_run(volume, run_path, cached):
+    '''
+    walk run_path scanning only the dirs whose mtime is not the cached one,
+    returns (rows of changed dirs, paths of all dirs, number scanned, mtime
+    of run_path)
+    '''
+    run = os.path.basename(run_path)
+    rows = []
+    paths = []
+    scanned = 0
+    run_mtime = None
+    stack = [(run_path, '.')]
+    while stack:
+        path, part = stack.pop()
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            continue
+        paths.append(path)
+        if path == run_path:
+            run_mtime = mtime
+        row = cached.get(path)
+        if row is not None and row['mtime'] == mtime:
+            subdirs = json.loads(row['subdirs'])
+        else:
+            try:
+                size, apparent, inodes, subdirs, freed = scan_dir(path)
+            except FileNotFoundError:
+                continue
+            scanned += 1
+            rows.append((path, volume, run, part, mtime, size, apparent, inodes, json.dumps(subdirs), freed))
+        for name in subdirs:
+            stack.append((os.path.join(path, name), name if path == run_path else part))
+    return rows, paths, scanned, run_mtime
+
+
+class DiskUsageIndex(object):
+
+    def __init__(self, path=DISK_USAGE_DB):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            for sql in SCHEMA:
+                self.db.execute(sql)
+            if 'freed_bytes' not in [r['name'] for r in self.db.execute('pragma table_info(dirs)')]:
+                # an index made before freed_bytes was kept is scanned again
+                self.db.execute('alter table dirs add column freed_bytes integer not null default 0')
+                self.db.execute('delete from dirs')
+                self.db.execute('delete from runs')
+            if 'links' not in [r['name'] for r in self.db.execute('pragma table_info(runs)')]:
+                # runs without a signature are scanned in full on the next refresh
+                self.db.execute('alter table runs add column links text')
+
+    def close(self):
+        self.db.close()
+
+    def get_links(self, volume):
+        '''
+        return {run: signature} of the dirs of each run on the volumes linked
+        to volume, as last indexed
+        '''
+        linked = LINKED_VOLUMES.get(volume, [])
+        rows = self.db.execute('''select run, count(*), max(mtime), total(mtime) from dirs where volume in (%s)
+            group by run''' % ','.join('?' * len(linked)), linked)
+        return {r[0]: json.dumps(list(r[1:])) for r in rows}
+
+    def refresh(self, volume, root=None, full=False, workers=WORKERS):
+        '''
+        refresh the runs of a volume, every dir is scanned if full, returns
+        (runs, dirs scanned)
+        '''
+        root = root or VOLUMES[volume]
+        run_paths = [e.path for e in os.scandir(root) if e.is_dir(follow_symlinks=False)]
+        cached = {}
+        for row in self.db.execute('select path, run, mtime, subdirs from dirs where volume = ?', (volume,)):
+            cached.setdefault(row['run'], {})[row['path']] = row
+        links = self.get_links(volume)
+        # link counts may have changed in any dir of these runs
+        rescan = set(r['run'] for r in self.db.execute('select run, links from runs where volume = ?', (volume,))
+            if r['links'] != links.get(r['run'], NO_LINKS))
+        runs = set()
+        scanned = 0
+        with ThreadPoolExecutor(workers) as pool:
+            futures = [pool.submit(refresh_run, volume, p, {} if full or os.path.basename(p) in rescan
+                else cached.get(os.path.basename(p), {})) for p in run_paths]
+            for run_path, future in zip(run_paths, futures):
+                rows, paths, run_scanned, mtime = future.result()
+                # removed since the volume was listed
+                if not paths:
+                    continue
+                run = os.path.basename(run_path)
+                runs.add(run)
+                scanned += run_scanned
+                gone = set(cached.get(run, {})) - set(paths)
+                with self.db:
+                    self.db.executemany('insert or replace into dirs values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                    self.db.executemany('delete from dirs where path = ?', [(p,) for p in gone])
+                    self.db.execute('''insert or replace into runs (volume, run, run_date, mtime, refreshed, links)
+                        values (?, ?, ?, ?, ?, ?)''', (volume, run, get_run_date(run), mtime, time.time(),
+                        links.get(run, NO_LINKS)))
+        with self.db:
+            for (run,) in self.db.execute('select run from runs where volume = ?', (volume,)).fetchall():
+                if run not in runs:
+                    self.db.execute('delete from dirs where volume = ? and run = ?', (volume, run))
+                    self.db.execute('delete from runs where volume = ? and run = ?', (volume, run))
+        return len(run_paths), scanned
+
+    def refresh_all(self, volumes, roots={}, full=False, workers=WORKERS):
+        '''
+        refresh volumes in order, then again any volume a linked volume was
+        refreshed after, returns {volume: (runs, dirs scanned)}
+        '''
+        counts = {}
+        for volume in volumes:
+            counts[volume] = self.refresh(volume, roots.get(volume), full, workers)
+        for i, volume in enumerate(volumes):
+            if set(LINKED_VOLUMES.get(volume, [])) & set(volumes[i + 1:]):
+                runs, scanned = self.refresh(volume, roots.get(volume), False, workers)
+                counts[volume] = (runs, counts[volume][1] + scanned)
+        return counts
+
+    def get_runs(self, volume=None, order='bytes', limit=20):
+        '''
+        return runs with their bytes, apparent bytes and inodes, the largest
+        first for order bytes or the oldest first for order date
+        '''
+        sql = '''select r.volume, r.run, r.run_date, r.mtime, sum(d.bytes) as bytes,
+            sum(d.apparent_bytes) as apparent_bytes, sum(d.inodes) as inodes
+            from runs r join dirs d on d.volume = r.volume and d.run = r.run'''
+        params = []
+        if volume:
+            sql += ' where r.volume = ?'
+            params.append(volume)
+        sql += ' group by r.volume, r.run'
+        if order == 'date':
+            sql += " order by coalesce(r.run_date, substr(strftime('%Y%m%d', r.mtime, 'unixepoch'), 3)), r.run"
+        else:
+            sql += ' order by bytes desc'
+        sql += ' limit ?'
+        params.append(limit)
+        return self.db.execute(sql, params).fetchall()
+
+    def get_freed_bytes(self, volume):
+        '''
+        return {run: bytes deleting it would free} for the runs of a volume
+        '''
+        return dict(self.db.execute('select run, sum(freed_bytes) from dirs where volume = ? group by run',
+            (volume,)).fetchall())
+
+    def get_parts(self, run, volume=None):
+        '''
+        return (volume, part, bytes, apparent bytes, inodes) for each
+        top-level subdir of a run, part . is the files directly in the run dir
+        '''
+        sql = '''select volume, part, sum(bytes), sum(apparent_bytes), sum(inodes) from dirs where run = ?'''
+        params = [run]
+        if volume:
+            sql += ' and volume = ?'
+            params.append(volume)
+        sql += ' group by volume, part order by volume, part'
+        return self.db.execute(sql, params).fetchall()
+
+    def get_volume_totals(self):
+        return self.db.execute('''select volume, count(distinct run), sum(bytes), sum(apparent_bytes), sum(inodes)
+            from dirs group by volume order by volume''').fetchall()
+
+
+def main():
+    parser = ArgumentParser(description='index and report the disk usage of runs')
+    parser.add_argument('--db', default=DISK_USAGE_DB, help='path to the db [default: %s]' % DISK_USAGE_DB)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    refresh = sub.add_parser('refresh', help='refresh the index, all volumes if none given')
+    refresh.add_argument('volumes', nargs='*', help=', '.join(sorted(VOLUMES)))
+    refresh.add_argument('--full', action='store_true', help='scan every dir, not only those that changed')
+    for cmd, help in [('largest', 'the largest runs'), ('oldest', 'the oldest runs')]:
+        runs = sub.add_parser(cmd, help=help)
+        runs.add_argument('--volume', choices=sorted(VOLUMES))
+        runs.add_argument('-n', type=int, default=20)
+    show = sub.add_parser('show', help='usage of a run by top-level subdir')
+    show.add_argument('run')
+    sub.add_parser('totals', help='usage of each volume')
+    args = parser.parse_args()
+
+    if args.cmd == 'refresh' and set(args.volumes) - set(VOLUMES):
+        parser.error('unknown volume, choose from %s' % ', '.join(sorted(VOLUMES)))
+    index = DiskUsageIndex(args.db)
+    if args.cmd == 'refresh':
+        counts = index.refresh_all(args.volumes or sorted(VOLUMES), full=args.full)
+        for volume, (runs, scanned) in counts.items():
+            print('%s: %i runs, %i dirs scanned' % (volume, runs, scanned))
+    elif args.cmd in ('largest', 'oldest'):
+        print('volume\trun\tgb\tapparent_gb\tinodes')
+        for row in index.get_runs(args.volume, 'bytes' if args.cmd == 'largest' else 'date', args.n):
+            print('%s\t%s\t%.1f\t%.1f\t%i' % (row['volume'], row['run'], row['bytes'] / GB,
+                row['apparent_bytes'] / GB, row['inodes']))
+    elif args.cmd == 'show':
+        print('volume\tpart\tgb\tapparent_gb\tinodes')
+        for volume, part, size, apparent, inodes in index.get_parts(args.run):
+            print('%s\t%s\t%.1f\t%.1f\t%i' % (volume, part, size / GB, apparent / GB, inodes))
+    else:
+        print('volume\truns\tgb\tapparent_gb\tinodes')
+        for volume, runs, size, apparent, inodes in index.get_volume_totals():
+            print('%s\t%i\t%.1f\t%.1f\t%i' % (volume, runs, size / GB, apparent / GB, inodes))
+    index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
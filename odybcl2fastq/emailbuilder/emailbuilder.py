@@ -1,5 +1,4 @@
 import smtplib
-from jinja2 import Environment, PackageLoader
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import COMMASPACE, make_msgid
@@ -43,7 +42,8 @@ def buildmessage(message, subject, summary_data, fromaddr, toemaillist, template
 
 
 def get_html(summary_data, template):
-    # create html message with jinja
+    # create html message with jinja, only summary emails need it
+    from jinja2 import Environment, PackageLoader
     j2_env = Environment(
         loader=PackageLoader('odybcl2fastq', 'templates'),
         trim_blocks=True
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+'''
+verify the fastq.gz files of a run in one pass over each file
+
+Each file is read once in large sequential chunks: the compressed bytes go to
+md5 and the decompressed bytes are counted, zlib checks the CRC and length of
+every gzip member and a file that ends part way through a member is reported
+as truncated.  Reads, bases and bases of Q30 or more are counted from the
+decompressed records.  Files are verified in parallel across processes, then
+md5sum.txt is written sorted by path in the format of md5sum and the figures
+for each file are written to verify/<path>.json in the analysis dir.
+
+Created on  2026-10-17
+
+@copyright: 2026 The Presidents and Fellows of Harvard College. All rights reserved.
+@license: GPL v2.0
+'''
+import os
+import sys
+import json
+import zlib
+import hashlib
+import logging
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+READ_SIZE = 16 * 1024 * 1024
+# phred+33 below Q30, deleting these leaves the Q30 bases
+LOW_QUALITY = bytes(range(33 + 30))
+MD5SUM_FILE = 'md5sum.txt'
+VERIFY_DIR = 'verify'
+
+
+class FastqCounter(object):
+    '''
+    count the reads, bases and Q30 bases of fastq fed in chunks
+    '''
+
+    def __init__(self):
+        self.reads = 0
+        self.bases = 0
+        self.q30_bases = 0
+        self.lines = 0
+        self.partial = b''
+
+    def feed(self, data):
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        self.add(lines)
+
+    def add(self, lines):
+        # lines of a record are header, sequence, +, quality
+        offset = self.lines % 4
+        self.reads += len(lines[(0 - offset) % 4::4])
+        self.bases += sum(map(len, lines[(1 - offset) % 4::4]))
+        quality = b''.join(lines[(3 - offset) % 4::4])
+        self.q30_bases += len(quality.translate(None, LOW_QUALITY))
+        self.lines += len(lines)
+
+    def close(self):
+        if self.partial:
+            self.add([self.partial])
+            self.partial = b''
+        return self.lines % 4 == 0
+
+
+def verify_fastq(path):
+    '''
+    return a dict of md5, gzip members, counts and any error for a fastq.gz
+    '''
+    md5 = hashlib.md5()
+    counter = FastqCounter()
+    result = {'path': path, 'size': 0, 'members': 0, 'error': None}
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    in_member = False
+    try:
+        with open(path, 'rb', buffering=0) as f:
+            while True:
+                data = f.read(READ_SIZE)
+                if not data:
+                    break
+                result['size'] += len(data)
+                md5.update(data)
+                while data:
+                    in_member = True
+                    counter.feed(decompressor.decompress(data))
+                    if not decompressor.eof:
+                        break
+                    # the CRC and length were checked, another member may follow
+                    result['members'] += 1
+                    data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                    in_member = False
+        if in_member or not result['members']:
+            result['error'] = 'truncated gzip member'
+        elif not counter.close():
+            result['error'] = 'incomplete fastq record'
+    except (OSError, zlib.error) as e:
+        result['error'] = str(e)
+    result['md5'] = md5.hexdigest()
+    result['reads'] = counter.reads
+    result['bases'] = counter.bases
+    result['q30_bases'] = counter.q30_bases
+    return result
+
+
+def find_fastq(analysis_dir):
+    '''
+    return the paths of the fastq.gz files relative to analysis_dir
+    '''
+    paths = []
+    for root, dirs, names in os.walk(os.path.join(analysis_dir, 'fastq')):
+        for name in names:
+            if name.endswith('.fastq.gz'):
+                paths.append(os.path.relpath(os.path.join(root, name), analysis_dir))
+    return paths
+
+
+def verify_run(analysis_dir, processes=None):
+    '''
+    verify all fastq.gz in analysis_dir, write md5sum.txt and a json file of
+    figures for each, returns the results for files that failed
+    '''
+    paths = sorted(find_fastq(analysis_dir))
+    with ProcessPoolExecutor(processes) as pool:
+        results = list(pool.map(verify_fastq, [os.path.join(analysis_dir, p) for p in paths], chunksize=1))
+    failed = []
+    md5sum_path = os.path.join(analysis_dir, MD5SUM_FILE)
+    with open(md5sum_path + '.tmp', 'w') as md5sums:
+        for path, result in zip(paths, results):
+            result['path'] = path
+            if result['error']:
+                failed.append(result)
+                logging.error('%s failed verification: %s' % (path, result['error']))
+            # same format as md5sum, the path relative to the analysis dir
+            md5sums.write('%s  %s\n' % (result['md5'], path))
+            verify_path = os.path.join(analysis_dir, VERIFY_DIR, path + '.json')
+            os.makedirs(os.path.dirname(verify_path), exist_ok=True)
+            with open(verify_path, 'w') as f:
+                json.dump(result, f, indent=1)
+    # a failed run leaves no md5sum.txt so the checksum step is retried
+    if failed:
+        os.remove(md5sum_path + '.tmp')
+    else:
+        os.replace(md5sum_path + '.tmp', md5sum_path)
+    return failed
+
+
+def main():
+    parser = ArgumentParser(description='verify the fastq.gz of a run and write md5sum.txt')
+    parser.add_argument('analysis_dir')
+    parser.add_argument('--processes', type=int, default=None, help='[default: number of cpus]')
+    args = parser.parse_args()
+    failed = verify_run(args.analysis_dir, args.processes)
+    for result in failed:
+        print('%s: %s' % (result['path'], result['error']))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
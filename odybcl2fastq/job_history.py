@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+'''
+history of the slurm jobs submitted by the workflows and the resources they
+used, used to size new jobs and to resubmit jobs that ran out of memory or time
+
+Every job submitted by slurm_submit.py is recorded with its rule, instrument,
+run size and sbatch options.  When cluster_status.py sees the job finish the
+/usr/bin/time -v reports in its .err log are added to the row.  Once a rule
+has MIN_HISTORY successful jobs (on the same instrument, or any instrument if
+there are too few) new jobs for it are given cores from the cpu use seen,
+memory from the largest max RSS seen and a walltime from the wall time per
+unit of run size seen, each with some headroom.  Run size is cycles x lanes
+for demultiplexing and GB of fastq for the steps after it.
+
+A job that ends OUT_OF_MEMORY or TIMEOUT is resubmitted with double the memory
+or time, up to MAX_ATTEMPTS, and the new job answers status checks for the
+old one.  For an array job only the tasks that failed are resubmitted.
+
+slurm_submit.py and cluster_status.py write to the db on each submission and
+finished job, from the host running the workflows, so by default it is kept on
+that host's local disk rather than the /sequencing/log NFS mount.
+
+Created on  2026-10-17
+
+@copyright: 2026 The Presidents and Fellows of Harvard College. All rights reserved.
+@license: GPL v2.0
+'''
+import os
+import sys
+import json
+import math
+import time
+import logging
+import sqlite3
+import subprocess
+from argparse import ArgumentParser
+from odybcl2fastq.parsers.parse_time import parse_time_v_file, get_totals
+from odybcl2fastq.parsers.samplesheet import get_instrument
+from odybcl2fastq.parsers.metadata_cache import get_run_cost
+from odybcl2fastq.resources import get_run_size, format_time, GB
+from odybcl2fastq.job_status import FAILED_STATES
+
+JOB_HISTORY_DB = os.getenv('ODYBCL2FASTQ_JOB_HISTORY_DB', '/var/tmp/ody_job_history.db')
+MIN_HISTORY = int(os.getenv('ODYBCL2FASTQ_MIN_HISTORY', 5))
+MAX_ATTEMPTS = int(os.getenv('ODYBCL2FASTQ_MAX_ATTEMPTS', 3))
+# most recent successful jobs a prediction is made from
+HISTORY_JOBS = 50
+PERCENTILE = 95
+MEM_HEADROOM = 1.25
+TIME_HEADROOM = 1.5
+MIN_MEM_MB = 1024
+MIN_MINUTES = 15
+MAX_MINUTES = (4 * 24 + 20) * 60
+ESCALATE_STATES = ['OUT_OF_MEMORY', 'TIMEOUT']
+DEMUX_RULES = ['demultiplex', 'demultiplex_10x']
+SOURCE_DIR = '/sequencing/source/'
+SBATCH_TIMEOUT = 60
+
+SCHEMA = '''
+create table if not exists jobs (
+    jobid text primary key,
+    rule text not null,
+    run text not null,
+    instrument text not null,
+    size real not null,
+    tasks integer not null default 0,
+    script text not null,
+    opts text not null,
+    err_path text not null,
+    attempt integer not null default 1,
+    retry_jobid text,
+    submitted real not null,
+    state text,
+    collected integer not null default 0,
+    wall_seconds real,
+    user_seconds real,
+    system_seconds real,
+    cpu_percent integer,
+    max_rss_kb integer,
+    exit_status integer
+)
+'''
+
+
+def parse_minutes(value):
+    '''
+    minutes from a slurm time, [days-]hours:minutes:seconds, minutes:seconds
+    or minutes
+    '''
+    value = str(value)
+    if '-' in value:
+        days, value = value.split('-', 1)
+        parts = [int(p) for p in value.split(':')] + [0, 0]
+        return int(days) * 24 * 60 + parts[0] * 60 + parts[1] + math.ceil(parts[2] / 60)
+    parts = [int(p) for p in value.split(':')]
+    if len(parts) == 3:
+        return parts[0] * 60 + parts[1] + math.ceil(parts[2] / 60)
+    elif len(parts) == 2:
+        return parts[0] + math.ceil(parts[1] / 60)
+    return parts[0]
+
+
+def parse_mem_mb(value):
+    '''
+    megabytes from a slurm memory size, 0 is all of the node's memory
+    '''
+    value = str(value).upper()
+    units = {'K': 1 / 1024, 'M': 1, 'G': 1024, 'T': 1024 * 1024}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value or 0)
+
+
+def percentile(values, p=PERCENTILE):
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def get_run(analysis_dir):
+    '''
+    the run for an analysis dir, which may have a suffix
+    '''
+    return '_'.join(os.path.basename(os.path.normpath(analysis_dir)).split('_')[:4])
+
+
+def get_job_size(rule, analysis_dir, run_size=None):
+    '''
+    return (instrument, size) for a job of rule on the run in analysis_dir,
+    run_size is get_run_size(analysis_dir) if the caller already has it
+    '''
+    run = get_run(analysis_dir)
+    try:
+        instrument = get_instrument(run)
+    except (IndexError, ValueError):
+        instrument = ''
+    if rule in DEMUX_RULES:
+        run_info = os.path.join(SOURCE_DIR, run, 'RunInfo.xml')
+        size = get_run_cost(run_info) if os.path.isfile(run_info) else 0
+    else:
+        size = (run_size or get_run_size(analysis_dir))[0] / GB
+    return instrument, size
+
+
+def sbatch(script, opts):
+    '''
+    submit script with opts as sbatch options, returns the job id
+    '''
+    argv = ['sbatch'] + ['--%s=%s' % (k, v) if v != '' else '--%s' % k for k, v in opts.items()] + [script]
+    proc = subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, timeout=SBATCH_TIMEOUT)
+    if proc.returncode != 0:
+        raise OSError('sbatch failed with code %i: %s' % (proc.returncode, proc.stderr.strip()))
+    # Submitted batch job <jobid>
+    return proc.stdout.split()[-1]
+
+
+def escalate(opts, states):
+    '''
+    return opts with double the memory for OUT_OF_MEMORY and double the time
+    for TIMEOUT in states, None if they can't be raised
+    '''
+    opts = dict(opts)
+    if 'OUT_OF_MEMORY' in states:
+        mem_mb = parse_mem_mb(opts.get('mem', 0))
+        # already all of a node's memory
+        if not mem_mb:
+            return None
+        opts['mem'] = '%iM' % (mem_mb * 2)
+    if 'TIMEOUT' in states:
+        minutes = parse_minutes(opts.get('time', MAX_MINUTES))
+        if minutes >= MAX_MINUTES:
+            return None
+        opts['time'] = format_time(min(minutes * 2, MAX_MINUTES))
+    return opts
+
+
+class JobHistory(object):
+
+    def __init__(self, path=JOB_HISTORY_DB, min_history=MIN_HISTORY):
+        self.path = path
+        self.min_history = min_history
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.execute(SCHEMA)
+            self.db.execute('create index if not exists jobs_rule on jobs (rule, state, submitted)')
+
+    def close(self):
+        self.db.close()
+
+    def get(self, jobid):
+        return self.db.execute('select * from jobs where jobid = ?', (jobid,)).fetchone()
+
+    def submitted(self, jobid, rule, run, instrument, size, script, opts, err_path, tasks=0, attempt=1):
+        with self.db:
+            self.db.execute('''insert or replace into jobs (jobid, rule, run, instrument, size, tasks, script, opts,
+                err_path, attempt, submitted) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                (jobid, rule, run, instrument, size, tasks, script, json.dumps(opts), err_path, attempt, time.time()))
+
+    def current(self, jobid):
+        '''
+        the job that stands in for jobid after any resubmissions
+        '''
+        row = self.get(jobid)
+        while row and row['retry_jobid']:
+            jobid = row['retry_jobid']
+            row = self.get(jobid)
+        return jobid
+
+    def collect(self, jobid, state, tasks=None):
+        '''
+        record the final state and the resources used by a job, or by each
+        task of an array job from (task jobid, state) in tasks
+        '''
+        row = self.get(jobid)
+        if not row or row['collected']:
+            return
+        usage = []
+        if row['tasks'] and tasks:
+            for task_jobid, task_state in tasks:
+                task = task_jobid.split('_', 1)[1]
+                err_path = row['err_path'].replace('%A', jobid).replace('%a', task)
+                usage.append((task_jobid, task_state, self.read_usage(err_path)))
+        elif not row['tasks']:
+            usage.append((jobid, state, self.read_usage(row['err_path'].replace('%j', jobid))))
+        with self.db:
+            for usage_jobid, usage_state, totals in usage:
+                if usage_jobid != jobid:
+                    # a task is sized by its share of the run
+                    self.db.execute('''insert or replace into jobs (jobid, rule, run, instrument, size, script, opts,
+                        err_path, attempt, submitted) select ?, rule, run, instrument, size / tasks, script, opts,
+                        err_path, attempt, submitted from jobs where jobid = ?''', (usage_jobid, jobid))
+                self.db.execute('''update jobs set state = ?, collected = 1, wall_seconds = ?, user_seconds = ?,
+                    system_seconds = ?, cpu_percent = ?, max_rss_kb = ?, exit_status = ? where jobid = ?''',
+                    (usage_state, totals.get('wall_seconds'), totals.get('user_seconds'), totals.get('system_seconds'),
+                        totals.get('cpu_percent'), totals.get('max_rss_kb'), totals.get('exit_status'), usage_jobid))
+            self.db.execute('update jobs set state = ?, collected = 1 where jobid = ?', (state, jobid))
+
+    def read_usage(self, err_path):
+        try:
+            return get_totals(parse_time_v_file(err_path))
+        except OSError as e:
+            logging.warning('Could not read resource usage from %s: %s' % (err_path, e))
+            return {}
+
+    def get_history(self, rule, instrument):
+        sql = '''select size, wall_seconds, cpu_percent, max_rss_kb from jobs where rule = ? and state = 'COMPLETED'
+            and size > 0 and wall_seconds > 0 and max_rss_kb > 0 %s order by submitted desc limit ?'''
+        rows = self.db.execute(sql % 'and instrument = ?', (rule, instrument, HISTORY_JOBS)).fetchall()
+        if len(rows) < self.min_history:
+            rows = self.db.execute(sql % '', (rule, HISTORY_JOBS)).fetchall()
+        return rows
+
+    def predict(self, rule, instrument, size):
+        '''
+        return sbatch options for a job of rule on a run of size, None if
+        there are too few jobs to go on
+        '''
+        rows = self.get_history(rule, instrument)
+        if len(rows) < self.min_history or not size:
+            return None
+        cpus = max(1, math.ceil(percentile([r['cpu_percent'] or 100 for r in rows]) / 100))
+        mem_mb = max(MIN_MEM_MB, math.ceil(percentile([r['max_rss_kb'] for r in rows]) / 1024 * MEM_HEADROOM))
+        seconds = percentile([r['wall_seconds'] / r['size'] for r in rows]) * size * TIME_HEADROOM
+        minutes = min(max(MIN_MINUTES, math.ceil(seconds / 60)), MAX_MINUTES)
+        return {'cpus-per-task': cpus, 'mem': '%iM' % mem_mb, 'time': format_time(minutes)}
+
+    def resubmit(self, jobid, state, tasks=None):
+        '''
+        resubmit a job that ran out of memory or time with more, returns the
+        new job id or None if it was not resubmitted
+        '''
+        row = self.get(jobid)
+        if not row or row['retry_jobid'] or row['attempt'] >= MAX_ATTEMPTS:
+            return None
+        opts = json.loads(row['opts'])
+        if row['tasks']:
+            failed = [(t, s) for t, s in tasks or [] if s in FAILED_STATES]
+            states = set(s for t, s in failed)
+            if not failed or not states.issubset(ESCALATE_STATES):
+                return None
+            # run only the failed tasks, keeping the limit on running tasks
+            limit = opts.get('array', '').partition('%')[2]
+            opts['array'] = ','.join(t.split('_', 1)[1] for t, s in failed) + ('%' + limit if limit else '')
+        elif state in ESCALATE_STATES:
+            states = set([state])
+        else:
+            return None
+        opts = escalate(opts, states)
+        if opts is None:
+            return None
+        new_jobid = sbatch(row['script'], opts)
+        logging.warning('Resubmitted %s job %s after %s as %s with mem %s and time %s'
+                % (row['rule'], jobid, ', '.join(sorted(states)), new_jobid, opts.get('mem'), opts.get('time')))
+        with self.db:
+            self.db.execute('''insert or replace into jobs (jobid, rule, run, instrument, size, tasks, script, opts,
+                err_path, attempt, submitted) select ?, rule, run, instrument, size, tasks, script, ?, err_path,
+                attempt + 1, ? from jobs where jobid = ?''', (new_jobid, json.dumps(opts), time.time(), jobid))
+            self.db.execute('update jobs set retry_jobid = ? where jobid = ?', (new_jobid, jobid))
+        return new_jobid
+
+
+def main():
+    parser = ArgumentParser(description='show the job history and predicted resources')
+    parser.add_argument('--db', default=JOB_HISTORY_DB, help='path to the db [default: %s]' % JOB_HISTORY_DB)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    predict = sub.add_parser('predict', help='predict resources for a rule')
+    predict.add_argument('rule')
+    predict.add_argument('instrument')
+    predict.add_argument('size', type=float, help='cycles x lanes for demultiplexing, otherwise GB of fastq')
+    show = sub.add_parser('show', help='show the jobs of a run')
+    show.add_argument('run')
+    args = parser.parse_args()
+
+    history = JobHistory(args.db)
+    if args.cmd == 'predict':
+        print(json.dumps(history.predict(args.rule, args.instrument, args.size)))
+    else:
+        rows = history.db.execute('select * from jobs where run = ? order by submitted', (args.run,))
+        for row in rows:
+            print('\t'.join(str(row[k]) for k in ['jobid', 'rule', 'attempt', 'state', 'wall_seconds',
+                'cpu_percent', 'max_rss_kb', 'exit_status']))
+    history.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
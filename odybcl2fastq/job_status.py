@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+'''
+shared cache of slurm job states for the snakemake cluster-status script
+
+Jobs are recorded in a sqlite table when they are submitted.  A refresher,
+run by process_snakemake_runs or on its own with
+python -m odybcl2fastq.job_status daemon, looks up every unfinished job with
+a single sacct call each interval so cluster_status.py can answer from the
+table.  When a job's state is older than STALE_SECONDS (the refresher is not
+running or is behind) the job is looked up directly and the answer cached.
+An array job gets a state from those of its tasks and each task's state is
+kept as <jobid>_<task>.  A job resubmitted by cluster_status.py is mapped to
+its new job id here too, so a status check only opens this db until the job
+has finished.
+The db is written by every cluster_status.py, slurm_submit.py and refresher,
+all on the host running the workflows, so it defaults to local disk where
+sqlite locking can be relied on, unlike the /sequencing/log NFS mount.
+Setting ODYBCL2FASTQ_SLURM_BACKEND=file:<path> reads job states from a json
+file ({"<jobid>": "<state>"}) instead of sacct, for tests.
+
+Created on  2026-10-17
+
+@copyright: 2026 The Presidents and Fellows of Harvard College. All rights reserved.
+@license: GPL v2.0
+'''
+import os
+import sys
+import json
+import time
+import logging
+import sqlite3
+import subprocess
+from argparse import ArgumentParser
+
+JOB_STATUS_DB = os.getenv('ODYBCL2FASTQ_JOB_STATUS_DB', '/var/tmp/ody_job_status.db')
+SLURM_BACKEND = os.getenv('ODYBCL2FASTQ_SLURM_BACKEND', 'sacct')
+REFRESH_SECONDS = int(os.getenv('ODYBCL2FASTQ_JOB_STATUS_SECONDS', 30))
+STALE_SECONDS = int(os.getenv('ODYBCL2FASTQ_JOB_STATUS_STALE_SECONDS', 120))
+# finished jobs are dropped from the table after this long
+KEEP_SECONDS = 7 * 24 * 60 * 60
+SACCT_TIMEOUT = 60
+# sacct takes job ids on the command line, keep the list a reasonable length
+BATCH_SIZE = 500
+
+SUBMITTED = 'SUBMITTED'
+SUCCESS_STATES = ['COMPLETED']
+FAILED_STATES = ['FAILED', 'OUT_OF_MEMORY', 'TIMEOUT', 'CANCELLED', 'BOOT_FAIL', 'DEADLINE', 'NODE_FAIL', 'PREEMPTED']
+FINISHED_STATES = SUCCESS_STATES + FAILED_STATES
+
+SCHEMA = '''
+create table if not exists job_status (
+    jobid text primary key,
+    state text not null,
+    checked real not null,
+    submitted real not null
+)
+'''
+RETRY_SCHEMA = '''
+create table if not exists job_retry (
+    jobid text primary key,
+    retry_jobid text not null
+)
+'''
+
+
+def get_status(state):
+    '''
+    translate a slurm state to the answer snakemake expects
+    '''
+    if state in SUCCESS_STATES:
+        return 'success'
+    elif state in FAILED_STATES:
+        return 'failed'
+    return 'running'
+
+
+def get_array_state(task_states):
+    '''
+    combine the states of an array job's tasks, it has finished when all of
+    its tasks have and failed if any of them did
+    '''
+    unfinished = [s for s in task_states if s not in FINISHED_STATES]
+    if unfinished:
+        return 'RUNNING' if 'RUNNING' in unfinished else unfinished[0]
+    failed = [s for s in task_states if s in FAILED_STATES]
+    return failed[0] if failed else SUCCESS_STATES[0]
+
+
+def collect_states(jobids, rows):
+    '''
+    return a dict of state by job for jobids from (jobid, state) rows, array
+    jobs are given the combined state of their tasks and the tasks are
+    included
+    '''
+    wanted = set(jobids)
+    states = {}
+    tasks = {}
+    for jobid, state in rows:
+        # e.g. "CANCELLED by 1234"
+        state = state.split(' ')[0]
+        base, _, task = jobid.partition('_')
+        if not task:
+            if jobid in wanted:
+                states[jobid] = state
+        elif base in wanted:
+            # tasks that haven't started are listed as a range, e.g. 1234_[4-95%16]
+            if task.startswith('['):
+                tasks.setdefault(base, []).append('PENDING')
+            else:
+                states[jobid] = state
+                tasks.setdefault(base, []).append(state)
+    for base, task_states in tasks.items():
+        states[base] = get_array_state(task_states)
+    return states
+
+
+class SacctSlurm(object):
+    '''
+    look up the state of many jobs with one sacct call
+    '''
+
+    def __call__(self, jobids):
+        states = {}
+        for i in range(0, len(jobids), BATCH_SIZE):
+            batch = jobids[i:i + BATCH_SIZE]
+            cmd = ['sacct', '--allocations', '--noheader', '--parsable2', '--format', 'JobID,State',
+                    '--jobs', ','.join(batch)]
+            proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    universal_newlines=True, timeout=SACCT_TIMEOUT)
+            if proc.returncode != 0:
+                raise OSError('sacct failed with code %i: %s' % (proc.returncode, proc.stderr.strip()))
+            rows = [line.split('|', 1) for line in proc.stdout.splitlines() if '|' in line]
+            states.update(collect_states(batch, rows))
+        return states
+
+
+class FileSlurm(object):
+    '''
+    read job states from a json file, stands in for slurm in tests
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, jobids):
+        with open(self.path, 'r') as f:
+            states = json.load(f)
+        return collect_states(jobids, states.items())
+
+
+def get_slurm_backend(backend=SLURM_BACKEND):
+    if backend.startswith('file:'):
+        return FileSlurm(backend[len('file:'):])
+    elif backend == 'sacct':
+        return SacctSlurm()
+    raise ValueError('unknown slurm backend: %s' % backend)
+
+
+class JobStatusCache(object):
+
+    def __init__(self, path=JOB_STATUS_DB, backend=None, stale_seconds=STALE_SECONDS):
+        self.path = path
+        self.backend = get_slurm_backend() if backend is None else backend
+        self.stale_seconds = stale_seconds
+        self.db = sqlite3.connect(path, timeout=30)
+        with self.db:
+            self.db.execute(SCHEMA)
+            self.db.execute(RETRY_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def get(self, jobid):
+        return self.db.execute('select state, checked from job_status where jobid = ?', (jobid,)).fetchone()
+
+    def record(self, states, checked=None):
+        '''
+        store a dict of jobid to state
+        '''
+        if checked is None:
+            checked = time.time()
+        with self.db:
+            self.db.executemany('''insert into job_status (jobid, state, checked, submitted) values (?, ?, ?, ?)
+                on conflict (jobid) do update set state = excluded.state, checked = excluded.checked''',
+                    [(j, s, checked, checked) for j, s in states.items()])
+
+    def tasks(self, jobid):
+        '''
+        return (task jobid, state) for the tasks of an array job
+        '''
+        return self.db.execute("select jobid, state from job_status where jobid like ? escape '\\' order by jobid",
+                (jobid + '\\_%',)).fetchall()
+
+    def submitted(self, jobid):
+        self.record({jobid: SUBMITTED})
+
+    def retried(self, jobid, retry_jobid):
+        '''
+        record that jobid was resubmitted as retry_jobid
+        '''
+        self.submitted(retry_jobid)
+        with self.db:
+            self.db.execute('insert or replace into job_retry (jobid, retry_jobid) values (?, ?)', (jobid, retry_jobid))
+
+    def current(self, jobid):
+        '''
+        the job that stands in for jobid after any resubmissions
+        '''
+        while True:
+            row = self.db.execute('select retry_jobid from job_retry where jobid = ?', (jobid,)).fetchone()
+            if not row:
+                return jobid
+            jobid = row[0]
+
+    def state(self, jobid):
+        '''
+        return the slurm state of a job, looked up directly if the cached
+        state is missing or stale
+        '''
+        row = self.get(jobid)
+        if row and (row[0] in FINISHED_STATES or time.time() - row[1] < self.stale_seconds):
+            return row[0]
+        try:
+            states = self.backend([jobid])
+        except Exception as e:
+            logging.warning('Could not look up slurm job %s: %s' % (jobid, e))
+            return row[0] if row else SUBMITTED
+        # jobs can take a moment to show up in sacct after submission
+        state = states.get(jobid, row[0] if row else SUBMITTED)
+        states[jobid] = state
+        self.record(states)
+        return state
+
+    def status(self, jobid):
+        return get_status(self.state(jobid))
+
+    def refresh(self):
+        '''
+        look up all unfinished jobs at once, returns the number of jobs checked
+        '''
+        now = time.time()
+        with self.db:
+            self.db.execute('delete from job_status where checked < ? and state in (%s)'
+                    % ','.join('?' * len(FINISHED_STATES)), [now - KEEP_SECONDS] + FINISHED_STATES)
+            # retries are kept until the last job they lead to is dropped
+            while self.db.execute('''delete from job_retry where retry_jobid not in (select jobid from job_status)
+                    and retry_jobid not in (select jobid from job_retry)''').rowcount:
+                pass
+        # array tasks are looked up with their job
+        rows = self.db.execute('''select jobid, state from job_status where state not in (%s)
+                and jobid not like '%%\\_%%' escape '\\' ''' % ','.join('?' * len(FINISHED_STATES)),
+                FINISHED_STATES).fetchall()
+        if not rows:
+            return 0
+        jobids = [r[0] for r in rows]
+        states = self.backend(jobids)
+        # unknown jobs keep their state but count as checked
+        for jobid, state in rows:
+            states.setdefault(jobid, state)
+        self.record(states, now)
+        return len(jobids)
+
+
+def refresh(path=JOB_STATUS_DB):
+    cache = JobStatusCache(path)
+    try:
+        return cache.refresh()
+    finally:
+        cache.close()
+
+
+def main():
+    parser = ArgumentParser(description='query or refresh the slurm job status cache')
+    parser.add_argument('--db', default=JOB_STATUS_DB, help='path to the db [default: %s]' % JOB_STATUS_DB)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    daemon = sub.add_parser('daemon', help='refresh the cache continuously')
+    daemon.add_argument('--seconds', type=int, default=REFRESH_SECONDS, help='[default: %i]' % REFRESH_SECONDS)
+    sub.add_parser('refresh', help='refresh the cache once')
+    show = sub.add_parser('show', help='show the state of a job')
+    show.add_argument('jobid')
+    args = parser.parse_args()
+
+    if args.cmd == 'daemon':
+        while True:
+            try:
+                refresh(args.db)
+            except Exception as e:
+                logging.warning('Could not refresh slurm job states: %s' % e)
+            time.sleep(args.seconds)
+    cache = JobStatusCache(args.db)
+    if args.cmd == 'refresh':
+        print('%i jobs checked' % cache.refresh())
+    else:
+        state = cache.state(args.jobid)
+        print('%s\t%s\t%s' % (args.jobid, state, get_status(state)))
+        for task, task_state in cache.tasks(args.jobid):
+            print('%s\t%s\t%s' % (task, task_state, get_status(task_state)))
+    cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
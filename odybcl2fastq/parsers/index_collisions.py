@@ -0,0 +1,136 @@
+'''
+check the sample indexes of a demultiplex job for collisions and pick the
+--barcode-mismatches value for bcl2fastq
+
+With m mismatches allowed in an index, two samples collide when their indexes
+are within 2m mismatches of each other in every index read of the lane, as a
+read could then be assigned to either.  The i7 and i5 indexes of each lane,
+truncated by Recipe, are packed into uint64 arrays and the mismatches between
+every pair of samples computed as one numpy matrix per index read.  bcl2fastq
+takes one value per index read for the whole job, so the highest value safe
+in every lane is used, the i5 value is applied to every dual indexed lane and
+so is given whenever one lane is dual indexed.  Samples with identical indexes
+in a lane, or a value given in the sample sheet Header that collides, stop
+the workflow before anything is submitted to slurm.
+'''
+import os
+import re
+import logging
+from collections import OrderedDict
+import numpy
+from odybcl2fastq import UserException
+from odybcl2fastq.parsers.makebasemask import apply_recipe
+from odybcl2fastq.parsers.undetermined import encode, mismatches
+
+MAX_BARCODE_MISMATCHES = int(os.getenv('ODYBCL2FASTQ_MAX_BARCODE_MISMATCHES', 1))
+
+
+def get_lane_indexes(data_by_sample):
+    '''
+    return {lane: [(sample, index, index2)]} for rows of SampleSheet
+    sections['Data'], indexes truncated by Recipe, rows without a lane are
+    in lane 1
+    '''
+    lanes = OrderedDict()
+    for row in data_by_sample.values():
+        row = apply_recipe(row)
+        index = re.sub('[^A-Z]+', '', row.get('index', '').upper())
+        index2 = re.sub('[^A-Z]+', '', row.get('index2', '').upper())
+        if index:
+            lanes.setdefault(row.get('Lane') or '1', []).append((row['Sample_ID'], index, index2))
+    return lanes
+
+
+def get_distances(samples):
+    '''
+    return (pairs, i7 mismatches, i5 mismatches) for each pair of samples,
+    i5 mismatches are 0 for single indexed samples
+    '''
+    i, j = numpy.triu_indices(len(samples), 1)
+    i7 = [s[1] for s in samples]
+    i5 = [s[2] for s in samples]
+    codes = encode(i7, max(len(s) for s in i7))
+    d7 = mismatches(codes, codes)[i, j]
+    if all(i5):
+        codes = encode(i5, max(len(s) for s in i5))
+        d5 = mismatches(codes, codes)[i, j]
+    else:
+        d5 = numpy.zeros(len(i), dtype=d7.dtype)
+    return (i, j), d7, d5
+
+
+def get_collisions(samples, distances, allowed):
+    '''
+    return the (sample, sample, i7 mismatches, i5 mismatches) that collide
+    with allowed (i7, i5) mismatches
+    '''
+    (i, j), d7, d5 = distances
+    collide = numpy.flatnonzero((d7 <= 2 * allowed[0]) & (d5 <= 2 * allowed[1]))
+    return [(samples[i[k]], samples[j[k]], int(d7[k]), int(d5[k])) for k in collide]
+
+
+def get_safe_mismatches(samples, distances, dual, max_mismatches=MAX_BARCODE_MISMATCHES):
+    '''
+    return the (i7, i5) mismatches with the most allowed that do not collide
+    '''
+    candidates = [(m7, m5) for m7 in range(max_mismatches, -1, -1) for m5 in range(max_mismatches if dual else 0, -1, -1)]
+    # the sort is stable, so of equal totals the most i7 mismatches is first
+    candidates.sort(key=lambda m: (sum(m), min(m)), reverse=True)
+    for allowed in candidates:
+        if not get_collisions(samples, distances, allowed):
+            return allowed
+    return (0, 0)
+
+
+def parse_mismatches(value, dual):
+    '''
+    return (i7, i5) from a --barcode-mismatches value, the last value is
+    used for any remaining index reads
+    '''
+    values = [int(v) for v in str(value).split(',')]
+    return (values[0], values[-1] if dual else 0)
+
+
+def format_collision(collision):
+    a, b, d7, d5 = collision
+    return '%s (%s) and %s (%s), %i i7 and %i i5 mismatches' % (a[0], '+'.join(filter(None, a[1:])), b[0],
+        '+'.join(filter(None, b[1:])), d7, d5)
+
+
+def get_barcode_mismatches(data_by_sample, requested=None, max_mismatches=MAX_BARCODE_MISMATCHES):
+    '''
+    return the --barcode-mismatches value for the samples of a demultiplex
+    job, the requested value is checked rather than chosen, raises
+    UserException listing the collisions if there is no safe value
+    '''
+    lanes = get_lane_indexes(data_by_sample)
+    # a single indexed lane has no i5 read, so only the dual indexed lanes
+    # limit the i5 value
+    dual_lanes = [lane for lane, samples in lanes.items() if all(s[2] for s in samples)]
+    dual = bool(dual_lanes)
+    chosen = [max_mismatches, max_mismatches if dual else 0]
+    errors = []
+    for lane, samples in lanes.items():
+        if len(samples) < 2:
+            continue
+        lane_dual = lane in dual_lanes
+        distances = get_distances(samples)
+        identical = get_collisions(samples, distances, (0, 0))
+        if identical:
+            errors.extend('lane %s: identical indexes for %s' % (lane, format_collision(c)) for c in identical)
+            continue
+        if requested is not None:
+            allowed = parse_mismatches(requested, dual)
+            errors.extend('lane %s: with --barcode-mismatches %s, %s' % (lane, requested, format_collision(c))
+                for c in get_collisions(samples, distances, allowed))
+            continue
+        allowed = get_safe_mismatches(samples, distances, lane_dual, max_mismatches)
+        (i, j), d7, d5 = distances
+        logging.info('lane %s: %i samples, closest i7 %i and i5 %i mismatches apart, %s mismatches allowed' % (lane,
+            len(samples), d7.min(), d5.min(), ','.join(str(m) for m in allowed[:1 + lane_dual])))
+        chosen = [min(chosen[0], allowed[0]), min(chosen[1], allowed[1]) if lane_dual else chosen[1]]
+    if errors:
+        raise UserException('Index collisions:\n%s' % '\n'.join(errors))
+    if requested is not None:
+        return str(requested)
+    return ','.join(str(m) for m in chosen[:1 + dual])
@@ -1,6 +1,6 @@
-from odybcl2fastq.parsers.parse_runinfoxml import get_readinfo_from_runinfo
+from odybcl2fastq.parsers.metadata_cache import cache, stat_key, get_readinfo, get_sample_sheet
 from odybcl2fastq import UserException
-from collections import OrderedDict,defaultdict
+from collections import OrderedDict
 from copy import copy
 import json
 import re
@@ -21,10 +21,8 @@ def make_universal_mask(rundata_by_read):
         universal_mask[read] = '%s%s' % (mask_type[indexed],mask_value)
     return universal_mask
 
-def update_mask_index(index, mask, sample):
+def index_mask(bases, mask, sample):
     if 'i' in mask:
-        index = re.sub('[^A-Z]+', '', index)
-        bases = len(index)
         if bases <= 0:
             raise UserException('sample %s index has zero bases' % sample)
         prev_bases = int(mask.replace('i', ''))
@@ -37,32 +35,77 @@ def update_mask_index(index, mask, sample):
         raise UserException('# of runinfo reads inconsistent with sample sheet Recipe setting for %s' % sample)
     return mask
 
-def make_mask(universal_mask, sample_key, sample_dict, log):
-    # sample mask is based on universal mask from run info
-    sample_mask = copy(universal_mask)
-    # limit indexes to length in recipe
+def update_mask_index(index, mask, sample):
+    return index_mask(len(re.sub('[^A-Z]+', '', index)), mask, sample)
+
+def index_length(index):
+    # None for no index, otherwise the bases left once non-base characters are stripped
+    return len(re.sub('[^A-Z]+', '', index)) if index else None
+
+def apply_recipe(sample_dict):
+    # a copy of the row with indexes limited to length in recipe, rows may be
+    # shared through the metadata cache so they are never changed in place
     if 'Recipe' in sample_dict and sample_dict['Recipe']:
         recipe = sample_dict['Recipe'].split('_')
+        sample_dict = sample_dict.copy()
         if 'index' in sample_dict:
             sample_dict['index'] = sample_dict['index'][:int(recipe[0])]
         if 'index2' in sample_dict and sample_dict['index2']:
             sample_dict['index2'] = sample_dict['index2'][:int(recipe[1])]
-    # update index lengths from sample sheet
-    if 'index' in sample_dict and sample_dict['index']: # both single and dual
-        if 'read2' in sample_mask:
-            sample_mask['read2'] = update_mask_index(sample_dict['index'],
-                    sample_mask['read2'], sample_key)
-    if 'index2' in sample_dict and sample_dict['index2'] and 'read3' in sample_mask: # dual indexed
-        sample_mask['read3'] = update_mask_index(sample_dict['index2'],
-                sample_mask['read3'], sample_key)
+    return sample_dict
+
+def signature_mask(universal_mask, index_len, index2_len, sample):
+    # mask for samples with indexes of these lengths, None for no index
+    sample_mask = copy(universal_mask)
+    if index_len is not None and 'read2' in sample_mask: # both single and dual
+        sample_mask['read2'] = index_mask(index_len, sample_mask['read2'], sample)
+    if index2_len is not None and 'read3' in sample_mask: # dual indexed
+        sample_mask['read3'] = index_mask(index2_len, sample_mask['read3'], sample)
     elif 'read3' in sample_mask and 'i' in sample_mask['read3']:
         # if the universal mask had a indexed read3 but this sample doesn't, add nutral
         cnt = int(sample_mask['read3'][1:])
         sample_mask['read3'] = NUTRAL_BASE * cnt
-    if log:
-        logger.info('sample %s mask is: %s' % (sample_key, sample_mask))
     return ','.join(sample_mask.values())
 
+def make_mask(universal_mask, sample_key, sample_dict, log):
+    # sample mask is based on universal mask from run info
+    sample_dict = apply_recipe(sample_dict)
+    mask = signature_mask(universal_mask, index_length(sample_dict.get('index')),
+            index_length(sample_dict.get('index2')), sample_key)
+    if log:
+        logger.info('sample %s mask is: %s' % (sample_key, mask))
+    return mask
+
+def get_signatures(data_by_sample, by_lane):
+    """
+    return the (lane, len(index), len(index2)) signature of each sample,
+    rows are already truncated by Recipe, lane is None unless by_lane
+    """
+    signatures = []
+    for sample, row in data_by_sample.items():
+        signatures.append((row['Lane'] if by_lane else None, index_length(row.get('index')),
+            index_length(row.get('index2'))))
+    return signatures
+
+def make_signature_table(universal_mask, data_by_sample, signatures):
+    """
+    returns an OrderedDict of signature to (mask, number of samples) in
+    order of first sample, masks are made once for each pair of index
+    lengths so errors name the first sample with those lengths
+    """
+    table = OrderedDict()
+    masks = {}
+    for sample, signature in zip(data_by_sample, signatures):
+        if signature in table:
+            mask, cnt = table[signature]
+            table[signature] = (mask, cnt + 1)
+            continue
+        lengths = signature[1:]
+        if lengths not in masks:
+            masks[lengths] = signature_mask(universal_mask, lengths[0], lengths[1], sample)
+        table[signature] = (masks[lengths], 1)
+    return table
+
 def lists_from_mask(mask, data_by_sample):
     mask_lists = {}
     mask_samples = {}
@@ -72,56 +115,71 @@ def lists_from_mask(mask, data_by_sample):
         mask_samples[mask].append(row)
     return mask_lists, mask_samples
 
-def extract_basemasks(data_by_sample, runinfo, instrument, run_type, log = True):
+def plan_basemasks(data_by_sample, runinfo, instrument, run_type, log = True):
     """
-    creates a list of lists that contain masks
-    that are compatible being run together in one demultiplexing
-    instance, regardless of instrument; nextseq must run each different
-    mask separately, while hiseq can handle different masks for different
-    lanes but if masks are different for same lane then it will require multiple
-    demultiplexing runs
+    returns (mask_lists, mask_samples, signature table) for extract_basemasks,
+    samples are grouped by their (lane, len(index), len(index2)) signature
+    and one mask is made per distinct signature rather than per sample, the
+    table is empty for indrop where every sample has the same mask
     """
-    rundata_by_read = get_readinfo_from_runinfo(runinfo)
+    rundata_by_read = get_readinfo(runinfo)
     universal_mask=make_universal_mask(rundata_by_read)
-    mask_list = []
     mask_samples = {}
     mask_lists = {}
+    table = OrderedDict()
     if run_type == 'indrop':
         mask = []
         for read in universal_mask:
             mask.append('y*')
         mask = ','.join(mask)
         mask_lists, mask_samples = lists_from_mask(mask, data_by_sample)
-    elif instrument in ['hiseq', 'novaseq']:
-        # get mask per sample
-        lane_masks=OrderedDict()
-        for sample, row in data_by_sample.items():
-            mask = make_mask(universal_mask, sample, row, log)
-            lane = row['Lane']
-            if lane not in lane_masks:
-                lane_masks[lane] = set()
-            lane_masks[lane].add(mask)
-            if mask not in mask_samples:
-                mask_samples[mask] = []
-            mask_samples[mask].append(row)
-            if log:
-                logger.info('adding mask %s for lane %s' % (mask, lane))
-        for lane, masks in lane_masks.items():
-            for mask in list(masks):
-                if mask not in mask_lists:
-                    mask_lists[mask] = OrderedDict()
-                mask_lists[mask][lane] = mask
-        for mask, lane_masks in mask_lists.items():
-            mask_lists[mask] = [lane + ':' + mask for lane, mask in lane_masks.items()]
-    else: # nextseq miseq
-        for sample, row in data_by_sample.items():
-            mask = make_mask(universal_mask, sample, row, log)
-            if mask not in mask_lists:
-                mask_lists[mask] = [mask]
-            if mask not in mask_samples:
-                mask_samples[mask] = []
-            mask_samples[mask].append(row)
+    else:
+        by_lane = instrument in ['hiseq', 'novaseq']
+        # the truncated copies are written to the mask sample sheets
+        data_by_sample = OrderedDict((sample, apply_recipe(row)) for sample, row in data_by_sample.items())
+        signatures = get_signatures(data_by_sample, by_lane)
+        table = make_signature_table(universal_mask, data_by_sample, signatures)
+        for row, signature in zip(data_by_sample.values(), signatures):
+            mask_samples.setdefault(table[signature][0], []).append(row)
+        if by_lane:
+            # hiseq and novaseq can run a different mask in each lane
+            lane_masks = OrderedDict()
+            for (lane, index_len, index2_len), (mask, cnt) in table.items():
+                lane_masks.setdefault(lane, []).append(mask)
+                if log:
+                    logger.info('adding mask %s for lane %s, %i samples' % (mask, lane, cnt))
+            for lane, masks in lane_masks.items():
+                for mask in masks:
+                    mask_lists.setdefault(mask, OrderedDict())[lane] = mask
+            for mask, lanes in mask_lists.items():
+                mask_lists[mask] = [lane + ':' + mask for lane in lanes]
+        else: # nextseq miseq
+            for mask, cnt in table.values():
+                mask_lists.setdefault(mask, [mask])
+                if log:
+                    logger.info('adding mask %s, %i samples' % (mask, cnt))
     if log:
         logger.info('instrument is %s' % instrument)
         logger.info('masks: %s' % json.dumps(mask_lists))
+    return mask_lists, mask_samples, table
+
+def extract_basemasks(data_by_sample, runinfo, instrument, run_type, log = True):
+    """
+    creates a list of lists that contain masks
+    that are compatible being run together in one demultiplexing
+    instance, regardless of instrument; nextseq must run each different
+    mask separately, while hiseq can handle different masks for different
+    lanes but if masks are different for same lane then it will require multiple
+    demultiplexing runs
+    """
+    mask_lists, mask_samples, table = plan_basemasks(data_by_sample, runinfo, instrument, run_type, log)
     return mask_lists, mask_samples
+
+def get_basemasks(sample_sheet_path, runinfo, instrument, run_type):
+    """
+    cached extract_basemasks for a sample sheet file, parsed again only if the
+    sample sheet or RunInfo.xml changes
+    """
+    key = ('basemasks', stat_key(sample_sheet_path), stat_key(runinfo), instrument, run_type)
+    sample_sheet = get_sample_sheet(sample_sheet_path)
+    return cache.get(key, lambda: extract_basemasks(sample_sheet.sections['Data'], runinfo, instrument, run_type, False))
@@ -0,0 +1,69 @@
+'''
+process wide cache of parsed run metadata
+
+entries are keyed on (path, size, mtime_ns) of the files they were parsed from
+so an edited sample sheet or RunInfo.xml is parsed again on its next use.
+Cached objects are shared, callers must treat them as read-only.
+'''
+from collections import OrderedDict
+from odybcl2fastq.parsers.samplesheet import SampleSheet
+from odybcl2fastq.parsers.parse_runinfoxml import get_readinfo_from_runinfo, get_runinfo_model
+import os
+
+CACHE_SIZE = int(os.getenv('ODYBCL2FASTQ_METADATA_CACHE_SIZE', 1024))
+
+
+def stat_key(path):
+    st = os.stat(path)
+    return (str(path), st.st_size, st.st_mtime_ns)
+
+
+class MetadataCache(object):
+    '''
+    least recently used cache with hit and miss counters
+    '''
+
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        value = loader()
+        self.entries[key] = value
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+
+cache = MetadataCache()
+
+
+def get_sample_sheet(path):
+    return cache.get(('SampleSheet',) + stat_key(path), lambda: SampleSheet(path))
+
+
+def get_readinfo(runinfo_xml_file):
+    return cache.get(('RunInfo',) + stat_key(runinfo_xml_file), lambda: get_readinfo_from_runinfo(runinfo_xml_file))
+
+
+def get_run_cost(runinfo_xml_file):
+    """
+    estimated size of a run as total cycles x lanes
+    """
+    run_info = get_runinfo_model(runinfo_xml_file)
+    return run_info.total_cycles * run_info.lane_count
@@ -1,26 +1,116 @@
+'''
+RunInfo.xml of a run, parsed once per file version
+
+RunInfo.xml is read with iterparse up to the end of Reads and FlowcellLayout,
+anything after them is not read.  Parsed files are kept by (path, size,
+mtime) so the scheduler and the snakefiles parse each version of a
+RunInfo.xml once, the functions below are views of the shared RunInfo and
+return copies that callers can change.
+'''
+import os
 import xml.etree.ElementTree as ET
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+CACHE_SIZE = int(os.getenv('ODYBCL2FASTQ_METADATA_CACHE_SIZE', 1024))
+
+Read = namedtuple('Read', ['number', 'num_cycles', 'is_indexed'])
+
+
+def get_int(attrib, key, default=None):
+    return int(attrib[key]) if key in attrib else default
+
+
+class RunInfo(object):
+    '''
+    reads, flowcell and layout of a RunInfo.xml, read once and shared so
+    treat as read-only
+    '''
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.name = None
+        self.number = None
+        self.flowcell = None
+        self.instrument = None
+        self.date = None
+        # attributes of each Read as strings, as in the xml
+        self.read_attribs = []
+        self.flowcell_layout = {}
+        self.tile_naming = None
+        self.tiles = []
+        self.parse()
+        self.reads = tuple(Read(get_int(r, 'Number'), get_int(r, 'NumCycles', 0), r.get('IsIndexedRead') == 'Y')
+            for r in self.read_attribs)
+        self.lane_count = get_int(self.flowcell_layout, 'LaneCount', 1)
+        self.surface_count = get_int(self.flowcell_layout, 'SurfaceCount')
+        self.swath_count = get_int(self.flowcell_layout, 'SwathCount')
+        self.tile_count = get_int(self.flowcell_layout, 'TileCount')
+        self.total_cycles = sum(r.num_cycles for r in self.reads)
+
+    def parse(self):
+        reads_done = layout_done = False
+        for event, elem in ET.iterparse(self.path, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag == 'Run':
+                    self.name = elem.get('Id')
+                    self.number = get_int(elem.attrib, 'Number')
+                continue
+            if elem.tag == 'Flowcell':
+                self.flowcell = elem.text
+            elif elem.tag == 'Instrument':
+                self.instrument = elem.text
+            elif elem.tag == 'Date':
+                self.date = elem.text
+            elif elem.tag == 'Read':
+                self.read_attribs.append(dict(elem.attrib))
+            elif elem.tag == 'Reads':
+                reads_done = True
+            elif elem.tag == 'Tile':
+                self.tiles.append(elem.text)
+            elif elem.tag == 'TileSet':
+                self.tile_naming = elem.get('TileNamingConvention')
+            elif elem.tag == 'FlowcellLayout':
+                self.flowcell_layout = dict(elem.attrib)
+                layout_done = True
+            else:
+                continue
+            elem.clear()
+            if reads_done and layout_done:
+                break
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def load_runinfo(path, size, mtime_ns):
+    return RunInfo(path)
+
+
+def get_runinfo_model(runinfo_xml_file):
+    '''
+    return the shared RunInfo for the current version of runinfo_xml_file
+    '''
+    st = os.stat(runinfo_xml_file)
+    return load_runinfo(str(runinfo_xml_file), st.st_size, st.st_mtime_ns)
+
 
 def get_runinfo(runinfo_xml_file):
-    tree = ET.parse(runinfo_xml_file)
-    root = tree.getroot()
+    run_info = get_runinfo_model(runinfo_xml_file)
     runinfo = {
-        'name': root.find('Run').attrib['Id'],
-        'instrument': root.find('Run/Instrument').text,
-        'flowcell': root.find('Run/Flowcell').text
+        'name': run_info.name,
+        'instrument': run_info.instrument,
+        'flowcell': run_info.flowcell
     }
     return runinfo
 
 
 def get_readinfo_from_runinfo(runinfo_xml_file):
-    tree = ET.parse(runinfo_xml_file)
-    root = tree.getroot()
-    read_dicts=[]
-    for child in root.findall('.//Read'):
-        read_dicts.append(child.attrib)
     readkey_to_readdata_map=OrderedDict()
-    for read_dict in read_dicts:
+    for read_dict in get_runinfo_model(runinfo_xml_file).read_attribs:
+        read_dict = dict(read_dict)
         number=read_dict.pop('Number')
         readkey_to_readdata_map['read%s' % number] = read_dict
     return readkey_to_readdata_map
 
+
+def get_flowcell_layout(runinfo_xml_file):
+    return dict(get_runinfo_model(runinfo_xml_file).flowcell_layout)
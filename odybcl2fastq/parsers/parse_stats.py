@@ -2,13 +2,22 @@ import os, re
 from odybcl2fastq import UserException
 from collections import OrderedDict
 from odybcl2fastq import config
-import operator
+from odybcl2fastq.parsers import undetermined as undetermined_barcodes
+from odybcl2fastq.parsers.samplesheet import SampleSheet
 import locale
 import numpy
 import json
 import logging
 
 MIN_UNDETER_CNT = 1000000
+# most undetermined indices listed per lane
+TOP_UNDETER = 50
+
+READ_SIZE = 1024 * 1024
+WHITESPACE = re.compile(r'\s*')
+# samples a lane's arrays start with room for
+LANE_SAMPLES = 256
+LANE_HEADERS = ['sample', 'index', 'clusters', '% >= Q30']
 
 def get_summary(output_dir, instrument, sample_sheet_dir, run):
     """
@@ -20,20 +29,20 @@ def get_summary(output_dir, instrument, sample_sheet_dir, run):
     stats_path = output_dir + '/Stats/Stats.json'
     if not os.path.exists(stats_path):
         raise UserException('Stats path does not exist: %s' % stats_path)
-    with open(stats_path) as f:
-        data = json.load(f)
-    if not data:
-        raise UserException('Stats file empty: %s' % stats_path)
     # parse stats for both hiseq and nextseq
-    lanes = get_stats(data)
+    lanes, unknown_barcodes = read_stats(stats_path)
+    if not lanes:
+        raise UserException('Stats file empty: %s' % stats_path)
     lane_sum = []
     if instrument in ['nextseq', 'miseq']:
         # no real lanes in nextseq, aggregate the stats
         lane_sum = get_lane_sum(lanes)
         lanes = aggregate_nextseq_lanes(lanes)
-        undetermined = format_undetermined_nextseq(data['UnknownBarcodes'])
+        undetermined = format_undetermined_nextseq(unknown_barcodes)
     else: # hiseq and novaseq
-        undetermined = format_undetermined(data['UnknownBarcodes'])
+        undetermined = format_undetermined(unknown_barcodes)
+    undetermined_causes = get_undetermined_causes(unknown_barcodes, sample_sheet_dir,
+            instrument in ['nextseq', 'miseq'])
     # format lane summary tables
     lanes, lane_headers = format_lane_table(lanes)
     summary_data = {
@@ -48,6 +57,7 @@ def get_summary(output_dir, instrument, sample_sheet_dir, run):
             'globus_url': config.GLOBUS_URL,
             'fastq_dir': config.PUBLISHED_CLUSTER_PATH,
             'undetermined': undetermined,
+            'undetermined_causes': undetermined_causes,
             'undetermined_file': 'Undetermined_SO',
             'sample_sheet_file': sample_sheet_dir
     }
@@ -64,109 +74,303 @@ def get_sample_sheet(sample_sheet_dir):
                 data += line + '<br>'
     return data
 
+class JsonStream(object):
+    """
+    walk a json file one value at a time, members() and elements() step
+    into an object or array so that only the small values inside it are
+    decoded, the parse state is the position in the buffer so a read never
+    decodes again what was already walked
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self, size=None):
+        chunk = self.f.read(size or READ_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError('unexpected end of json')
+
+    def expect(self, chars):
+        c = self.peek()
+        if c not in chars:
+            raise ValueError('expected one of %s at %r' % (chars, self.buf[self.pos:self.pos + 20]))
+        self.pos += 1
+        return c
+
+    def value(self):
+        """
+        decode the next value, a value cut off by the end of the buffer is
+        decoded again after reading twice as much, so a large value is
+        decoded at most a few times rather than once per read
+        """
+        self.peek()
+        size = READ_SIZE
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer may go on in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill(max(size, len(self.buf) - self.pos))
+            size *= 2
+
+    def members(self):
+        """
+        yield each key of the next object, the caller reads its value with
+        value(), members() or elements() before the next key
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def elements(self):
+        """
+        yield the index of each element of the next array, the caller reads
+        the element before the next
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        i = 0
+        while True:
+            yield i
+            i += 1
+            if self.expect(',]') == ']':
+                return
+
+class LaneStats(object):
+    """
+    the samples of a lane added as they are read to arrays of reads
+    (sample) and yield and yield >= Q30 (sample x read) that double in size
+    when full
+    """
+
+    def __init__(self):
+        self.info = {}
+        self.samples = []
+        self.index = []
+        self.col = {}
+        self.undetermined = None
+        self.sam_num = 0
+        self.reads = numpy.zeros(LANE_SAMPLES)
+        self.yields = numpy.zeros((LANE_SAMPLES, 0))
+        self.yieldq30 = numpy.zeros((LANE_SAMPLES, 0))
+
+    def reserve(self, rows, cols):
+        old_rows, old_cols = self.yields.shape
+        if rows <= old_rows and cols <= old_cols:
+            return
+        new_rows = max(rows, old_rows * 2) if rows > old_rows else old_rows
+        new_cols = max(cols, old_cols)
+        reads = numpy.zeros(new_rows)
+        reads[:old_rows] = self.reads
+        self.reads = reads
+        for name in ['yields', 'yieldq30']:
+            arr = numpy.zeros((new_rows, new_cols))
+            arr[:old_rows, :old_cols] = getattr(self, name)
+            setattr(self, name, arr)
+
+    def add(self, row, sample=None):
+        sample = sample or row['SampleId']
+        i = self.col.get(sample)
+        if i is None:
+            i = self.col[sample] = len(self.samples)
+            self.samples.append(sample)
+            if 'IndexMetrics' in row:
+                self.index.append([m['IndexSequence'] for m in row['IndexMetrics']])
+            else:
+                self.index.append(['undetermined'])
+        metrics = row['ReadMetrics']
+        self.reserve(i + 1, len(metrics))
+        self.reads[i] = float(row['NumberReads'])
+        for j, r in enumerate(metrics):
+            self.yields[i, j] += float(r['Yield'])
+            self.yieldq30[i, j] += float(r['YieldQ30'])
+
+    def add_demux(self, row):
+        self.sam_num += 1
+        self.add(row)
+
+    def stats(self):
+        # include a row for undertermined stats, last whatever order it was read in
+        if self.undetermined is not None:
+            self.add(self.undetermined, 'undetermined')
+        n = len(self.samples)
+        return {
+                'samples': self.samples,
+                'index': self.index,
+                'reads': self.reads[:n].copy(),
+                'yield': self.yields[:n].copy(),
+                'yieldq30': self.yieldq30[:n].copy(),
+                'clusters': self.info['TotalClustersPF'],
+                'lane_yield': self.info['Yield'],
+                'sam_num': self.sam_num
+        }
+
+def read_lane(stream):
+    """
+    return the stats of the next ConversionResults lane, each of its
+    DemuxResults is decoded and added to the arrays in turn
+    """
+    lane = LaneStats()
+    for key in stream.members():
+        if key == 'DemuxResults' and stream.peek() == '[':
+            for _ in stream.elements():
+                lane.add_demux(stream.value())
+        elif key == 'Undetermined':
+            lane.undetermined = stream.value()
+        else:
+            lane.info[key] = stream.value()
+    return lane.info['LaneNumber'], lane.stats()
+
+def read_unknown_barcodes(stream):
+    """
+    return the next UnknownBarcodes lane, reading its barcodes one at a time
+    """
+    lane = {}
+    for key in stream.members():
+        if key == 'Barcodes' and stream.peek() == '{':
+            barcodes = lane['Barcodes'] = OrderedDict()
+            for barcode in stream.members():
+                barcodes[barcode] = stream.value()
+        else:
+            lane[key] = stream.value()
+    return lane
+
+def read_stats(stats_path):
+    """
+    return (lane stats, UnknownBarcodes) from Stats.json, reading it
+    incrementally
+    """
+    lanes = OrderedDict()
+    unknown_barcodes = []
+    with open(stats_path) as f:
+        stream = JsonStream(f)
+        for key in stream.members():
+            if key == 'ConversionResults' and stream.peek() == '[':
+                for _ in stream.elements():
+                    lane_num, lane_stats = read_lane(stream)
+                    lanes[lane_num] = lane_stats
+            elif key == 'UnknownBarcodes' and stream.peek() == '[':
+                for _ in stream.elements():
+                    unknown_barcodes.append(read_unknown_barcodes(stream))
+            else:
+                stream.value()
+    return lanes, unknown_barcodes
+
 def get_stats(data):
     stats = OrderedDict()
     # get data on from each lane and samples in the lane
     for lane_info in data['ConversionResults']:
-        lane = lane_info['LaneNumber']
-        lane_stats = {
-                'samples': OrderedDict(),
-                'clusters': lane_info['TotalClustersPF'],
-                'yield': lane_info['Yield'],
-                'sam_num': len(lane_info['DemuxResults'])
-        }
-        # loop through samples and collect sam_data
-        for row in lane_info['DemuxResults']:
-            sam = row['SampleId']
-            lane_stats['samples'][sam] = get_sam_stats(sam, lane_stats['samples'], row)
-        # include a row for undertermined stats
-        if 'Undetermined' in lane_info:
-            sam = 'undetermined'
-            lane_stats['samples'][sam] = get_sam_stats(sam, lane_stats['samples'], lane_info['Undetermined'])
-        stats[lane] = lane_stats
+        stats[lane_info['LaneNumber']] = get_lane_stats(lane_info)
     return stats
 
-def get_sam_stats(sam, sam_summary, row):
-    if sam not in sam_summary:
-        sam_stats = {
-                'sample': sam,
-                'index': [],
-                'yield': [],
-                'yieldq30': []
-        }
-        if 'IndexMetrics' in row:
-            for i in row['IndexMetrics']:
-                sam_stats['index'].append(i['IndexSequence'])
-        else:
-            sam_stats['index'].append('undetermined')
-    else:
-        sam_stats = sam_summary[sam]
-    sam_stats['reads'] = float(row['NumberReads'])
-    for r in row['ReadMetrics']:
-        # ignore 0s
-        if float(r['Yield']) > 0.0:
-            sam_stats['yield'].append(float(r['Yield']))
-            sam_stats['yieldq30'].append(float(r['YieldQ30']))
-    return sam_stats
+def get_lane_stats(lane_info):
+    """
+    return the stats of a decoded lane, see LaneStats
+    """
+    lane = LaneStats()
+    lane.info = lane_info
+    for row in lane_info['DemuxResults']:
+        lane.add_demux(row)
+    lane.undetermined = lane_info.get('Undetermined')
+    return lane.stats()
+
+def get_q30(yieldq30, yields):
+    # nan where there is no yield
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return yieldq30 / yields * 100
 
 def get_lane_sum(lanes):
     lane_sum = []
     for lane_num, info in lanes.items():
-        reads = 0
-        lane_yield = []
-        lane_yieldq30 = []
-        for sam in info['samples'].values():
-            reads += sam['reads']
-            lane_yield.extend(sam['yield'])
-            lane_yieldq30.extend(sam['yieldq30'])
-        q30 = numpy.sum(lane_yieldq30) / numpy.sum(lane_yield) * 100
+        q30 = get_q30(info['yieldq30'].sum(), info['yield'].sum())
         lane_row = OrderedDict()
         lane_row['lane'] = lane_num
-        lane_row['clusters'] = locale.format_string('%d', reads, True)
+        lane_row['clusters'] = locale.format_string('%d', info['reads'].sum(), True)
         lane_row['% Bases >= Q30'] = locale.format_string('%.2f',  q30, True)
         lane_sum.append(lane_row)
     return lane_sum
 
 def format_lane_table(lanes):
+    formatted = OrderedDict()
     for lane_num, lane_info in lanes.items():
-        lanes[lane_num]['clusters'] = locale.format_string('%d', lane_info['clusters'], True)
-        for sam_name, sam_info in lane_info['samples'].items():
+        q30 = get_q30(lane_info['yieldq30'].sum(axis=1), lane_info['yield'].sum(axis=1))
+        rows = OrderedDict()
+        for i, sam in enumerate(lane_info['samples']):
             row = OrderedDict()
-            row['sample'] = sam_info['sample']
-            row['index'] = ', '.join(sam_info['index'])
-            row['clusters'] = locale.format_string('%d', sam_info['reads'], True)
-            q30 = numpy.sum(sam_info['yieldq30']) / numpy.sum(sam_info['yield']) * 100
-            row['% >= Q30'] = locale.format_string('%.2f', q30, True)
-            lanes[lane_num]['samples'][sam_name] = row
-            headers = list(row.keys())
-    return lanes, headers
+            row['sample'] = sam
+            row['index'] = ', '.join(lane_info['index'][i])
+            row['clusters'] = locale.format_string('%d', lane_info['reads'][i], True)
+            row['% >= Q30'] = locale.format_string('%.2f', q30[i], True)
+            rows[sam] = row
+        formatted[lane_num] = {
+                'samples': rows,
+                'clusters': locale.format_string('%d', lane_info['clusters'], True),
+                'sam_num': lane_info['sam_num']
+        }
+        if 'lane_yield' in lane_info:
+            formatted[lane_num]['yield'] = lane_info['lane_yield']
+    return formatted, list(LANE_HEADERS)
 
 def aggregate_nextseq_lanes(lanes):
-    lanes_new = {}
-    agg = OrderedDict()
-    agg_reads = 0
     # aggregate sample stats since there are no real lanes in nextseq
-    for lane_num, lane_info in lanes.items():
-        for sam_name, sam_info in lane_info['samples'].items():
-            if sam_name not in agg:
-                agg[sam_name] = {
-                        'sample': sam_info['sample'],
-                        'index': sam_info['index'],
-                        'reads': 0,
-                        'yield': [],
-                        'yieldq30': []
-                }
-            agg[sam_name]['reads'] += sam_info['reads']
-            agg_reads += sam_info['reads']
-            agg[sam_name]['yield'].extend(sam_info['yield'])
-            agg[sam_name]['yieldq30'].extend(sam_info['yieldq30'])
+    samples = OrderedDict()
+    for lane_info in lanes.values():
+        for sam, index in zip(lane_info['samples'], lane_info['index']):
+            samples.setdefault(sam, index)
+    cols = list(samples.keys())
+    col = {sam: i for i, sam in enumerate(cols)}
+    num_reads = max([l['yield'].shape[1] for l in lanes.values()] or [0])
+    reads = numpy.zeros(len(cols))
+    yields = numpy.zeros((len(cols), num_reads))
+    yieldq30 = numpy.zeros((len(cols), num_reads))
+    for lane_info in lanes.values():
+        idx = numpy.array([col[sam] for sam in lane_info['samples']], dtype=int)
+        lane_reads = lane_info['yield'].shape[1]
+        numpy.add.at(reads, idx, lane_info['reads'])
+        numpy.add.at(yields[:, :lane_reads], idx, lane_info['yield'])
+        numpy.add.at(yieldq30[:, :lane_reads], idx, lane_info['yieldq30'])
     # since nextseq has no lanes put aggregated results in a single "lane"
-    lanes_new[1] = {
+    return {
+        1: {
             'sam_num': lanes[1]['sam_num'],
-            'samples': agg,
-            'clusters': agg_reads
+            'samples': cols,
+            'index': [samples[sam] for sam in cols],
+            'reads': reads,
+            'yield': yields,
+            'yieldq30': yieldq30,
+            'clusters': reads.sum()
+        }
     }
-    return lanes_new
 
 def format_undetermined_nextseq(undeter):
     all = {}
@@ -176,20 +380,54 @@ def format_undetermined_nextseq(undeter):
             if index not in all:
                 all[index] = 0
             all[index] += cnt
-    sorted_undeter = OrderedDict(sorted(all.items(), key=lambda kv: kv[1], reverse = True))
-    for index, cnt in sorted_undeter.items():
-        if cnt > MIN_UNDETER_CNT:
-                top[index] = locale.format_string('%d', cnt, True)
-        else:
-            break
+    for index, cnt in undetermined_barcodes.top_barcodes(all, TOP_UNDETER, MIN_UNDETER_CNT):
+        top[index] = locale.format_string('%d', cnt, True)
     return {1: top}
 
 def format_undetermined(undeter):
     top = OrderedDict()
     for lane in undeter:
         top[lane['Lane']] = OrderedDict()
-        sorted_undeter = sorted(lane['Barcodes'].items(), key=operator.itemgetter(1), reverse = True)
-        for (index, cnt) in sorted_undeter:
-            if cnt > MIN_UNDETER_CNT:
-                top[lane['Lane']][index] = locale.format_string('%d', cnt, True)
+        for (index, cnt) in undetermined_barcodes.top_barcodes(lane['Barcodes'], TOP_UNDETER, MIN_UNDETER_CNT):
+            top[lane['Lane']][index] = locale.format_string('%d', cnt, True)
     return top
+
+def get_undetermined_causes(undeter, sample_sheet_path, aggregate):
+    """
+    diagnose the top undetermined indices of each lane against the sample
+    sheet, lanes are combined in lane 1 if aggregate
+    """
+    try:
+        lane_samples = undetermined_barcodes.get_lane_samples(SampleSheet(sample_sheet_path))
+    except (OSError, ValueError, KeyError) as e:
+        # like the sample sheet in the email this is a convenience
+        logging.warning('Could not read samples from %s: %s' % (sample_sheet_path, e))
+        return {}
+    barcodes = OrderedDict()
+    for lane in undeter:
+        lane_num = 1 if aggregate else lane['Lane']
+        lane_barcodes = barcodes.setdefault(lane_num, {})
+        for index, cnt in lane['Barcodes'].items():
+            lane_barcodes[index] = lane_barcodes.get(index, 0) + cnt
+    causes = OrderedDict()
+    for lane_num, lane_barcodes in barcodes.items():
+        if aggregate:
+            samples = list(OrderedDict((s, None) for l in lane_samples.values() for s in l))
+        else:
+            samples = lane_samples.get(lane_num, lane_samples.get(None, []))
+        diagnosis = undetermined_barcodes.diagnose(undetermined_barcodes.top_barcodes(lane_barcodes), samples)
+        rows = []
+        for index, (cnt, cause, sample, mismatches) in diagnosis.items():
+            row = OrderedDict()
+            row['index'] = index
+            row['count'] = locale.format_string('%d', cnt, True)
+            row['likely cause'] = cause
+            row['sample'] = sample
+            row['mismatches'] = '' if mismatches is None else mismatches
+            rows.append(row)
+        causes[lane_num] = {
+                'causes': [(cause, num, locale.format_string('%d', cnt, True))
+                    for cause, num, cnt in undetermined_barcodes.get_causes(diagnosis)],
+                'indices': rows
+        }
+    return causes
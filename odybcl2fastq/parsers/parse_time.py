@@ -0,0 +1,75 @@
+'''
+parse the resource usage reports written by /usr/bin/time -v
+
+A job's log can hold several reports, one for each command run under time,
+they are returned in order and can be combined into totals for the job.
+'''
+
+def parse_percent(value):
+    value = value.rstrip('%')
+    return int(value) if value.isdigit() else None
+
+
+def parse_clock(value):
+    '''
+    seconds from h:mm:ss or m:ss
+    '''
+    seconds = 0
+    for part in value.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+FIELDS = {
+    'User time (seconds)': ('user_seconds', float),
+    'System time (seconds)': ('system_seconds', float),
+    'Percent of CPU this job got': ('cpu_percent', parse_percent),
+    'Elapsed (wall clock) time (h:mm:ss or m:ss)': ('wall_seconds', parse_clock),
+    'Maximum resident set size (kbytes)': ('max_rss_kb', int),
+    'File system inputs': ('fs_inputs', int),
+    'File system outputs': ('fs_outputs', int),
+    'Exit status': ('exit_status', int)
+}
+COMMAND = 'Command being timed: '
+
+
+def parse_time_v(text):
+    '''
+    return a dict of fields for each report in text
+    '''
+    reports = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith(COMMAND):
+            reports.append({'command': line[len(COMMAND):].strip('"')})
+        elif reports and ': ' in line:
+            # labels can include a colon, values can't
+            label, value = line.rsplit(': ', 1)
+            if label in FIELDS:
+                name, convert = FIELDS[label]
+                try:
+                    reports[-1][name] = convert(value)
+                except ValueError:
+                    pass
+    return reports
+
+
+def parse_time_v_file(path):
+    with open(path, 'r', errors='replace') as f:
+        return parse_time_v(f.read())
+
+
+def get_totals(reports):
+    '''
+    combine the reports of a job, times and io are summed, memory is the
+    largest and the exit status is the last non-zero one
+    '''
+    totals = {}
+    for name in ['wall_seconds', 'user_seconds', 'system_seconds', 'fs_inputs', 'fs_outputs']:
+        totals[name] = sum(r.get(name, 0) for r in reports)
+    totals['max_rss_kb'] = max([r.get('max_rss_kb', 0) for r in reports] or [0])
+    exit_statuses = [r.get('exit_status', 0) for r in reports if r.get('exit_status')]
+    totals['exit_status'] = exit_statuses[-1] if exit_statuses else 0
+    cpu_seconds = totals['user_seconds'] + totals['system_seconds']
+    totals['cpu_percent'] = int(100 * cpu_seconds / totals['wall_seconds']) if totals['wall_seconds'] else None
+    return totals
@@ -1,15 +1,78 @@
 from collections import OrderedDict
+from collections.abc import MutableMapping
+import csv
 import logging
 import odybcl2fastq.util as util
 import re, os
 from pathlib import Path
 
+def get_instrument(run):
+    instrument_name = run.split('_')[1]
+    instrument = ''
+    if instrument_name.startswith('D'):
+        instrument = 'hiseq'
+    elif instrument_name.startswith('N'):
+        instrument = 'nextseq'
+    elif instrument_name.startswith('A'):
+        instrument = 'novaseq'
+    elif instrument_name.startswith('M'):
+        instrument = 'miseq'
+    else:
+        raise ValueError('Instrument %s does not match known types: D, N, A, M' % instrument_name)
+    return instrument
+
+class SampleRow(MutableMapping):
+    """
+    a sample of the Data section, rows read under the same header share one
+    dict of column positions so each row holds only a list of its values,
+    a row given a new column or losing one gets its own copy of the dict
+    """
+    __slots__ = ('_columns', '_values')
+
+    def __init__(self, columns, values):
+        self._columns = columns
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._columns[key]]
+
+    def __setitem__(self, key, value):
+        if key in self._columns:
+            self._values[self._columns[key]] = value
+        else:
+            self._columns = dict(self._columns)
+            self._columns[key] = len(self._values)
+            self._values.append(value)
+
+    def __delitem__(self, key):
+        if key not in self._columns:
+            raise KeyError(key)
+        # the value is left in place, only the column is dropped
+        self._columns = {k: i for k, i in self._columns.items() if k != key}
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        return len(self._columns)
+
+    def __contains__(self, key):
+        return key in self._columns
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def copy(self):
+        return SampleRow(self._columns, list(self._values))
+
 class SampleSheet(object):
     SAMPLE_SHEET_FILE = 'SampleSheet.csv'
 
     def __init__(self, path):
         self.path = path
         self.lanes = []
+        # value to sample keys for Data columns, built on first use
+        self.indexes = {}
         self.sections = self.sheet_parse(path)
 
     def sheet_parse(self, samplesheet=None):
@@ -50,40 +113,46 @@ class SampleSheet(object):
 
             'Data': OrderedDict(),
             }
-        ssheet_open = open(samplesheet,'r')
         defaults_section = ''
         data_fields = []
-        for line in ssheet_open:
-            linelist = line.strip().split(',')
-            if linelist[0] != '':
-                if line[0] == '[':
+        columns = {}
+        # fields are split on commas only, as the sheets are written back by joining them
+        with open(samplesheet, 'r', newline='') as ssheet_open:
+            for linelist in csv.reader((line.strip() for line in ssheet_open), quoting=csv.QUOTE_NONE):
+                if not linelist or linelist[0] == '':
+                    continue
+                if linelist[0][0] == '[':
                     defaults_section = linelist[0][1:-1]
-                else:
-                    if defaults_section in ['Settings','Header']:
-                        defaults_by_section[defaults_section][linelist[0]] = linelist[1]
+                elif defaults_section in ['Settings','Header']:
+                    defaults_by_section[defaults_section][linelist[0]] = linelist[1]
 
-                    elif defaults_section == 'Reads':
-                        if defaults_by_section['Reads']['read1_length'] == None:
-                            defaults_by_section['Reads']['read1_length'] = linelist[0]
-                        elif linelist[0] != '':
-                            defaults_by_section['Reads']['read2_length'] = linelist[0]
+                elif defaults_section == 'Reads':
+                    if defaults_by_section['Reads']['read1_length'] == None:
+                        defaults_by_section['Reads']['read1_length'] = linelist[0]
+                    else:
+                        defaults_by_section['Reads']['read2_length'] = linelist[0]
 
+                elif 'Sample_ID' in linelist or 'SampleID' in linelist:
+                    # TODO: lowercase all fields?
+                    data_fields=[field.replace('SampleID','Sample_ID').replace('Index', 'index') for field in linelist if field != '']
+                    # a repeated field keeps its first position and its last value
+                    columns = {field: i for i, field in enumerate(data_fields)}
+                else:
+                    values = linelist[:len(data_fields)]
+                    if len(values) == len(data_fields):
+                        data_row = SampleRow(columns, values)
+                    else:
+                        data_row = SampleRow({field: i for i, field in enumerate(data_fields[:len(values)])}, values)
+                    if 'Lane' in data_row:
+                        name = '%s:%s' % (data_row['Lane'],data_row['Sample_ID'])
+                        lane = data_row['Lane']
                     else:
-                        if 'Sample_ID' in linelist or 'SampleID' in linelist:
-                            # TODO: lowercase all fields?
-                            data_fields=[field.replace('SampleID','Sample_ID').replace('Index', 'index') for field in linelist if field != '']
-                        else:
-                            data_dict=OrderedDict(zip(data_fields,linelist[:len(data_fields)]))
-                            if 'Lane' in list(data_dict):
-                                name = '%s:%s' % (data_dict['Lane'],data_dict['Sample_ID'])
-                                lane = data_dict['Lane']
-                            else:
-                                name = '%s:%s' % (data_dict['Sample_Project'],data_dict['Sample_ID'])
-                                lane = '1'
-                            if lane not in self.lanes:
-                                self.lanes.append(lane)
-
-                            defaults_by_section['Data'][name] = data_dict
+                        name = '%s:%s' % (data_row['Sample_Project'],data_row['Sample_ID'])
+                        lane = '1'
+                    if lane not in self.lanes:
+                        self.lanes.append(lane)
+
+                    defaults_by_section['Data'][name] = data_row
 
         for section_key in ['Settings','Header','Reads']:
             for data_key in list(defaults_by_section[section_key]):
@@ -106,19 +175,7 @@ class SampleSheet(object):
 
     def get_instrument(self):
         run = os.path.basename(os.path.dirname(self.path))
-        instrument_name = run.split('_')[1]
-        instrument = ''
-        if instrument_name.startswith('D'):
-            instrument = 'hiseq'
-        elif instrument_name.startswith('N'):
-            instrument = 'nextseq'
-        elif instrument_name.startswith('A'):
-            instrument = 'novaseq'
-        elif instrument_name.startswith('M'):
-            instrument = 'miseq'
-        else:
-            raise ValueError('Instrument %s does not match known types: D, N, A, M' % instrument_name)
-        return instrument
+        return get_instrument(run)
 
     def validate(self):
         if self.validate_sample_names() | self.validate_index2():
@@ -128,6 +185,8 @@ class SampleSheet(object):
             Path(self.path).rename(self.path + '.orig-uncorrected')
             # rename corrected to sample sheet path
             Path(corrected_sample_sheet).rename(self.path)
+        # corrections change the values indexed
+        self.indexes.clear()
 
     def validate_index2(self):
         corrected = False
@@ -226,23 +285,29 @@ class SampleSheet(object):
         else:
             return 'standard'
 
+    def get_index(self, column):
+        """
+        returns an OrderedDict of each non empty value of a Data column to
+        the keys of the samples with it, in sample sheet order
+        """
+        if column not in self.indexes:
+            index = OrderedDict()
+            for key, row in self.sections['Data'].items():
+                value = row.get(column)
+                if value:
+                    index.setdefault(value, []).append(key)
+            self.indexes[column] = index
+        return self.indexes[column]
+
     def get_sample_types(self):
         types = {}
-        for key, row in self.sections['Data'].items():
-            name = key.split(':')[1]
-            if 'Type' in row and row['Type']:
-                types[name] = row['Type']
+        for sample_type, keys in self.get_index('Type').items():
+            for key in keys:
+                types[key.split(':')[1]] = sample_type
         return types
 
     def get_sample_projects(self):
-        sp = {}
-        for key, row in self.sections['Data'].items():
-            name = key.split(':')[1]
-            if 'Sample_Project' in row and row['Sample_Project']:
-                if row['Sample_Project'] not in sp:
-                    sp[row['Sample_Project']] = []
-                sp[row['Sample_Project']].append(name)
-        return sp
+        return {project: [key.split(':')[1] for key in keys] for project, keys in self.get_index('Sample_Project').items()}
 
     def get_assay(self):
         if 'Assay' in self.sections['Header'] and self.sections['Header']['Assay']:
@@ -251,12 +316,7 @@ class SampleSheet(object):
             return None
 
     def get_submissions(self):
-        instrument = self.get_instrument()
-        subs = set()
-        for key, row in self.sections['Data'].items():
-            if row['Description']:
-                subs.add(row['Description'])
-        return list(subs)
+        return list(self.get_index('Description'))
 
     def get_projects(self):
         projects = []
@@ -0,0 +1,164 @@
+'''
+diagnose the most common undetermined barcodes of a run
+
+The top barcodes of each lane are picked from Stats.json UnknownBarcodes
+with a heap and compared with the indexes of the lane's samples.  Indexes
+are packed 2 bits a base into uint64 with a mask of N bases, so the
+mismatches between every top barcode and every sample, and against the
+reverse complement and swapped i7/i5 of each, are computed as numpy
+matrices.  Each barcode is given the most likely cause: close to a sample
+index, i5 or i7 reverse complemented, i7 and i5 swapped, index hopping
+between two samples, only one index in the sample sheet, or no index read.
+'''
+import heapq
+import operator
+from collections import OrderedDict
+import numpy
+
+TOP_N = 20
+MAX_MISMATCH = 1
+# within this many mismatches of a sample's indexes barcodes are called close
+NEAR_MISMATCH = 2
+BASES = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+COMPLEMENT = str.maketrans('ACGTN', 'TGCAN')
+EVEN_BITS = numpy.uint64(0x5555555555555555)
+POPCOUNT = numpy.array([bin(i).count('1') for i in range(256)], dtype=numpy.uint8)
+
+
+def top_barcodes(barcodes, n=TOP_N, min_count=0):
+    '''
+    return the n (barcode, count) with the highest counts above min_count,
+    highest first
+    '''
+    return [(b, c) for b, c in heapq.nlargest(n, barcodes.items(), key=operator.itemgetter(1)) if c > min_count]
+
+
+def reverse_complement(seq):
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+def encode(seqs, length):
+    '''
+    return (codes, n mask) as uint64 arrays for seqs, 2 bits a base, bases
+    past the end of a seq or other than ACGT set the even bit of the mask
+    '''
+    # 32 bases fill the uint64
+    length = min(length, 32)
+    codes = numpy.zeros(len(seqs), dtype=numpy.uint64)
+    mask = numpy.zeros(len(seqs), dtype=numpy.uint64)
+    for i, seq in enumerate(seqs):
+        code = 0
+        n = 0
+        for j in range(length):
+            base = BASES.get(seq[j], None) if j < len(seq) else None
+            if base is None:
+                n |= 1 << (2 * j)
+            else:
+                code |= base << (2 * j)
+        codes[i] = code
+        mask[i] = n
+    return codes, mask
+
+
+def mismatches(a, b):
+    '''
+    return the matrix of mismatches between each of encoded a and b
+    '''
+    x = a[0][:, None] ^ b[0][None, :]
+    diff = ((x | (x >> numpy.uint64(1))) & EVEN_BITS) | a[1][:, None] | b[1][None, :]
+    diff = numpy.ascontiguousarray(diff)
+    return POPCOUNT[diff.view(numpy.uint8)].reshape(diff.shape + (8,)).sum(axis=-1)
+
+
+def best(match, dist):
+    '''
+    return (index, mismatches) of the closest sample where match is true
+    '''
+    j = numpy.flatnonzero(match)[numpy.argmin(dist[match])]
+    return j, dist[j]
+
+
+def get_lane_samples(sample_sheet):
+    '''
+    return {lane: [(sample, index, index2)]} from a SampleSheet, lane None
+    holds samples of a sheet without lanes
+    '''
+    lanes = OrderedDict()
+    for row in sample_sheet.sections['Data'].values():
+        lane = int(row['Lane']) if row.get('Lane') else None
+        lanes.setdefault(lane, []).append((row['Sample_ID'], row.get('index', ''), row.get('index2', '')))
+    return lanes
+
+
+def diagnose(barcodes, samples):
+    '''
+    return an OrderedDict of barcode to (count, cause, sample, mismatches)
+    for the top (barcode, count), samples are (sample, index, index2)
+    '''
+    diagnosis = OrderedDict()
+    if not barcodes:
+        return diagnosis
+    splits = [b.split('+') + [''] for b, c in barcodes]
+    b7 = [s[0] for s in splits]
+    b5 = [s[1] for s in splits]
+    dual = any(b5) and all(s[2] for s in samples) if samples else False
+    if samples:
+        n7 = max(len(s) for s in b7)
+        n5 = max(len(s) for s in b5)
+        names = [s[0] for s in samples]
+        bar7 = encode(b7, n7)
+        bar5 = encode(b5, n5)
+        d77 = mismatches(bar7, encode([s[1] for s in samples], n7))
+        d77rc = mismatches(bar7, encode([reverse_complement(s[1]) for s in samples], n7))
+        if dual:
+            d55 = mismatches(bar5, encode([s[2] for s in samples], n5))
+            d55rc = mismatches(bar5, encode([reverse_complement(s[2]) for s in samples], n5))
+            d75 = mismatches(bar7, encode([s[2] for s in samples], n7))
+            d57 = mismatches(bar5, encode([s[1] for s in samples], n5))
+        else:
+            d55 = d55rc = d75 = d57 = numpy.zeros(d77.shape, dtype=d77.dtype)
+    for i, (barcode, count) in enumerate(barcodes):
+        if set(b7[i] + b5[i]) <= set('G+'):
+            diagnosis[barcode] = (count, 'no index read (poly-G)', '', None)
+            continue
+        if not samples:
+            diagnosis[barcode] = (count, 'no samples in lane', '', None)
+            continue
+        total = d77[i] + d55[i]
+        near = numpy.argmin(total)
+        i7 = numpy.flatnonzero(d77[i] <= MAX_MISMATCH)
+        i5 = numpy.flatnonzero(d55[i] <= MAX_MISMATCH)
+        rc5 = (d77[i] <= MAX_MISMATCH) & (d55rc[i] <= MAX_MISMATCH)
+        swapped = (d75[i] <= MAX_MISMATCH) & (d57[i] <= MAX_MISMATCH)
+        rc7 = (d77rc[i] <= MAX_MISMATCH) & (d55[i] <= MAX_MISMATCH)
+        if total[near] <= NEAR_MISMATCH:
+            cause, j, d = 'close to sample indexes', near, total[near]
+        elif dual and rc5.any():
+            cause, j, d = 'i5 reverse complemented', *best(rc5, d77[i] + d55rc[i])
+        elif dual and swapped.any():
+            cause, j, d = 'i7 and i5 swapped', *best(swapped, d75[i] + d57[i])
+        elif rc7.any():
+            cause, j, d = 'i7 reverse complemented', *best(rc7, d77rc[i] + d55[i])
+        elif dual and len(i7) and len(i5):
+            diagnosis[barcode] = (count, 'index hopping, i7 and i5 of different samples',
+                '%s, %s' % (names[i7[0]], names[i5[0]]), int(d77[i][i7[0]] + d55[i][i5[0]]))
+            continue
+        elif dual and len(i7):
+            cause, j, d = 'i7 of a sample, i5 not in sample sheet', i7[0], d77[i][i7[0]]
+        elif dual and len(i5):
+            cause, j, d = 'i5 of a sample, i7 not in sample sheet', i5[0], d55[i][i5[0]]
+        else:
+            cause, j, d = 'not in sample sheet', near, total[near]
+        diagnosis[barcode] = (count, cause, names[j], int(d))
+    return diagnosis
+
+
+def get_causes(diagnosis):
+    '''
+    return [(cause, barcodes, count)] ranked by count
+    '''
+    causes = OrderedDict()
+    for count, cause, sample, d in diagnosis.values():
+        barcodes, total = causes.get(cause, (0, 0))
+        causes[cause] = (barcodes + 1, total + count)
+    return sorted(((c, b, t) for c, (b, t) in causes.items()), key=operator.itemgetter(2), reverse=True)
@@ -11,22 +11,29 @@ Created on  2020-04-02
 @copyright: 2020 The Presidents and Fellows of Harvard College. All rights reserved.
 @license: GPL v2.0
 '''
-import os, glob, time, sys
+import os, sys
+import asyncio
 import logging
-import subprocess
+import shlex
 import json
 import traceback
-from time import sleep
 from datetime import datetime
-from multiprocessing import Pool
 from pathlib import Path
-from odybcl2fastq import config, initLogger, setupMainLogger
+from odybcl2fastq import config, initLogger, setupMainLogger, setupLogging
 from odybcl2fastq import constants as const
 import odybcl2fastq.util as util
 from odybcl2fastq.emailbuilder.emailbuilder import buildmessage
 from odybcl2fastq.parsers.samplesheet import SampleSheet
-from odybcl2fastq.parsers.makebasemask import extract_basemasks
+from odybcl2fastq.parsers.makebasemask import get_basemasks
+from odybcl2fastq.parsers import metadata_cache
 from odybcl2fastq.status_db import StatusDB
+from odybcl2fastq.run_discovery import RunDiscovery
+from odybcl2fastq.run_state import RunStateDB
+from odybcl2fastq.supervisor import SnakemakeSupervisor, read_limit
+from odybcl2fastq.run_scheduler import RunScheduler
+from odybcl2fastq.cluster import AdmissionController
+from odybcl2fastq import job_status
+from odybcl2fastq import run_plan
 
 STATUS_DIR = 'status_test' if config.TEST else 'status'
 PROCESSED_FILE_NAME = 'ody.processed'
@@ -34,6 +41,7 @@ PROCESSED_FILE = '%s/%s' % (STATUS_DIR, PROCESSED_FILE_NAME)
 COMPLETE_FILE_NAME = 'ody.complete'
 COMPLETE_FILE = '%s/%s' % (STATUS_DIR, COMPLETE_FILE_NAME)
 SKIP_FILE = 'odybcl2fastq.skip'
+LEGACY_PROCESSED_FILE = 'odybcl2fastq.processed'
 INCOMPLETE_NOTIFIED_FILE = '%s/ody.incomplete_notified' % STATUS_DIR
 DAYS_TO_SEARCH = 3
 INCOMPLETE_AFTER_DAYS = 4
@@ -43,16 +51,28 @@ SEARCH_AFTER_DATE = datetime.strptime('Aug 10 2019', '%b %d %Y')
 REQUIRED_FILES = ['InterOp/QMetricsOut.bin', 'InterOp/TileMetricsOut.bin', 'RunInfo.xml', 'RTAComplete.txt']
 TYPES_10X = ['10x single cell', '10x single cell rna', '10x single nuclei rna', '10x single cell vdj', '10x single cell atac']
 PROC_NUM = int(os.getenv('ODYBCL2FASTQ_PROC_NUM', 7))
+PROC_NUM_FILE = os.getenv('ODYBCL2FASTQ_PROC_NUM_FILE', '/sequencing/log/odybcl2fastq.proc_num')
 FREQUENCY = 60
+# seconds to wait for new runs between checks on the queued runs
+CHECK_FREQUENCY = 10
+SOURCE_DIR = '/sequencing/source/'
+# submit the count jobs of a 10x run as one slurm array job
+COUNT_ARRAY = os.getenv('ODYBCL2FASTQ_COUNT_ARRAY', 'TRUE') == 'TRUE'
+# run checksum, fastqc and multiqc in one right-sized slurm job
+POST_DEMUX_BUNDLE = os.getenv('ODYBCL2FASTQ_POST_DEMUX_BUNDLE', 'FALSE') == 'TRUE'
 
 logger = setupMainLogger()
+discovery = None
+run_state = None
 
-def failure_email(run, log, cmd, ret_code, std_out, std_err = ''):
+def failure_email(run, log, cmd, ret_code, std_out, std_err = '', errors = ''):
     subject = "Run Failed: %s" % run
     message = (
         "%s\ncmd: %s\nreturn code: %i\nstandard out: %s\nstandard"
         " error: %s\nsee log: %s\n" % (subject, cmd, ret_code, std_out, std_err, log)
     )
+    if errors:
+        message += "last error lines:\n%s\n" % errors
     send_email(message, subject)
 
 def send_email(message, subject, to = 'to_email_error'):
@@ -69,15 +89,16 @@ def need_to_process(dir):
     # filter out if modified outside or search window
     if ((now - m_time).days) > DAYS_TO_SEARCH:
         return False
+    state = get_run_state()
     # filter out if tagged as processed
-    if os.path.isfile(dir + PROCESSED_FILE):
+    if state.marker_exists(dir, PROCESSED_FILE):
         return False
     # filter out if tagged as old non 10x processed
     # TODO: remove this after these old runs are no longer around
-    if os.path.isfile(dir + 'odybcl2fastq.processed'):
+    if state.marker_exists(dir, LEGACY_PROCESSED_FILE):
         return False
     # filter out if tagged as skip
-    if os.path.isfile(dir + SKIP_FILE):
+    if state.marker_exists(dir, SKIP_FILE):
         return False
     # filter out if any required files are missing
     for req in REQUIRED_FILES:
@@ -94,25 +115,34 @@ def run_is_incomplete(dir):
     # filter out if modified after reasonable delay to allow for completion
     if ((now - m_time).days) <= INCOMPLETE_AFTER_DAYS:
         return False
+    state = get_run_state()
     # filter out if tagged as complete
-    if os.path.isfile(dir + COMPLETE_FILE):
+    if state.marker_exists(dir, COMPLETE_FILE):
         return False
     # filter out if never tagged for processing
-    if not os.path.isfile(dir + PROCESSED_FILE):
+    if not state.marker_exists(dir, PROCESSED_FILE):
         return False
     # filter out already notified
-    if os.path.isfile(dir + INCOMPLETE_NOTIFIED_FILE):
+    if state.marker_exists(dir, INCOMPLETE_NOTIFIED_FILE):
         return False
     return True
 
+def get_discovery():
+    global discovery
+    if discovery is None:
+        discovery = RunDiscovery(SOURCE_DIR)
+    return discovery
+
+def get_run_state():
+    global run_state
+    if run_state is None:
+        run_state = RunStateDB(status_dir=STATUS_DIR)
+    return run_state
+
 def find_runs(filter):
-    # get all subdirectories
-    dirs = sorted(glob.glob('/sequencing/source/*/'))
-    runs = []
-    for dir in dirs:
-        if filter(dir):
-            runs.append(dir)
-    return runs
+    # run dirs in the source dir that pass filter, dirs already rejected are
+    # only checked again if they have changed
+    return get_discovery().find(filter)
 
 def check_sample_sheet(sample_sheet, run):
     # if sample sheet is not already there then copy the one from run_folder named
@@ -131,15 +161,12 @@ def get_sample_sheet_path(run_dir):
         return os.path.join(run_dir, "SampleSheet.csv") # default
 
 def check_complete(run_dir):
-    complete_file_path = Path(run_dir, COMPLETE_FILE)
-    if not complete_file_path.exists():
-        sub_dirs = next(os.walk('%s%s' % (run_dir, STATUS_DIR)))[1]
-        complete = True
-        for sub_dir in sub_dirs:
-            if not os.path.exists('%s%s/%s/%s' % (run_dir, STATUS_DIR, sub_dir, COMPLETE_FILE_NAME)):
-                complete = False
-        if complete:
-            complete_file_path.touch()
+    state = get_run_state()
+    # pick up the markers written by the snakemake workflow
+    state.import_markers(run_dir)
+    run = Path(run_dir).name
+    if not state.has(run, 'complete') and state.all_masks_complete(run):
+        state.touch_marker(run_dir, COMPLETE_FILE)
 
 def get_custom_suffix(sample_sheet_path):
     suffix = ''
@@ -219,7 +246,22 @@ def get_10x_snakemake_config(run_dir, run_type, sample_sheet, run, suffix):
     gtf = ''
     if not run_type == '10x single cell vdj':
         ref_file, gtf = get_reference(run_dir, run_type, sample_sheet)
-    return {'run': run, 'ref': ref_file, 'gtf': gtf, 'atac': atac, 'suffix': suffix}
+    return {'run': run, 'ref': ref_file, 'gtf': gtf, 'atac': atac, 'suffix': suffix, 'count_array': int(COUNT_ARRAY)}
+
+def compile_run_plan(run, run_type, suffix, mask_suffix):
+    # compile what the snakefiles need once rather than in every slurm job
+    workflow = run_plan.TENX if run_type in TYPES_10X else run_plan.NON_10X
+    status_dir = STATUS_DIR + ('/' + mask_suffix if mask_suffix else '')
+    path = run_plan.get_plan_path(run, status_dir, suffix)
+    try:
+        plan = run_plan.compile_plan(workflow, run, suffix, mask_suffix, status_dir)
+        run_plan.write_plan(plan, path)
+        logger.info('Run plan for %s%s: %s' % (run, suffix, path))
+    except Exception as e:
+        # the snakefile compiles it again and the run fails as it would have without a plan
+        logger.warning('Could not compile run plan for %s%s: %s' % (run, suffix, e))
+        if os.path.exists(path):
+            os.remove(path)
 
 def get_ody_snakemake_opts(run_dir, ss_path, run_type, suffix, mask_suffix):
     run = Path(run_dir).name
@@ -233,26 +275,29 @@ def get_ody_snakemake_opts(run_dir, ss_path, run_type, suffix, mask_suffix):
         snakefile = 'non_10x.snakefile'
 
     snakemake_config['analysis_dir'] = config.ANALYSIS_DIR
+    snakemake_config['post_demux_bundle'] = int(POST_DEMUX_BUNDLE)
+    compile_run_plan(run, run_type, suffix, mask_suffix)
 
     opts = {
         '--cores': 99,
         '--local-cores': 4,
         '--max-jobs-per-second': 2,
-        '--config': ' '.join(['%s=%s' % (k, v) for k, v in snakemake_config.items()]),
+        '--config': ['%s=%s' % (k, v) for k, v in snakemake_config.items()],
         '--profile': '/app/odybcl2fastq/profiles/rc_slurm',
         '--printshellcmds': None,
         '--reason': None,
         '-s': '/app/odybcl2fastq/%s' % snakefile,
         '--directory': '/sequencing/snakemake/'
     }
-    return [k + ((' %s' % v) if v else '') for k, v in opts.items()]
-
-def run_snakemake(cmd, output_log):
-    # run unix cmd, stream out and error, return last lines of out
-    with open(output_log, 'a+') as writer:
-        proc = subprocess.run(cmd, shell=True, stderr=writer, stdout=writer)
-    lines = subprocess.run(["tail", "-n", "40", output_log], stdout=subprocess.PIPE).stdout
-    return proc.returncode, lines.decode()
+    # argument list for exec, each config item is its own argument
+    argv = []
+    for k, v in opts.items():
+        argv.append(k)
+        if isinstance(v, list):
+            argv.extend(v)
+        elif v is not None:
+            argv.append(str(v))
+    return argv
 
 def notify_incomplete_runs():
     run_dirs = find_runs(run_is_incomplete)
@@ -261,7 +306,7 @@ def notify_incomplete_runs():
         message = "The following runs failed to complete %s or more days ago:\n\n%s" % (INCOMPLETE_AFTER_DAYS, run_dirs_str)
         send_email(message, 'Odybcl2fastq incomplete runs')
         for run in run_dirs:
-            Path(run, INCOMPLETE_NOTIFIED_FILE).touch()
+            get_run_state().touch_marker(run, INCOMPLETE_NOTIFIED_FILE)
 
 
 def get_runs():
@@ -277,132 +322,177 @@ def get_runs():
             run = Path(run_dir).name
             # copy samplesheet from samplesheet folder if necessary
             check_sample_sheet(ss_path, run)
-            sample_sheet = SampleSheet(ss_path)
+            # parsed metadata is cached until the files change
+            sample_sheet = metadata_cache.get_sample_sheet(ss_path)
             instrument = sample_sheet.get_instrument()
             sam_types = sample_sheet.get_sample_types()
             run_info_file = run_dir + '/RunInfo.xml'
+            cost = metadata_cache.get_run_cost(run_info_file)
             # create a list of runs with their type
             for t, v in sam_types.items():
                 mask_suffix = ''
+                info = {'type': v, 'custom_suffix': custom_suffix, 'instrument': instrument, 'cost': cost}
                 if v not in TYPES_10X: #non 10x
                     # get some information about the run
                     # consider if multiple indexing strategies are needed
                     # meaning it will be run more than once
-                    mask_lists, mask_samples = extract_basemasks(sample_sheet.sections['Data'], run_info_file, instrument, v, False)
+                    mask_lists, mask_samples = get_basemasks(ss_path, run_info_file, instrument, v)
                     jobs_tot = len(mask_lists)
                     if jobs_tot > 1:
                         for mask, mask_list in mask_lists.items():
                             mask_suffix = mask.replace(',', '_')
-                            mask_status_processed_file_path = Path(run_dir, STATUS_DIR, mask_suffix, PROCESSED_FILE_NAME)
+                            mask_status_processed_file = os.path.join(STATUS_DIR, mask_suffix, PROCESSED_FILE_NAME)
                             # only start the run if the processed file for that mask
                             # is not present, this will enable restart of one mask
-                            if not mask_status_processed_file_path.is_file():
-                                run_dirs.append({'run':run_dir, 'type':v, 'mask_suffix': mask_suffix, 'custom_suffix': custom_suffix})
-                                mask_status_processed_file_path.touch()
+                            if not get_run_state().marker_exists(run_dir, mask_status_processed_file):
+                                run_dirs.append(dict(info, run=run_dir, mask_suffix=mask_suffix))
+                                get_run_state().touch_marker(run_dir, mask_status_processed_file)
                     else:
-                        run_dirs.append({'run':run_dir, 'type':v, 'mask_suffix': mask_suffix, 'custom_suffix': custom_suffix})
+                        run_dirs.append(dict(info, run=run_dir, mask_suffix=mask_suffix))
                 else:
-                    run_dirs.append({'run':run_dir, 'type':v, 'mask_suffix': mask_suffix, 'custom_suffix': custom_suffix})
+                    run_dirs.append(dict(info, run=run_dir, mask_suffix=mask_suffix))
                 break
         except:
             traceback.print_exc()
+    logger.debug('Metadata cache: %s' % json.dumps(metadata_cache.cache.stats()))
     return run_dirs
 
-def process_runs(pool):
+def get_proc_num():
+    # the number of concurrent runs can be changed while runs are in progress
+    # by writing a number to PROC_NUM_FILE
+    return read_limit(PROC_NUM_FILE, PROC_NUM)
+
+def get_wake_fd():
+    # wake up early for new runs when the source dir is watched with inotify
+    inotify = get_discovery().inotify
+    return inotify.fileno() if inotify else None
+
+def launch_run(supervisor, run_info, admission=None):
+    run_type = run_info['type']
+    run_dir = run_info['run']
+    mask_suffix = run_info['mask_suffix']
+    custom_suffix = run_info['custom_suffix']
+    ss_path = get_sample_sheet_path(run_dir)
+    suffix = get_run_suffix(custom_suffix, mask_suffix)
+    run = Path(run_dir).name + suffix
+    opts = get_ody_snakemake_opts(run_dir, ss_path, run_type, suffix, mask_suffix)
+    logger.info("Queueing odybcl2fastq cmd for %s:\n" % (run))
+    run_log = str(Path('/sequencing/log/', run).with_suffix('.log'))
+    argv = ['snakemake'] + opts
+    cmd = ' '.join(shlex.quote(a) for a in argv)
+    msg = "Running cmd: %s\n" % cmd
+    logger.info(msg)
+    runlogger = initLogger(run, run + '.log')
+    runlogger.info(msg)
+    if admission:
+        admission_msg = 'Admission for %s: %s' % (run, json.dumps(admission))
+        logger.info(admission_msg)
+        runlogger.info(admission_msg)
+    # touch processed file so errors in snakemake don't cause the run to
+    # continually be queued, this creates the status dir if needed
+    get_run_state().touch_marker(run_dir, PROCESSED_FILE)
+    supervisor.launch(run, argv, run_log)
+    return {'run_dir': run_dir, 'cmd': cmd, 'log': run_log, 'admission': admission}
+
+def get_run_name(run_info):
+    return Path(run_info['run']).name + get_run_suffix(run_info['custom_suffix'], run_info['mask_suffix'])
+
+def schedule_runs(scheduler, run_dirs):
+    # queue per instrument, with 10x runs in their own queue
+    for run_info in run_dirs:
+        queue = run_info['instrument'] + ('_10x' if run_info['type'] in TYPES_10X else '')
+        scheduler.add(get_run_name(run_info), run_info, queue, run_info['cost'])
+
+async def process_runs(supervisor):
     '''
-    Fills up the pool with runs with apply_async
-    If anything is ready, result is placed in success_runs or failed_runs
+    Launches runs as the supervisor has capacity
+    When a run exits, result is placed in success_runs or failed_runs
     Then looks for more runs
     '''
     logger.info("Processing runs")
-    run_dirs = get_runs()
-    logger.info("Found %s runs: %s\n" % (len(run_dirs), json.dumps(run_dirs)))
+    scheduler = RunScheduler()
+    admission = AdmissionController()
+    schedule_runs(scheduler, get_runs())
+    logger.info("Found %s runs: %s\n" % (len(scheduler), json.dumps(scheduler.names())))
 
-    results = {}
     failed_runs = []
     success_runs = []
     queued_runs = {}
-    while len(run_dirs) > 0 or len(results) > 0:
-        logger.info("Current runs found %s Runs pending results: %s Runs queued: %s\n" % (json.dumps(run_dirs), json.dumps(list(results.keys())),
+    while len(scheduler) > 0 or len(supervisor.running) > 0:
+        logger.info("Current runs found %s Runs pending results: %s Runs queued: %s\n" % (json.dumps(scheduler.names()), json.dumps(list(supervisor.running.keys())),
                     json.dumps(list(queued_runs.keys()))))
-        while len(run_dirs) > 0:
-            run_info = run_dirs.pop()
-            run_type = run_info['type']
-            run_dir = run_info['run']
-            mask_suffix = run_info['mask_suffix']
-            custom_suffix = run_info['custom_suffix']
-            ss_path = get_sample_sheet_path(run_dir)
-            suffix = get_run_suffix(custom_suffix, mask_suffix)
-            run = Path(run_dir).name + suffix
-            opts = get_ody_snakemake_opts(run_dir, ss_path, run_type, suffix, mask_suffix)
-            logger.info("Queueing odybcl2fastq cmd for %s:\n" % (run))
-            run_log = str(Path('/sequencing/log/', run).with_suffix('.log'))
-            cmd = 'snakemake ' + ' '.join(opts)
-            msg = "Running cmd: %s\n" % cmd
-            logger.info(msg)
-            runlogger = initLogger(run, run + '.log')
-            runlogger.info(msg)
-            # create status dir if it doesn't exist
-            status_path = '%s%s' % (run_dir, STATUS_DIR)
-            if not os.path.exists(status_path):
-                os.mkdir(status_path)
-            # touch processed file so errors in snakemake don't cause the run to
-            # continually be queued
-            Path(run_dir, PROCESSED_FILE).touch()
-            results[run] = pool.apply_async(run_snakemake, (cmd, run_log,))
-            queued_runs[run] = 1
-        for run in list(results.keys()):
-            result = results[run]
-            if result.ready():
-                # 5 day timeout
-                timeout = (5 * 24 * 60 * 60)
-                ret_code, lines = result.get(timeout)
-                if ret_code == 0:
-                    success_runs.append(run)
-                    status = 'success'
-                    check_complete(run_dir)
-                else:
-                    failed_runs.append(run)
-                    status = 'failure'
-                    failure_email(run, run_log, cmd, ret_code, lines)
-                    logging.info('Run failed: %s with code %s\n %s\n %s' % (run, str(ret_code), cmd, lines))
-                del results[run]
-                del queued_runs[run]
+        logger.info("Run queues: %s\n" % json.dumps(scheduler.snapshot()))
+        supervisor.set_limit(get_proc_num())
+        while len(scheduler) > 0 and supervisor.has_capacity():
+            # leave runs queued while the cluster is busy
+            if not admission.has_room():
+                admission.hold(scheduler.names())
+                break
+            run_info = scheduler.pop()
+            name = get_run_name(run_info)
+            queued_runs[name] = launch_run(supervisor, run_info, admission.admit(name))
+        # wait for a run to exit, a run dir to change or the check frequency
+        for run, ret_code, tail in await supervisor.wait(CHECK_FREQUENCY, get_wake_fd()):
+            queued = queued_runs.pop(run)
+            # jobs of the finished run have left the queue, sample again
+            admission.invalidate()
+            if ret_code == 0:
+                success_runs.append(run)
+                status = 'success'
+                check_complete(queued['run_dir'])
+            else:
+                failed_runs.append(run)
+                status = 'failure'
+                lines = tail.tail()
+                failure_email(run, queued['log'], queued['cmd'], ret_code, lines, errors=tail.grep())
+                logging.info('Run failed: %s with code %s\n %s\n %s' % (run, str(ret_code), queued['cmd'], lines))
 
         logger.info("After checking results, runs found %s Runs pending results: %s Runs queued: %s\n"
-                % (json.dumps(run_dirs), json.dumps(list(results.keys())),
+                % (json.dumps(scheduler.names()), json.dumps(list(supervisor.running.keys())),
                     json.dumps(list(queued_runs.keys()))))
-        sleep(10)
-        new_run_dirs = get_runs()
-        for new_run_dir in new_run_dirs:
-            new_run = Path(new_run_dir['run']).name
-            if new_run not in queued_runs:
-                run_dirs.append(new_run_dir)
-        if len(run_dirs) > 0:
-            logger.info("Found %s more runs: %s\n" % (len(run_dirs),
-                json.dumps(run_dirs)))
+        new_run_dirs = [r for r in get_runs() if get_run_name(r) not in queued_runs]
+        before = len(scheduler)
+        schedule_runs(scheduler, new_run_dirs)
+        if len(scheduler) > before:
+            logger.info("Found %s more runs: %s\n" % (len(scheduler) - before,
+                json.dumps(scheduler.names())))
     logger.info(
         "Completed %s runs: %s success %s and %s failures %s\n\n\n" %
         ((len(success_runs) + len(failed_runs)), len(success_runs), json.dumps(success_runs), len(failed_runs), json.dumps(failed_runs))
     )
 
+async def refresh_job_status():
+    # keep the slurm job states read by the cluster-status script current
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, job_status.refresh)
+        except Exception as e:
+            logger.warning('Could not refresh slurm job states: %s' % e)
+        await asyncio.sleep(job_status.REFRESH_SECONDS)
+
+async def supervise():
+    supervisor = SnakemakeSupervisor(get_proc_num())
+    asyncio.ensure_future(refresh_job_status())
+    # run continuously
+    while True:
+        # queue new runs for demultiplexing with bcl2fastq2
+        await process_runs(supervisor)
+        # check for any runs that started but never completed demultiplexing
+        notify_incomplete_runs()
+        # wait before checking for more runs to process
+        frequency = int(os.getenv('ODYBCL2FASTQ_FREQUENCY', FREQUENCY))
+        if frequency != FREQUENCY:
+            logger.info("Frequency is not default: %i\n" % frequency)
+        await supervisor.wait(frequency, get_wake_fd())
+
 def main():
     try:
+        setupLogging()
+        config.validate()
         logger.info("Starting ody10x processing")
         logger.info("Running with ")
-        proc_num = PROC_NUM
-        pool = Pool(proc_num)
-        # run continuously
-        while True:
-            # queue new runs for demultiplexing with bcl2fastq2
-            process_runs(pool)
-            # check for any runs that started but never completed demultiplexing
-            notify_incomplete_runs()
-            # wait before checking for more runs to process
-            frequency = os.getenv('ODYBCL2FASTQ_FREQUENCY', FREQUENCY)
-            if frequency != FREQUENCY:
-                logger.info("Frequency is not default: %i\n" % frequency)
-            time.sleep(frequency)
+        asyncio.run(supervise())
     except Exception as e:
         logging.exception(e)
         #send_email(str(e), 'Odybcl2fastq exception')
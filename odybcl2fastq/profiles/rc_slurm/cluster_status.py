@@ -3,22 +3,43 @@
 Take from snakemake documentation
 https://snakemake.readthedocs.io/en/stable/tutorial/additional_features.html#using-cluster-status
 
+Job states are read from the shared cache in odybcl2fastq.job_status, sacct
+is only called for a job whose cached state is stale.  Once a job has
+finished its resource use is recorded in odybcl2fastq.job_history and a job
+that ran out of memory or time is resubmitted with more, snakemake keeps
+asking about the first job id and is answered for the latest.  The history db
+is not opened while a job is running.
 '''
 import sys
-import subprocess
+from odybcl2fastq.job_status import JobStatusCache, get_status
+from odybcl2fastq.job_history import JobHistory
+
 if len(sys.argv) < 5:
     print("failed")
 else:
-    jobid = sys.argv[4]
-
-    cmd = "sacct -j %s --format State --noheader | head -1 | awk '{print $1}'" % jobid
-    output = str(subprocess.check_output(cmd, shell=True).strip())
-
-    running_status=["PENDING", "CONFIGURING", "COMPLETING", "RUNNING", "SUSPENDED"]
-    failed_status=["FAILED", "OUT_OF_MEMORY", "TIMEOUT", "CANCELLED", "BOOT_FAIL", "DEADLINE", "NODE_FAIL", "PREEMPTED"]
-    if "COMPLETED" in output:
-        print("success")
-    elif any(r in output for r in failed_status):
-        print("failed")
-    else:
-        print("running")
+    cache = JobStatusCache()
+    jobid = cache.current(sys.argv[4])
+    state = cache.state(jobid)
+    status = get_status(state)
+    if status != 'running':
+        history = JobHistory()
+        tasks = cache.tasks(jobid)
+        history.collect(jobid, state, tasks)
+        new_jobid = None
+        if status == 'failed':
+            try:
+                new_jobid = history.resubmit(jobid, state, tasks)
+            except Exception as e:
+                sys.stderr.write('Could not resubmit job %s: %s\n' % (jobid, e))
+        history.close()
+        if new_jobid:
+            cache.retried(jobid, new_jobid)
+            sys.stderr.write('Job %s ended %s, resubmitted as %s\n' % (jobid, state, new_jobid))
+            status = 'running'
+        elif status == 'failed':
+            # name the tasks of an array job that failed in the snakemake log
+            failed = ['%s %s' % t for t in tasks if get_status(t[1]) == 'failed']
+            if failed:
+                sys.stderr.write('Failed tasks of job %s: %s\n' % (jobid, ', '.join(failed)))
+    print(status)
+    cache.close()
@@ -15,6 +15,22 @@ import shutil
 from collections import OrderedDict
 
 from snakemake.utils import read_job_properties
+from odybcl2fastq.job_status import JobStatusCache
+from odybcl2fastq.job_history import JobHistory, get_job_size, get_run, sbatch, DEMUX_RULES
+from odybcl2fastq.resources import get_sbatch_opts, get_run_size
+
+# an array task runs line SLURM_ARRAY_TASK_ID + 1 of the index, a script and
+# the marker to touch when the script succeeds, a script whose marker exists
+# finished before a rerun and is skipped, the task that finds every marker
+# touches the job's output
+ARRAY_TASK = '''IFS=$'\\t' read -r script output <<< "$(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" {index})"
+if [ ! -e "$output" ]; then
+    singularity exec "$SINGULARITY_CONTAINER" bash -c "$script && touch $output" || exit $?
+fi
+if cut -f 2 {index} | xargs ls > /dev/null 2>&1; then
+    touch {done}
+fi
+'''
 
 jobscript = sys.argv[1]
 job_props = read_job_properties(jobscript)
@@ -22,27 +38,78 @@ job_props = read_job_properties(jobscript)
 # uncomment out to write jobscript to script folder
 #shutil.copyfile(jobscript, (job_props['input'][0] + '_jobscript'))
 
-# the input file is a bash script to submit to slurm, read cmd in
-with open(job_props['input'][0], 'r') as fh:
-    cmd = fh.readlines()
+# rules with an array-limit are submitted as an array job with a task for
+# each input script, at most array-limit of them running at once
+cluster = dict(job_props['cluster'])
+array_limit = cluster.pop('array-limit', None)
+
+rule = job_props['rule']
+analysis_dir = cluster.get('chdir', '')
+tasks = len(job_props['input']) if array_limit is not None else 0
+if tasks:
+    cluster['array'] = '0-%i%%%s' % (tasks - 1, array_limit)
+
+# the fastq dir is on nfs, walk it once for both the profile and the history
+run_size = get_run_size(analysis_dir) if rule not in DEMUX_RULES else None
+
+# size the post-demux steps from the fastq of the run rather than taking a
+# whole node
+sized = get_sbatch_opts(rule, analysis_dir, run_size)
+if sized:
+    cluster.pop('exclusive', None)
+    cluster.update(sized)
+
+# size from earlier jobs of the rule once there are enough of them
+history = JobHistory()
+instrument, size = get_job_size(rule, analysis_dir, run_size)
+predicted = history.predict(rule, instrument, size / tasks if tasks else size)
+if predicted:
+    cluster.pop('exclusive', None)
+    cluster.update(predicted)
 
 prefix = []
-cli_opts = []
 # get slurm opts as a prefix for cmd
-for prop, val in job_props['cluster'].items():
+for prop, val in cluster.items():
     sbatch_val = ''
     if val != '':
         sbatch_val = '=%s' % val
     prefix.append('#SBATCH --%s%s\n' % (prop, sbatch_val))
-    cli_opts.append('--%s%s' % (prop, sbatch_val))
 
-# write new prefixed cmd to the file
-new_cmd = [cmd[0]] + prefix + cmd[1:]
-with open(job_props['input'][0], 'w') as fh:
-    for l in new_cmd:
-        fh.write(l)
+if not tasks:
+    # the input file is a bash script to submit to slurm, read cmd in
+    with open(job_props['input'][0], 'r') as fh:
+        cmd = fh.readlines()
 
+    # write new prefixed cmd to the file
+    new_cmd = [cmd[0]] + prefix + cmd[1:]
+    with open(job_props['input'][0], 'w') as fh:
+        for l in new_cmd:
+            fh.write(l)
+    script = jobscript
+else:
+    script_dir = os.path.dirname(job_props['input'][0])
+    index = os.path.join(script_dir, '%s.index' % job_props['rule'])
+    with open(index, 'w') as fh:
+        # the markers of the tasks are params of the rule, its output is touched once they all exist
+        markers = job_props['params'].get('markers', job_props['output'])
+        for task_script, output in zip(job_props['input'], markers):
+            fh.write('%s\t%s\n' % (task_script, output))
+    script = os.path.join(script_dir, '%s_array.sh' % job_props['rule'])
+    with open(script, 'w') as fh:
+        fh.write('#!/bin/bash\n')
+        for l in prefix:
+            fh.write(l)
+        fh.write(ARRAY_TASK.format(index=index, done=job_props['output'][0]))
 
-cli_opt_str = ' '.join(cli_opts)
 
-os.system("sbatch {cli_opts} {script}".format(cli_opts=cli_opt_str, script=jobscript))
+jobid = sbatch(script, cluster)
+# snakemake reads the job id from "Submitted batch job <jobid>"
+print('Submitted batch job %s' % jobid)
+# track the job in the status cache so it is refreshed with the others and
+# in the history so it can be resubmitted and its resource use recorded
+cache = JobStatusCache()
+cache.submitted(jobid)
+cache.close()
+err_path = os.path.join(analysis_dir, cluster.get('error', 'slurm-%j.out'))
+history.submitted(jobid, rule, get_run(analysis_dir), instrument, size, script, cluster, err_path, tasks)
+history.close()
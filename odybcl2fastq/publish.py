@@ -0,0 +1,120 @@
+'''
+publish an analysis dir by hard-linking it into the published dir
+
+The analysis tree is compared with what is already published, directory by
+directory across a thread pool: a file already linked to the same inode is
+left alone, new or changed files and symlinks are created under a temporary
+name and renamed over the old entry, and entries no longer in the analysis
+dir are removed.  Published files are made read-only, which is only done for
+files that aren't already.  A run published for the first time is built in a
+staging dir that is renamed into place when complete, a run published again
+is updated in place one rename at a time so users never see a partial or
+empty dir, and the work is proportional to what changed.
+'''
+import os
+import stat
+import shutil
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+WORKERS = int(os.getenv('ODYBCL2FASTQ_PUBLISH_WORKERS', 16))
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+TMP_PREFIX = '.publish-'
+STAGING_SUFFIX = '.publishing'
+
+
+def remove(entry):
+    if entry.is_dir(follow_symlinks=False):
+        shutil.rmtree(entry.path)
+    else:
+        os.unlink(entry.path)
+
+
+def replace(dst_dir, name, existing, create):
+    '''
+    create dst_dir/name by calling create with a temporary path that is then
+    renamed over any existing file
+    '''
+    path = os.path.join(dst_dir, name)
+    if existing is not None and existing.is_dir(follow_symlinks=False):
+        shutil.rmtree(existing.path)
+    tmp = os.path.join(dst_dir, TMP_PREFIX + name)
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+    create(tmp)
+    os.rename(tmp, path)
+
+
+def sync_dir(src_dir, dst_dir):
+    '''
+    make dst_dir match src_dir, returns the (src, dst) subdirs still to be
+    synced and a Counter of what was done
+    '''
+    counts = Counter()
+    subdirs = []
+    existing = {e.name: e for e in os.scandir(dst_dir)}
+    for entry in os.scandir(src_dir):
+        dst_entry = existing.pop(entry.name, None)
+        dst_path = os.path.join(dst_dir, entry.name)
+        if entry.is_symlink():
+            target = os.readlink(entry.path)
+            if dst_entry is not None and dst_entry.is_symlink() and os.readlink(dst_entry.path) == target:
+                counts['unchanged'] += 1
+            else:
+                replace(dst_dir, entry.name, dst_entry, lambda tmp: os.symlink(target, tmp))
+                counts['linked'] += 1
+        elif entry.is_dir():
+            if dst_entry is not None and not dst_entry.is_dir(follow_symlinks=False):
+                os.unlink(dst_entry.path)
+                dst_entry = None
+            mode = stat.S_IMODE(entry.stat().st_mode)
+            if dst_entry is None:
+                os.mkdir(dst_path)
+                counts['dirs'] += 1
+            if dst_entry is None or stat.S_IMODE(dst_entry.stat().st_mode) != mode:
+                os.chmod(dst_path, mode)
+            subdirs.append((entry.path, dst_path))
+        else:
+            if dst_entry is not None and dst_entry.is_file(follow_symlinks=False) and dst_entry.inode() == entry.inode():
+                counts['unchanged'] += 1
+            else:
+                replace(dst_dir, entry.name, dst_entry, lambda tmp: os.link(entry.path, tmp, follow_symlinks=False))
+                counts['linked'] += 1
+            # the link shares the mode of the analysis file
+            if stat.S_IMODE(entry.stat().st_mode) != READ_ONLY:
+                os.chmod(entry.path, READ_ONLY)
+                counts['chmod'] += 1
+    for dst_entry in existing.values():
+        remove(dst_entry)
+        counts['removed'] += 1
+    return subdirs, counts
+
+
+def publish_tree(src, dst, workers=WORKERS):
+    '''
+    hard-link the tree at src to dst read-only, returns a Counter of the
+    entries linked, removed, chmod-ed and unchanged
+    '''
+    src = os.path.normpath(src)
+    dst = os.path.normpath(dst)
+    target = dst
+    if not os.path.isdir(dst):
+        target = dst + STAGING_SUFFIX
+        # left by an earlier publish that failed
+        shutil.rmtree(target, ignore_errors=True)
+        os.mkdir(target)
+    os.chmod(target, stat.S_IMODE(os.stat(src).st_mode))
+    counts = Counter()
+    with ThreadPoolExecutor(workers) as pool:
+        pending = {pool.submit(sync_dir, src, target)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, dir_counts = future.result()
+                counts.update(dir_counts)
+                pending.update(pool.submit(sync_dir, s, d) for s, d in subdirs)
+    if target != dst:
+        os.rename(target, dst)
+    logging.info('Published %s to %s: %s' % (src, dst, dict(counts)))
+    return counts
@@ -0,0 +1,98 @@
+'''
+slurm resources for the post-demultiplex steps sized from the run
+
+checksum and fastqc get cpus in proportion to the bytes of fastq written by
+demultiplexing (no more than there are fastq files to work on), memory for
+those cpus and a walltime from the expected throughput per cpu.  multiqc is
+sized by the number of samples.  The post_demux rule runs all three in one
+allocation: checksum and fastqc side by side on their own share of the cpus,
+then multiqc.  Profiles can be changed with ODYBCL2FASTQ_RESOURCE_PROFILES,
+a json object of {"<rule>": {"<field>": value}}.
+'''
+import os
+import re
+import json
+import math
+
+DEFAULT_PROFILES = {
+    'checksum': {'min_cpus': 2, 'max_cpus': 16, 'gb_per_cpu': 20, 'mem_gb': 2, 'mem_gb_per_cpu': 0.25,
+        'minutes': 15, 'minutes_per_gb': 0.25, 'minutes_per_sample': 0},
+    'fastqc': {'min_cpus': 2, 'max_cpus': 32, 'gb_per_cpu': 5, 'mem_gb': 2, 'mem_gb_per_cpu': 0.5,
+        'minutes': 30, 'minutes_per_gb': 0.4, 'minutes_per_sample': 0},
+    'multiqc': {'min_cpus': 1, 'max_cpus': 1, 'gb_per_cpu': 0, 'mem_gb': 4, 'mem_gb_per_cpu': 0,
+        'minutes': 15, 'minutes_per_gb': 0, 'minutes_per_sample': 0.1}
+}
+PROFILES = json.loads(os.getenv('ODYBCL2FASTQ_RESOURCE_PROFILES', '{}'))
+# walltime is the expected time times this, capped at MAX_MINUTES
+TIME_FACTOR = 3
+MAX_MINUTES = (4 * 24 + 12) * 60
+BUNDLE_RULE = 'post_demux'
+GB = 1024 ** 3
+FASTQ_NAME = re.compile(r'^(?P<sample>.+)_S\d+_(L\d{3}_)?[RI]\d_001\.fastq\.gz$')
+
+
+def get_profile(rule):
+    profile = dict(DEFAULT_PROFILES[rule])
+    profile.update(PROFILES.get(rule, {}))
+    return profile
+
+
+def get_run_size(analysis_dir):
+    '''
+    return (bytes, files, samples) for the fastq written to analysis_dir
+    '''
+    size = 0
+    files = 0
+    samples = set()
+    for root, dirs, names in os.walk(os.path.join(analysis_dir, 'fastq')):
+        for name in names:
+            if name.endswith('.fastq.gz'):
+                size += os.path.getsize(os.path.join(root, name))
+                files += 1
+                match = FASTQ_NAME.match(name)
+                if match and not name.startswith('Undetermined'):
+                    samples.add(match.group('sample'))
+    return size, files, len(samples)
+
+
+def size_rule(rule, size, files, samples):
+    '''
+    return (cpus, mem_gb, minutes) for a rule on a run of size bytes
+    '''
+    profile = get_profile(rule)
+    gb = size / GB
+    cpus = math.ceil(gb / profile['gb_per_cpu']) if profile['gb_per_cpu'] else profile['min_cpus']
+    # more cpus than files would sit idle
+    cpus = max(profile['min_cpus'], min(cpus, profile['max_cpus'], max(files, 1)))
+    mem_gb = math.ceil(profile['mem_gb'] + profile['mem_gb_per_cpu'] * cpus)
+    minutes = profile['minutes'] + profile['minutes_per_gb'] * gb / cpus + profile['minutes_per_sample'] * samples
+    return cpus, mem_gb, min(math.ceil(minutes * TIME_FACTOR), MAX_MINUTES)
+
+
+def format_time(minutes):
+    days, minutes = divmod(minutes, 24 * 60)
+    return '%i-%02i:%02i:00' % (days, minutes // 60, minutes % 60)
+
+
+def get_sbatch_opts(rule, analysis_dir, run_size=None):
+    '''
+    return sbatch options sizing rule for the run in analysis_dir, None for
+    rules without a profile, run_size is get_run_size(analysis_dir) if the
+    caller already has it
+    '''
+    if rule != BUNDLE_RULE and rule not in DEFAULT_PROFILES:
+        return None
+    size, files, samples = run_size or get_run_size(analysis_dir)
+    if rule != BUNDLE_RULE:
+        cpus, mem_gb, minutes = size_rule(rule, size, files, samples)
+        return {'cpus-per-task': cpus, 'mem': '%iG' % mem_gb, 'time': format_time(minutes)}
+    checksum = size_rule('checksum', size, files, samples)
+    fastqc = size_rule('fastqc', size, files, samples)
+    multiqc = size_rule('multiqc', size, files, samples)
+    return {
+        'cpus-per-task': checksum[0] + fastqc[0],
+        'mem': '%iG' % max(checksum[1] + fastqc[1], multiqc[1]),
+        'time': format_time(min(max(checksum[2], fastqc[2]) + multiqc[2], MAX_MINUTES)),
+        # the share of the cpus for each step
+        'export': 'ALL,ODY_CHECKSUM_CPUS=%i,ODY_FASTQC_CPUS=%i' % (checksum[0], fastqc[0])
+    }
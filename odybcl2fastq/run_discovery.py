@@ -0,0 +1,256 @@
+'''
+discover run folders in the source directory
+
+inotify is used when the source volume is on a local filesystem so new runs
+and newly written RTAComplete.txt files are noticed as soon as they appear.
+On network filesystems (where inotify does not see writes made by the
+sequencers) a single scandir sweep is made and only run folders whose mtime
+changed since the previous sweep are passed to the filter again.  The
+scheduler waits on the inotify fd and the events are read by the next find,
+each filter keeps its own pending run folders until it is next used.
+
+Created on  2026-10-17
+
+@copyright: 2026 The Presidents and Fellows of Harvard College. All rights reserved.
+@license: GPL v2.0
+'''
+import os
+import time
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+SOURCE_DIR = '/sequencing/source/'
+# force a full sweep this often even when inotify is in use, this catches
+# marker files removed by hand (e.g. to rerun a mask) and age based filters
+RESCAN_SECONDS = int(os.getenv('ODYBCL2FASTQ_RESCAN_SECONDS', 600))
+# filesystems whose changes from other hosts are not reported by inotify
+REMOTE_FS_TYPES = ['nfs', 'nfs4', 'cifs', 'smb3', 'lustre', 'gpfs', 'beegfs', 'panfs', 'fuse.sshfs']
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+ROOT_MASK = IN_CREATE | IN_MOVED_TO | IN_ONLYDIR
+RUN_MASK = IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE | IN_DELETE | IN_ATTRIB | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def get_fs_type(path):
+    '''
+    return the filesystem type from /proc/mounts for the mount holding path
+    '''
+    path = os.path.realpath(path)
+    fs_type = ''
+    mount_len = -1
+    try:
+        with open('/proc/mounts', 'r') as mounts:
+            for line in mounts:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                mount_point = parts[1].replace('\\040', ' ')
+                if path == mount_point or path.startswith(mount_point.rstrip('/') + '/'):
+                    if len(mount_point) > mount_len:
+                        mount_len = len(mount_point)
+                        fs_type = parts[2]
+    except OSError:
+        pass
+    return fs_type
+
+
+def inotify_supported(path):
+    fs_type = get_fs_type(path)
+    return bool(fs_type) and fs_type not in REMOTE_FS_TYPES
+
+
+class Inotify(object):
+    '''
+    minimal ctypes wrapper around the linux inotify api
+    '''
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def read(self):
+        '''
+        return a list of (wd, mask, name) for all queued events
+        '''
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(buf):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(buf, pos)
+                pos += EVENT_HEADER.size
+                name = os.fsdecode(buf[pos:pos + length].rstrip(b'\0'))
+                pos += length
+                events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class RunDiscovery(object):
+    '''
+    find run folders in root that pass a filter
+
+    folders rejected by a filter are remembered with their mtime and are not
+    passed to that filter again until the mtime changes or a full sweep is due,
+    folders that passed are always checked again since starting a run changes
+    only files in the status dir
+    '''
+
+    def __init__(self, root=SOURCE_DIR, rescan_seconds=RESCAN_SECONDS, use_inotify=None):
+        self.root = root if root.endswith('/') else root + '/'
+        self.rescan_seconds = rescan_seconds
+        self.rejected = {}
+        self.accepted = {}
+        self.last_sweep = {}
+        self.pending = {}
+        self.watches = {}
+        self.watched = set()
+        self.watch_failed = False
+        self.inotify = None
+        if use_inotify is None:
+            use_inotify = inotify_supported(self.root)
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+                self.inotify.add_watch(self.root, ROOT_MASK)
+                logging.info('Watching %s for new runs with inotify' % self.root)
+            except OSError as e:
+                logging.warning('inotify unavailable for %s, falling back to scanning: %s' % (self.root, e))
+                self.close()
+        if not self.inotify:
+            logging.info('Scanning %s for new runs' % self.root)
+
+    def close(self):
+        if self.inotify:
+            self.inotify.close()
+        self.inotify = None
+        self.watches = {}
+        self.watched = set()
+
+    def scan(self):
+        '''
+        return {run_dir: mtime_ns} for every run folder in root
+        '''
+        dirs = {}
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir():
+                        dirs[entry.path + '/'] = entry.stat().st_mtime_ns
+                except FileNotFoundError: # removed during the scan
+                    continue
+        return dirs
+
+    def find(self, filter):
+        '''
+        return a sorted list of run dirs that pass filter
+        '''
+        key = filter.__name__
+        rejected = self.rejected.setdefault(key, {})
+        accepted = self.accepted.setdefault(key, set())
+        pending = self.pending.setdefault(key, set())
+        now = time.time()
+        full = (now - self.last_sweep.get(key, 0)) >= self.rescan_seconds
+        self.drain()
+        if self.inotify and not full:
+            # only folders with events since the last look or that passed before
+            candidates = {}
+            for dir in (pending | accepted):
+                try:
+                    candidates[dir] = os.stat(dir).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+        else:
+            candidates = self.scan()
+            if full:
+                rejected.clear()
+                self.last_sweep[key] = now
+            for dir in list(rejected):
+                if dir not in candidates:
+                    del rejected[dir]
+        runs = []
+        for dir in sorted(candidates):
+            mtime_ns = candidates[dir]
+            if dir not in pending and rejected.get(dir) == mtime_ns:
+                continue
+            if filter(dir):
+                runs.append(dir)
+                accepted.add(dir)
+                rejected.pop(dir, None)
+            else:
+                accepted.discard(dir)
+                rejected[dir] = mtime_ns
+            self.watch(dir)
+        pending.clear()
+        return runs
+
+    def watch(self, dir):
+        if not self.inotify or self.watch_failed or dir in self.watched:
+            return
+        try:
+            wd = self.inotify.add_watch(dir, RUN_MASK)
+            self.watches[wd] = dir
+            self.watched.add(dir)
+        except OSError as e:
+            # most likely fs.inotify.max_user_watches, stop adding watches,
+            # the periodic sweep will still find the runs
+            logging.warning('Could not watch %s, no more run dirs will be watched: %s' % (dir, e))
+            self.watch_failed = True
+
+    def drain(self):
+        '''
+        move queued inotify events into the pending run dirs of every filter,
+        returns True if there were any
+        '''
+        if not self.inotify:
+            return False
+        changed = set()
+        overflow = False
+        for wd, mask, name in self.inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, force the next find to sweep
+                self.last_sweep = {}
+                overflow = True
+            elif mask & IN_IGNORED:
+                self.watched.discard(self.watches.pop(wd, None))
+            elif wd in self.watches:
+                changed.add(self.watches[wd])
+            elif name and mask & IN_ISDIR and not name.startswith('.'):
+                dir = self.root + name + '/'
+                changed.add(dir)
+                self.watch(dir)
+        for pending in self.pending.values():
+            pending.update(changed)
+        return bool(changed) or overflow
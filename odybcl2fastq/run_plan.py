@@ -0,0 +1,234 @@
+'''
+run plan manifest for the snakemake workflows
+
+Every slurm job snakemake launches evaluates the snakefiles again, so the
+scheduler compiles what they need to know about a run once, before the run
+is launched: the sample sheet to demultiplex with, the basemask and
+bcl2fastq params for non 10x runs, the samples and projects for 10x runs and
+the output paths.  The plan is written as json to the status dir of the run
+and the snakefiles load it instead of parsing the sample sheet, making the
+basemasks, checking index collisions and writing the mask sample sheet for
+each job.  The plan records the size and mtime of the sample sheet and
+RunInfo.xml it was compiled from.  A plan of another version, one whose
+inputs changed since, or a missing one for a workflow started by hand is
+compiled again when the snakefile is evaluated.
+
+Created on  2026-10-17
+
+@copyright: 2026 The Presidents and Fellows of Harvard College. All rights reserved.
+@license: GPL v2.0
+'''
+import os
+import json
+import logging
+import time
+from odybcl2fastq import UserException
+from odybcl2fastq.parsers.samplesheet import SampleSheet
+from odybcl2fastq.parsers.makebasemask import extract_basemasks
+
+PLAN_VERSION = 2
+SOURCE_DIR = '/sequencing/source'
+ANALYSIS_DIR = '/sequencing/analysis'
+PUBLISHED_DIR = '/sequencing/published'
+NON_10X = 'non_10x'
+TENX = '10x'
+MASK_SHORT_ADAPTER_READS = 22
+# params users can add to the end of the Header section of the sample sheet
+SAMPLE_SHEET_BCL_PARAMS = [
+    '--no-lane-splitting',
+    '--barcode-mismatches',
+    '--mask-short-adapter-reads',
+    '--minimum-trimmed-read-length',
+    '--adapter-stringency',
+    '--processing-threads',
+    '--create-fastq-for-index-reads',
+    '--mask-short-adapter-reads'
+]
+
+
+def get_plan_path(run, status_dir, suffix, source_dir=SOURCE_DIR):
+    return os.path.join(source_dir, run, status_dir, 'run_plan%s.json' % suffix)
+
+
+def get_source_sample_sheet_path(run, suffix, mask_suffix, source_dir=SOURCE_DIR):
+    # a run with several masks demultiplexes each from the run's sample sheet
+    if mask_suffix:
+        return os.path.join(source_dir, run, 'SampleSheet.csv')
+    return os.path.join(source_dir, run, 'SampleSheet%s.csv' % suffix)
+
+
+def get_inputs(paths):
+    '''
+    return {path: [size, mtime_ns]} of the files a plan is compiled from,
+    None for a file that does not exist
+    '''
+    inputs = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+            inputs[path] = [st.st_size, st.st_mtime_ns]
+        except FileNotFoundError:
+            inputs[path] = None
+    return inputs
+
+
+def get_params_from_sample_sheet(sample_sheet):
+    # users can add params to the end of the HEADER section of the sample sheet
+    params = {}
+    for k, v in sample_sheet.sections['Header'].items():
+        key = '--' + k.strip()
+        if key in SAMPLE_SHEET_BCL_PARAMS:
+            v = v.strip()
+            params[key] = v if v else None
+    return params
+
+
+def shortest_read(r):
+    return int(r[min(r.keys(), key=(lambda k:int(r[k])))])
+
+
+def get_bcl_params(sample_sheet, instrument, run_type):
+    # start with the defaults
+    param_dict = {
+        '--barcode-mismatches': 0,
+        '--ignore-missing-bcls': None,
+        '--ignore-missing-filter': None,
+        '--ignore-missing-positions': None,
+        '--minimum-trimmed-read-length': 1
+    }
+    if instrument in ['nextseq', 'miseq']:
+        param_dict['--no-lane-splitting'] = None
+    # check for short reads, do not mask
+    if run_type == 'indrop' or shortest_read(sample_sheet.sections['Reads']) < MASK_SHORT_ADAPTER_READS:
+        param_dict['--mask-short-adapter-reads'] = 0
+    # grab any manually added params from sample sheet
+    ss_params = get_params_from_sample_sheet(sample_sheet)
+    if run_type != 'indrop':
+        # numpy is only loaded for the runs that check collisions
+        from odybcl2fastq.parsers.index_collisions import get_barcode_mismatches
+        # the most mismatches the indexes allow, or check the sample sheet value, collisions fail before demultiplexing
+        param_dict['--barcode-mismatches'] = get_barcode_mismatches(sample_sheet.sections['Data'],
+                ss_params.get('--barcode-mismatches'))
+    param_dict.update(ss_params)
+    param_list = [(k + ' ' + str(v)) if v is not None else k for k, v in param_dict.items()]
+    return ' '.join(param_list)
+
+
+def remove_stale_sheet(sample_sheet_path, mask_suffix):
+    # the mask sample sheet is only written if missing, so one older than the
+    # run's sheet is removed to be written again from the changes
+    mask_sheet_path = sample_sheet_path.replace('.csv', '_%s.csv' % mask_suffix)
+    try:
+        if os.stat(mask_sheet_path).st_mtime_ns < os.stat(sample_sheet_path).st_mtime_ns:
+            logging.warning('Sample sheet %s changed, writing %s again' % (sample_sheet_path, mask_sheet_path))
+            os.remove(mask_sheet_path)
+    except FileNotFoundError:
+        pass
+
+
+def compile_non_10x(plan, sample_sheet, run_info, mask_suffix):
+    instrument = sample_sheet.get_instrument()
+    run_type = sample_sheet.get_run_type()
+    # get basemasks for entire run and then use the one for the indexing strategy
+    # in mask_suffix, for runs with only one strategy mask_suffix is empty
+    mask_lists, mask_samples = extract_basemasks(sample_sheet.sections['Data'], run_info, instrument, run_type)
+    sample_sheet_path = sample_sheet.path
+    if len(mask_lists) > 1:
+        mask = mask_suffix.replace('_', ',')
+        remove_stale_sheet(sample_sheet.path, mask_suffix)
+        sample_sheet_path = sample_sheet.write_new_sample_sheet(mask_samples[mask], mask_suffix)
+        sample_sheet = SampleSheet(sample_sheet_path)
+        run_type = sample_sheet.get_run_type()
+    else:
+        mask = next(iter(mask_lists))
+    plan.update({
+        'sample_sheet_path': sample_sheet_path,
+        'instrument': instrument,
+        'run_type': run_type,
+        'mask': mask,
+        'mask_opt_list': mask_lists[mask],
+        'masks': len(mask_lists),
+        'submissions': sample_sheet.get_submissions()
+    })
+    try:
+        plan['bcl_params'] = get_bcl_params(sample_sheet, instrument, run_type)
+    except UserException as e:
+        # raised when the demultiplex script is made, as before the plan
+        plan['bcl_params_error'] = e.user_msg
+    return plan
+
+
+def compile_10x(plan, sample_sheet):
+    plan.update({
+        'sample_sheet_path': sample_sheet.path,
+        'instrument': sample_sheet.get_instrument(),
+        'run_type': sample_sheet.get_run_type(),
+        'samples': sample_sheet.get_samples(),
+        'projects': sample_sheet.get_projects(),
+        'submissions': sample_sheet.get_submissions()
+    })
+    return plan
+
+
+def compile_plan(workflow, run, suffix, mask_suffix='', status_dir='status', source_dir=SOURCE_DIR):
+    '''
+    return the run plan of a non_10x or 10x workflow
+    '''
+    output_run = run + suffix
+    source_sample_sheet_path = get_source_sample_sheet_path(run, suffix, mask_suffix, source_dir)
+    plan = {
+        'version': PLAN_VERSION,
+        'created': time.time(),
+        'workflow': workflow,
+        'run': run,
+        'suffix': suffix,
+        'mask_suffix': mask_suffix,
+        'source_sample_sheet_path': source_sample_sheet_path,
+        'run_info': os.path.join(source_dir, run, 'RunInfo.xml'),
+        'status_dir': os.path.join(source_dir, run, status_dir),
+        'analysis_dir': os.path.join(ANALYSIS_DIR, output_run),
+        'fastq_dir': os.path.join(ANALYSIS_DIR, output_run, 'fastq'),
+        'published_dir': os.path.join(PUBLISHED_DIR, output_run)
+    }
+    # stat before reading so a change while compiling is seen by the next load
+    plan['inputs'] = get_inputs([source_sample_sheet_path, plan['run_info']])
+    sample_sheet = SampleSheet(source_sample_sheet_path)
+    if workflow == TENX:
+        return compile_10x(plan, sample_sheet)
+    return compile_non_10x(plan, sample_sheet, plan['run_info'], mask_suffix)
+
+
+def write_plan(plan, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = '%s.%i.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(plan, f, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+def load_plan(workflow, run, suffix, mask_suffix='', status_dir='status', source_dir=SOURCE_DIR):
+    '''
+    return the run plan written by the scheduler, or compile it if there is
+    none of this version or its inputs changed
+    '''
+    path = get_plan_path(run, status_dir, suffix, source_dir)
+    try:
+        with open(path) as f:
+            plan = json.load(f)
+        if plan.get('version') == PLAN_VERSION and plan.get('workflow') == workflow:
+            if plan['inputs'] == get_inputs(plan['inputs']):
+                return plan
+            logging.warning('Sample sheet or RunInfo.xml changed since run plan %s, compiling it again' % path)
+        else:
+            logging.warning('Run plan %s is version %s of %s, compiling version %i' % (path, plan.get('version'),
+                plan.get('workflow'), PLAN_VERSION))
+    except FileNotFoundError:
+        logging.warning('No run plan %s, compiling it' % path)
+    plan = compile_plan(workflow, run, suffix, mask_suffix, status_dir, source_dir)
+    # later jobs of the workflow can load it
+    try:
+        write_plan(plan, path)
+    except OSError as e:
+        logging.warning('Could not write run plan %s: %s' % (path, e))
+    return plan
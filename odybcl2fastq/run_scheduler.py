@@ -0,0 +1,119 @@
+'''
+order runs waiting to be launched
+
+Runs are placed in a queue per instrument and run type (10x or not).  Queues
+are served in proportion to their weight by the cost already launched from
+each (weighted fair queueing), so a backlog on one instrument cannot starve
+another.  Within a queue the run with the lowest expected cost goes first,
+and a run's cost is discounted the longer it waits so large runs still get
+their turn.  An operator can bump runs ahead of everything else by listing
+them in the priority file as {"<run><suffix>": <priority>}.
+'''
+import os
+import json
+import time
+import logging
+
+PRIORITY_FILE = os.getenv('ODYBCL2FASTQ_PRIORITY_FILE', '/sequencing/log/odybcl2fastq.priority')
+# a run's cost is halved after waiting this long, a third after twice as long...
+AGING_SECONDS = int(os.getenv('ODYBCL2FASTQ_AGING_SECONDS', 6 * 60 * 60))
+# weights by queue name or by instrument, 10x queues fall back to the '10x' weight
+DEFAULT_WEIGHTS = {'miseq': 4, 'nextseq': 3, 'hiseq': 2, 'novaseq': 2, '10x': 1}
+QUEUE_WEIGHTS = json.loads(os.getenv('ODYBCL2FASTQ_QUEUE_WEIGHTS', json.dumps(DEFAULT_WEIGHTS)))
+
+
+class RunScheduler(object):
+
+    def __init__(self, weights=None, aging_seconds=AGING_SECONDS, priority_file=PRIORITY_FILE):
+        self.weights = QUEUE_WEIGHTS if weights is None else weights
+        self.aging_seconds = aging_seconds
+        self.priority_file = priority_file
+        self.queues = {}
+        self.served = {}
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def names(self):
+        return list(self.entries.keys())
+
+    def get_weight(self, queue):
+        if queue in self.weights:
+            return self.weights[queue]
+        instrument, _, run_type = queue.partition('_')
+        if run_type == '10x' and '10x' in self.weights:
+            return self.weights['10x']
+        return self.weights.get(instrument, 1)
+
+    def add(self, name, run_info, queue, cost):
+        '''
+        queue run_info under name, runs already queued are ignored
+        '''
+        if name in self.entries:
+            return False
+        if not self.queues.get(queue):
+            # a queue that was idle starts level with the least served active
+            # queue rather than using up credit it built while idle
+            active = [self.served[q] for q, names in self.queues.items() if names]
+            self.served[queue] = max(self.served.get(queue, 0), min(active) if active else 0)
+        self.queues.setdefault(queue, []).append(name)
+        self.entries[name] = {'run_info': run_info, 'queue': queue, 'cost': max(cost, 1), 'added': time.time()}
+        return True
+
+    def get_priorities(self):
+        priorities = {}
+        if self.priority_file and os.path.isfile(self.priority_file):
+            try:
+                with open(self.priority_file, 'r') as f:
+                    priorities = json.load(f)
+            except (ValueError, OSError) as e:
+                logging.warning('Ignoring priority file %s: %s' % (self.priority_file, e))
+        return priorities
+
+    def get_score(self, name, now):
+        # shortest expected job first, discounted by time waited
+        entry = self.entries[name]
+        waited = now - entry['added']
+        return entry['cost'] / (1 + waited / self.aging_seconds)
+
+    def pop(self):
+        '''
+        remove and return the run_info of the next run to launch
+        '''
+        if not self.entries:
+            raise IndexError('pop from empty scheduler')
+        now = time.time()
+        priorities = self.get_priorities()
+        bumped = [n for n in self.entries if priorities.get(n, 0) > 0]
+        if bumped:
+            name = max(bumped, key=lambda n: (priorities[n], now - self.entries[n]['added']))
+        else:
+            active = [q for q, names in self.queues.items() if names]
+            queue = min(active, key=lambda q: (self.served[q], q))
+            name = min(self.queues[queue], key=lambda n: self.get_score(n, now))
+        entry = self.entries.pop(name)
+        queue = entry['queue']
+        self.queues[queue].remove(name)
+        self.served[queue] += entry['cost'] / self.get_weight(queue)
+        return entry['run_info']
+
+    def snapshot(self):
+        '''
+        return the waiting runs per queue in the order they would be launched
+        '''
+        now = time.time()
+        snap = {}
+        for queue, names in self.queues.items():
+            if names:
+                snap[queue] = {
+                    'weight': self.get_weight(queue),
+                    'served': round(self.served[queue], 1),
+                    'runs': [{'run': n, 'cost': self.entries[n]['cost'],
+                        'waited': int(now - self.entries[n]['added'])}
+                        for n in sorted(names, key=lambda n: self.get_score(n, now))]
+                }
+        return snap
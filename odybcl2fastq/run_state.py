@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+'''
+persistent record of run, mask and stage state
+
+Each marker file (status/ody.processed, status/<mask>/ody.complete,
+odybcl2fastq.skip, status/demultiplex.processed, ...) is a row in a sqlite
+table keyed on (run, mask, stage).  Checks made by the scheduler are answered
+from the table and the marker files written by the snakemake workflow are
+imported when a workflow exits.  In mirror mode, the default while migrating,
+touches write the marker file as well, and an import replaces the run's rows
+so the files stay the source of truth.  The mtimes of the run dir and its
+status dir are kept with each import, a run is imported again when it is
+checked and either has changed, so a skip marker added or a marker removed by
+hand is seen on the next check (the mtime of a mask dir is not checked, run
+run_state import after removing a marker of a mask by hand).  In db mode an
+import only adds rows.
+
+The db is on local disk by default, sqlite locking is not reliable on NFS.
+
+Created on  2026-10-17
+
+@copyright: 2026 The Presidents and Fellows of Harvard College. All rights reserved.
+@license: GPL v2.0
+'''
+import os
+import sys
+import time
+import sqlite3
+from argparse import ArgumentParser
+from pathlib import Path
+
+RUN_STATE_DB = os.getenv('ODYBCL2FASTQ_RUN_STATE_DB', '/var/tmp/ody_run_state.db')
+RUN_STATE_MODE = os.getenv('ODYBCL2FASTQ_RUN_STATE_MODE', 'mirror')
+MODES = ['mirror', 'db']
+SOURCE_DIR = '/sequencing/source/'
+DONE = 'done'
+# marker files that don't follow the <stage>.processed convention
+STAGE_BY_MARKER = {
+    'ody.processed': 'processed',
+    'ody.complete': 'complete',
+    'ody.incomplete_notified': 'incomplete_notified',
+    'odybcl2fastq.skip': 'skip',
+    'odybcl2fastq.processed': 'legacy_processed'
+}
+MARKER_BY_STAGE = {v: k for k, v in STAGE_BY_MARKER.items()}
+# these live in the run dir rather than the status dir
+ROOT_STAGES = ['skip', 'legacy_processed']
+
+SCHEMA = ['''
+create table if not exists run_state (
+    run text not null,
+    mask text not null default '',
+    stage text not null,
+    state text not null,
+    updated real not null,
+    primary key (run, mask, stage)
+)
+''', '''
+create index if not exists run_state_stage on run_state (stage, state, updated)
+''', '''
+create table if not exists imported (
+    run text primary key,
+    updated real not null,
+    run_mtime integer,
+    status_mtime integer
+)
+''']
+# columns added to imported since it was first created
+IMPORTED_COLUMNS = ['run_mtime', 'status_mtime']
+
+
+def get_stage(marker_name):
+    if marker_name in STAGE_BY_MARKER:
+        return STAGE_BY_MARKER[marker_name]
+    elif marker_name.endswith('.processed'):
+        return marker_name[:-len('.processed')]
+    return None
+
+
+class RunStateDB(object):
+
+    def __init__(self, path=RUN_STATE_DB, mode=RUN_STATE_MODE, status_dir='status'):
+        if mode not in MODES:
+            raise ValueError('run state mode must be one of %s: %s' % (MODES, mode))
+        self.path = path
+        self.mode = mode
+        self.status_dir = status_dir
+        self.db = sqlite3.connect(path, timeout=30)
+        with self.db:
+            for sql in SCHEMA:
+                self.db.execute(sql)
+            columns = [r[1] for r in self.db.execute('pragma table_info(imported)')]
+            for column in IMPORTED_COLUMNS:
+                if column not in columns:
+                    # runs imported before are imported again on their next check
+                    self.db.execute('alter table imported add column %s integer' % column)
+        # (run dir mtime, status dir mtime) of each run when its marker files were imported
+        self.imported = {r[0]: (r[1], r[2]) for r in
+                self.db.execute('select run, run_mtime, status_mtime from imported')}
+
+    def close(self):
+        self.db.close()
+
+    def parse_marker(self, marker):
+        '''
+        return (mask, stage) for a marker path relative to the run dir
+        '''
+        parts = Path(marker).parts
+        stage = get_stage(parts[-1])
+        if not stage:
+            raise ValueError('not a marker file: %s' % marker)
+        mask = parts[1] if len(parts) == 3 and parts[0] == self.status_dir else ''
+        return mask, stage
+
+    def marker_path(self, stage, mask=''):
+        '''
+        return the marker path relative to the run dir for a stage
+        '''
+        name = MARKER_BY_STAGE.get(stage, stage + '.processed')
+        if stage in ROOT_STAGES:
+            return name
+        return os.path.join(self.status_dir, mask, name) if mask else os.path.join(self.status_dir, name)
+
+    def get(self, run, stage, mask=''):
+        row = self.db.execute('select state, updated from run_state where run = ? and mask = ? and stage = ?',
+                (run, mask, stage)).fetchone()
+        return row
+
+    def has(self, run, stage, mask=''):
+        row = self.get(run, stage, mask)
+        return bool(row) and row[0] == DONE
+
+    def set(self, run, stage, mask='', state=DONE, updated=None):
+        if updated is None:
+            updated = time.time()
+        with self.db:
+            self.db.execute('insert or replace into run_state (run, mask, stage, state, updated) values (?, ?, ?, ?, ?)',
+                    (run, mask, stage, state, updated))
+
+    def clear(self, run, stage, mask=''):
+        with self.db:
+            self.db.execute('delete from run_state where run = ? and mask = ? and stage = ?', (run, mask, stage))
+
+    def get_mtimes(self, run_dir):
+        '''
+        return (run dir mtime, status dir mtime) in ns, None for a missing dir
+        '''
+        mtimes = []
+        for path in [run_dir, os.path.join(run_dir, self.status_dir)]:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def marker_exists(self, run_dir, marker):
+        '''
+        check a marker for a run from the table, in mirror mode the marker
+        files of a run are imported first if it was not seen before or its
+        run or status dir changed since
+        '''
+        run = Path(run_dir).name
+        mask, stage = self.parse_marker(marker)
+        if self.mode == 'mirror' and self.imported.get(run) != self.get_mtimes(run_dir):
+            self.import_markers(run_dir)
+        return self.has(run, stage, mask)
+
+    def touch_marker(self, run_dir, marker):
+        run = Path(run_dir).name
+        mask, stage = self.parse_marker(marker)
+        if self.mode == 'mirror':
+            path = Path(run_dir, marker)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
+        self.set(run, stage, mask)
+
+    def import_markers(self, run_dir):
+        '''
+        record the marker files found on disk for a run, in mirror mode rows
+        without a marker file are removed
+        '''
+        run = Path(run_dir).name
+        # taken first so a marker written during the import is seen next time
+        mtimes = self.get_mtimes(run_dir)
+        rows = []
+        for stage in ROOT_STAGES:
+            path = Path(run_dir, MARKER_BY_STAGE[stage])
+            if path.is_file():
+                rows.append((run, '', stage, DONE, path.stat().st_mtime))
+        status_path = Path(run_dir, self.status_dir)
+        if status_path.is_dir():
+            for entry in os.scandir(status_path):
+                if entry.is_dir():
+                    for sub_entry in os.scandir(entry.path):
+                        stage = get_stage(sub_entry.name)
+                        if stage and sub_entry.is_file():
+                            rows.append((run, entry.name, stage, DONE, sub_entry.stat().st_mtime))
+                else:
+                    stage = get_stage(entry.name)
+                    if stage and entry.is_file():
+                        rows.append((run, '', stage, DONE, entry.stat().st_mtime))
+        with self.db:
+            if self.mode == 'mirror':
+                self.db.execute('delete from run_state where run = ?', (run,))
+            self.db.executemany('insert or replace into run_state (run, mask, stage, state, updated) values (?, ?, ?, ?, ?)', rows)
+            self.db.execute('insert or replace into imported (run, updated, run_mtime, status_mtime) values (?, ?, ?, ?)',
+                    (run, time.time()) + mtimes)
+        self.imported[run] = mtimes
+        return len(rows)
+
+    def all_masks_complete(self, run):
+        '''
+        return True if every mask of the run is complete, a run without masks
+        has only the run level marker
+        '''
+        return all(self.has(run, 'complete', mask) for mask in self.get_masks(run))
+
+    def get_masks(self, run):
+        rows = self.db.execute("select distinct mask from run_state where run = ? and mask != ''", (run,))
+        return [r[0] for r in rows]
+
+    def get_run(self, run):
+        return self.db.execute('select mask, stage, state, updated from run_state where run = ? order by updated',
+                (run,)).fetchall()
+
+    def get_stuck(self, stage, older_than_hours=0):
+        '''
+        return (run, mask, updated) for runs whose latest stage is stage, that
+        have not completed and have not moved on in older_than_hours
+        '''
+        cutoff = time.time() - older_than_hours * 60 * 60
+        sql = '''
+            select s.run, s.mask, s.updated from run_state s
+            where s.stage = ? and s.state = ? and s.updated < ?
+            and not exists (select 1 from run_state l where l.run = s.run and l.mask = s.mask
+                and l.state = ? and l.updated > s.updated)
+            and not exists (select 1 from run_state c where c.run = s.run and c.stage = 'complete'
+                and c.state = ? and (c.mask = s.mask or c.mask = ''))
+            order by s.updated
+        '''
+        return self.db.execute(sql, (stage, DONE, cutoff, DONE, DONE)).fetchall()
+
+
+def main():
+    parser = ArgumentParser(description='query or update the run state db')
+    parser.add_argument('--db', default=RUN_STATE_DB, help='path to the db [default: %s]' % RUN_STATE_DB)
+    parser.add_argument('--mode', default=RUN_STATE_MODE, choices=MODES, help='[default: %s]' % RUN_STATE_MODE)
+    parser.add_argument('--status_dir', default='status', help='[default: status]')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    imp = sub.add_parser('import', help='import marker files, all runs in %s if none given' % SOURCE_DIR)
+    imp.add_argument('run_dirs', nargs='*')
+    stuck = sub.add_parser('stuck', help='list runs stuck in a stage')
+    stuck.add_argument('stage')
+    stuck.add_argument('--hours', type=float, default=24)
+    show = sub.add_parser('show', help='show the state of a run')
+    show.add_argument('run')
+    for cmd in ['set', 'clear']:
+        p = sub.add_parser(cmd, help='%s a stage for a run, e.g. skip or processed' % cmd)
+        p.add_argument('run')
+        p.add_argument('stage')
+        p.add_argument('--mask', default='')
+    args = parser.parse_args()
+
+    state = RunStateDB(args.db, args.mode, args.status_dir)
+    if args.cmd == 'import':
+        run_dirs = args.run_dirs or sorted(e.path for e in os.scandir(SOURCE_DIR) if e.is_dir())
+        for run_dir in run_dirs:
+            print('%s: %i markers' % (run_dir, state.import_markers(run_dir)))
+    elif args.cmd == 'stuck':
+        for run, mask, updated in state.get_stuck(args.stage, args.hours):
+            print('%s\t%s\t%s' % (run, mask, time.ctime(updated)))
+    elif args.cmd == 'show':
+        for mask, stage, st, updated in state.get_run(args.run):
+            print('%s\t%s\t%s\t%s' % (mask, stage, st, time.ctime(updated)))
+    else:
+        run_dir = os.path.join(SOURCE_DIR, args.run)
+        marker = state.marker_path(args.stage, args.mask)
+        if args.cmd == 'set':
+            state.touch_marker(run_dir, marker)
+        else:
+            if state.mode == 'mirror' and Path(run_dir, marker).is_file():
+                Path(run_dir, marker).unlink()
+            state.clear(args.run, args.stage, args.mask)
+    state.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
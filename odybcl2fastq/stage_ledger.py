@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+'''
+ledger of the resources used by each workflow step of each run
+
+The /usr/bin/time -v reports in the .err logs of a run's analysis dir are
+collected when the run is published (or with the collect command for older
+runs) into a sqlite table with a row per job log, alongside a row of run
+attributes: instrument, lanes, cycles, samples and bytes of fastq.  The report
+command shows the 50th and 95th percentiles of each step's wall time, cpu
+time and max RSS and the GB of fastq each instrument's runs produced per
+node-hour, over a date range so runs before and after an upgrade can be
+compared.
+
+publish is a local rule, so the ledger is written from the host running the
+workflows and is kept on its local disk by default, as the run state is.
+
+Created on  2026-10-17
+
+@copyright: 2026 The Presidents and Fellows of Harvard College. All rights reserved.
+@license: GPL v2.0
+'''
+import os
+import re
+import sys
+import time
+import sqlite3
+from datetime import datetime
+from argparse import ArgumentParser
+from odybcl2fastq.parsers.parse_time import parse_time_v_file, get_totals
+from odybcl2fastq.parsers.parse_runinfoxml import get_runinfo_model
+from odybcl2fastq.parsers.samplesheet import get_instrument
+from odybcl2fastq.resources import get_run_size, GB
+from odybcl2fastq.job_history import get_run, percentile
+
+LEDGER_DB = os.getenv('ODYBCL2FASTQ_LEDGER_DB', '/var/tmp/ody_stage_ledger.db')
+ANALYSIS_DIR = '/sequencing/analysis/'
+# log/{rule}-%j.err, log/{rule}.{sample}-%j.err or log/{rule}-%A_%a.err
+LOG_NAME = re.compile(r'^(?P<rule>\w+?)(\.(?P<sample>.+))?-(?P<jobid>\d+(_\d+)?)\.err$')
+
+SCHEMA = ['''
+create table if not exists runs (
+    analysis text primary key,
+    run text not null,
+    instrument text not null,
+    lanes integer,
+    cycles integer,
+    samples integer,
+    fastq_bytes integer,
+    collected real not null
+)
+''', '''
+create table if not exists stages (
+    analysis text not null,
+    log text not null,
+    rule text not null,
+    sample text,
+    jobid text,
+    finished real,
+    wall_seconds real,
+    user_seconds real,
+    system_seconds real,
+    max_rss_kb integer,
+    fs_inputs integer,
+    fs_outputs integer,
+    exit_status integer,
+    primary key (analysis, log)
+)
+''']
+
+
+def get_run_attributes(analysis_dir):
+    '''
+    return a dict of instrument, lanes, cycles, samples and fastq bytes for
+    the run in analysis_dir
+    '''
+    run = get_run(analysis_dir)
+    try:
+        instrument = get_instrument(run)
+    except (IndexError, ValueError):
+        instrument = ''
+    lanes = cycles = None
+    run_info = os.path.join(analysis_dir, 'RunInfo.xml')
+    if os.path.isfile(run_info):
+        run_info = get_runinfo_model(run_info)
+        cycles = run_info.total_cycles
+        lanes = run_info.lane_count
+    fastq_bytes, files, samples = get_run_size(analysis_dir)
+    return {'run': run, 'instrument': instrument, 'lanes': lanes, 'cycles': cycles, 'samples': samples,
+            'fastq_bytes': fastq_bytes}
+
+
+class StageLedger(object):
+
+    def __init__(self, path=LEDGER_DB):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            for sql in SCHEMA:
+                self.db.execute(sql)
+
+    def close(self):
+        self.db.close()
+
+    def collect_run(self, analysis_dir):
+        '''
+        record the run attributes and the usage in each job log of
+        analysis_dir, returns the number of logs with a time report
+        '''
+        analysis = os.path.basename(os.path.normpath(analysis_dir))
+        attributes = get_run_attributes(analysis_dir)
+        stages = []
+        log_dir = os.path.join(analysis_dir, 'log')
+        if os.path.isdir(log_dir):
+            for entry in os.scandir(log_dir):
+                match = LOG_NAME.match(entry.name)
+                if not match or not entry.is_file():
+                    continue
+                reports = parse_time_v_file(entry.path)
+                if not reports:
+                    continue
+                totals = get_totals(reports)
+                stages.append((analysis, entry.name, match.group('rule'), match.group('sample'), match.group('jobid'),
+                    entry.stat().st_mtime, totals['wall_seconds'], totals['user_seconds'], totals['system_seconds'],
+                    totals['max_rss_kb'], totals['fs_inputs'], totals['fs_outputs'], totals['exit_status']))
+        with self.db:
+            self.db.execute('''insert or replace into runs (analysis, run, instrument, lanes, cycles, samples,
+                fastq_bytes, collected) values (?, ?, ?, ?, ?, ?, ?, ?)''',
+                (analysis, attributes['run'], attributes['instrument'], attributes['lanes'], attributes['cycles'],
+                    attributes['samples'], attributes['fastq_bytes'], time.time()))
+            self.db.execute('delete from stages where analysis = ?', (analysis,))
+            self.db.executemany('insert into stages values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', stages)
+        return len(stages)
+
+    def get_stages(self, since=0, until=None, instrument=None):
+        sql = '''select s.*, r.instrument, r.fastq_bytes from stages s join runs r on r.analysis = s.analysis
+            where s.finished >= ? and s.finished < ?'''
+        params = [since, until or time.time() + 1]
+        if instrument:
+            sql += ' and r.instrument = ?'
+            params.append(instrument)
+        return self.db.execute(sql, params).fetchall()
+
+    def stage_report(self, since=0, until=None, instrument=None):
+        '''
+        return (rule, jobs, p50 and p95 of wall hours, cpu hours and max RSS GB)
+        for each rule that exited 0
+        '''
+        by_rule = {}
+        for row in self.get_stages(since, until, instrument):
+            if row['exit_status'] == 0:
+                by_rule.setdefault(row['rule'], []).append(row)
+        report = []
+        for rule, rows in sorted(by_rule.items()):
+            wall = [r['wall_seconds'] / 3600 for r in rows]
+            cpu = [(r['user_seconds'] + r['system_seconds']) / 3600 for r in rows]
+            rss = [r['max_rss_kb'] / 1024 / 1024 for r in rows]
+            report.append((rule, len(rows), percentile(wall, 50), percentile(wall, 95), percentile(cpu, 50),
+                percentile(cpu, 95), percentile(rss, 50), percentile(rss, 95)))
+        return report
+
+    def throughput_report(self, since=0, until=None):
+        '''
+        return (instrument, runs, GB of fastq, node-hours, GB per node-hour),
+        each job counts as a node for its wall time
+        '''
+        runs = {}
+        for row in self.get_stages(since, until):
+            run = runs.setdefault(row['analysis'], {'instrument': row['instrument'], 'gb': row['fastq_bytes'] / GB,
+                'hours': 0})
+            run['hours'] += row['wall_seconds'] / 3600
+        by_instrument = {}
+        for run in runs.values():
+            totals = by_instrument.setdefault(run['instrument'], [0, 0, 0])
+            totals[0] += 1
+            totals[1] += run['gb']
+            totals[2] += run['hours']
+        return [(i, n, gb, hours, gb / hours if hours else None) for i, (n, gb, hours) in sorted(by_instrument.items())]
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').timestamp()
+
+
+def main():
+    parser = ArgumentParser(description='collect and report the resources used by each workflow step')
+    parser.add_argument('--db', default=LEDGER_DB, help='path to the db [default: %s]' % LEDGER_DB)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    collect = sub.add_parser('collect', help='collect analysis dirs, all in %s if none given' % ANALYSIS_DIR)
+    collect.add_argument('analysis_dirs', nargs='*')
+    report = sub.add_parser('report', help='percentiles per step and throughput per instrument')
+    report.add_argument('--since', type=parse_date, default=0, help='YYYY-MM-DD')
+    report.add_argument('--until', type=parse_date, help='YYYY-MM-DD')
+    report.add_argument('--instrument')
+    args = parser.parse_args()
+
+    ledger = StageLedger(args.db)
+    if args.cmd == 'collect':
+        analysis_dirs = args.analysis_dirs or sorted(e.path for e in os.scandir(ANALYSIS_DIR) if e.is_dir())
+        for analysis_dir in analysis_dirs:
+            print('%s: %i logs' % (analysis_dir, ledger.collect_run(analysis_dir)))
+    else:
+        print('rule\tjobs\twall_h_p50\twall_h_p95\tcpu_h_p50\tcpu_h_p95\trss_gb_p50\trss_gb_p95')
+        for row in ledger.stage_report(args.since, args.until, args.instrument):
+            print('%s\t%i\t' % row[:2] + '\t'.join('%.2f' % v for v in row[2:]))
+        print('\ninstrument\truns\tfastq_gb\tnode_hours\tgb_per_node_hour')
+        for instrument, runs, gb, hours, rate in ledger.throughput_report(args.since, args.until):
+            print('%s\t%i\t%.1f\t%.1f\t%s' % (instrument, runs, gb, hours, '%.2f' % rate if rate else ''))
+    ledger.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,13 @@
 import os
 import json
 import time
-import mariadb
 import logging
 from odybcl2fastq import config
 
 class StatusDB(object):
     def __init__(self):
+        # imported here so the workflows do not load the driver until a db is used
+        import mariadb
         self.db = mariadb.connect(
                 host = config.STATUS_DB_HOST,
                 user = config.STATUS_DB_USER,
@@ -5,6 +5,15 @@
 '''
 Manage storage capacity by deleting old runs
 
+Runs older than --expired_after days can be deleted.  With --free_percent only
+as many of them are deleted, oldest first, as are needed to bring the space
+available on the volume up to that percent, using the bytes each run would
+free (files whose last link is in the run).  The sizes are walked for the
+oldest runs only until the target is met rather than taken from the disk usage
+index, whose link counts can be stale after a run is published.  Runs are
+deleted in parallel by walking them with scandir and
+unlinking in process, the bytes reclaimed for each run are logged.
+
 Created on  2018-03-09
 Updated on  2020-05-06
 
@@ -15,14 +24,15 @@ Updated on  2020-05-06
 import sys, os
 import datetime
 import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from argparse import ArgumentParser
 from argparse import RawDescriptionHelpFormatter
-from subprocess import Popen, PIPE
-from odybcl2fastq import config, initLogger
+from odybcl2fastq import config, initLogger, setupLogging
 
 
-# Setup logging, to a file if set, otherwise, stderr
-logger = initLogger('storage_mgmt', 'storage_mgmt')
+# the log file is added by initLogger when run as a script
+logger = logging.getLogger('storage_mgmt')
 
 
 # Set named storage paths
@@ -32,8 +42,12 @@ STORAGEPATHS = {
     'OUTPUT_DIR' : '/sequencing/analysis',
     'PUBLISHED_DIR'  : '/sequencing/published',
 }
-for k, v in STORAGEPATHS.items():
-    STORAGEPATHS[k] = config[k]
+
+
+def set_storage_paths():
+    for k in STORAGEPATHS:
+        if k in config:
+            STORAGEPATHS[k] = config[k]
 
 
 def init_args():
@@ -70,6 +84,20 @@ def init_args():
                 'help'      : 'maximum number of runs to delete, if more runs are found then no runs will be deleted, this is a saftey measure',
                 'type'      : int,
                 'default'   : 5,
+            },
+        'free_percent':
+            {
+                'required'  : False,
+                'help'      : 'only delete the oldest expired runs needed to make this percent of the volume available, all expired runs if not set',
+                'type'      : float,
+                'default'   : None,
+            },
+        'workers':
+            {
+                'required'  : False,
+                'help'      : 'number of runs to delete at once',
+                'type'      : int,
+                'default'   : 4,
             }
     }
 
@@ -85,13 +113,6 @@ def init_args():
     return parser.parse_args()
 
 
-def run_cmd(cmd):
-    # run unix cmd, return out and error
-    proc = Popen(cmd, shell=True, stderr=PIPE, stdout=PIPE)
-    out, err = proc.communicate()
-    return (proc.returncode, out, err)
-
-
 def get_runs(seq_storage):
     # hard code paths as a safety measure so job cannot be used to delete
     # from unintended directories
@@ -102,17 +123,15 @@ def get_runs(seq_storage):
     logger.info('Cleaning up %s' % path)
 
     # get all the run folders
-    cmd = 'find %s -maxdepth 1 -mindepth 1 -type d' % path
-    code, out, err = run_cmd(cmd)
-    if code != 0:
-        raise Exception('Could not find directories at path %s: %s' % (cmd, err))
-    return out.split()
+    try:
+        return [e.path for e in os.scandir(path) if e.is_dir(follow_symlinks=False)]
+    except OSError as e:
+        raise Exception('Could not find directories at path %s: %s' % (path, e))
 
 
 def find_expired_runs(runs, oldest_str):
     to_delete = []
     for run in runs:
-        run = run.decode('utf-8')
         run_parts = os.path.basename(run).split('_')
         run_date = run_parts[0]
         if len(run_parts) < 4 or len(run_date) != 6:
@@ -121,7 +140,87 @@ def find_expired_runs(runs, oldest_str):
         if run_date < oldest_str:
             to_delete.append(run)
             logger.info('Adding %s to delete' % run)
-    return to_delete
+    # oldest first
+    return sorted(to_delete, key=os.path.basename)
+
+
+def get_free_bytes(path):
+    '''
+    return (bytes available, bytes total) for the volume of path
+    '''
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize, st.f_blocks * st.f_frsize
+
+
+def get_tree_size(path):
+    '''
+    return the bytes deleting path would free, files with links outside the
+    tree (published runs are hard-linked to analysis) free nothing
+    '''
+    size = 0
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            size += get_tree_size(entry.path)
+        else:
+            st = entry.stat(follow_symlinks=False)
+            if st.st_nlink == 1:
+                size += st.st_blocks * 512
+    return size
+
+
+def remove_tree(path):
+    '''
+    delete path with scandir and unlink, returns the bytes freed
+    '''
+    freed = 0
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            freed += remove_tree(entry.path)
+        else:
+            st = entry.stat(follow_symlinks=False)
+            if st.st_nlink == 1:
+                freed += st.st_blocks * 512
+            os.unlink(entry.path)
+    os.rmdir(path)
+    return freed
+
+
+def select_runs(expired, needed):
+    '''
+    return the oldest expired runs, with their sizes, that free needed bytes,
+    only the runs selected are walked
+    '''
+    selected = []
+    for run in expired:
+        if needed <= 0:
+            break
+        size = get_tree_size(run)
+        selected.append((run, size))
+        needed -= size
+    if needed > 0:
+        logger.warning('Deleting all expired runs will leave %s bytes short of the target' % needed)
+    return selected
+
+
+def delete_runs(runs, workers):
+    '''
+    delete runs in parallel, returns a dict of bytes reclaimed by run
+    '''
+    reclaimed = {}
+    errors = []
+    with ThreadPoolExecutor(workers) as pool:
+        futures = {pool.submit(remove_tree, run): run for run in runs}
+        for future in as_completed(futures):
+            run = futures[future]
+            try:
+                reclaimed[run] = future.result()
+                logger.info('Deleted %s, reclaimed %.1f GB (%i of %i runs)' % (run, reclaimed[run] / 1024 ** 3,
+                    len(reclaimed), len(runs)))
+            except OSError as e:
+                errors.append('%s: %s' % (run, e))
+    if errors:
+        raise Exception('Error deleting runs %s' % json.dumps(errors))
+    return reclaimed
 
 
 def manage_storage():
@@ -134,6 +233,15 @@ def manage_storage():
     logger.info('Removing data older than %s' % expire_str)
 
     to_delete = find_expired_runs(runs, expire_str)
+    if args.free_percent is not None:
+        available, total = get_free_bytes(STORAGEPATHS[args.seq_storage])
+        needed = int(total * args.free_percent / 100) - available
+        logger.info('%.1f%% of %s available, target %.1f%%, need %i bytes' % (100 * available / total,
+            STORAGEPATHS[args.seq_storage], args.free_percent, max(needed, 0)))
+        selected = select_runs(to_delete, needed)
+        for run, size in selected:
+            logger.info('Selected %s, estimated %.1f GB' % (run, size / 1024 ** 3))
+        to_delete = [run for run, size in selected]
     delete_cnt = len(to_delete)
 
     # exit if we found more to delete than we planned as the max
@@ -143,23 +251,21 @@ def manage_storage():
 
     # print out expired runs and delete if option is true
     to_delete_str = json.dumps(to_delete)
-    cmds = []
-    for dir in to_delete:
-        cmds.append('rm -rf %s' % dir)
-    logger.info('Delete cmds:\n%s' % json.dumps(cmds))
     if args.delete:
         logger.info('Deleting %i runs:\n%s' % (delete_cnt, to_delete_str))
-        for cmd in cmds:
-            code, out, err = run_cmd(cmd)
-            if code != 0:
-                raise Exception('Error deleting runs %s: %s' % (cmd, err))
-        logger.info('Successfully deleted runs %s' % to_delete_str)
+        reclaimed = delete_runs(to_delete, args.workers)
+        logger.info('Successfully deleted runs %s, reclaimed %.1f GB' % (to_delete_str,
+            sum(reclaimed.values()) / 1024 ** 3))
     else:
         logger.info('Found %i runs for deletion.  To delete pass in the parameter --delete:\n%s' % (delete_cnt, json.dumps(to_delete)))
 
 
 if __name__ == "__main__":
     try:
+        setupLogging()
+        initLogger('storage_mgmt', 'storage_mgmt')
+        config.validate()
+        set_storage_paths()
         sys.exit(manage_storage())
     except Exception as e:
         logger.exception(e)
@@ -0,0 +1,187 @@
+'''
+run snakemake workflows as child processes of an asyncio event loop
+
+output of each child is streamed to its run log as it is produced and a
+finished child is reported as soon as it exits, the number of concurrent
+children can be changed while runs are in progress.  The end of the output,
+and the last lines that look like errors, are kept in memory for the failure
+email so the log doesn't have to be read back.  A child whose output can't be
+streamed (the log can't be written) is stopped, it would otherwise block on a
+full pipe holding its snakemake lock.
+
+Created on  2026-10-17
+
+@copyright: 2026 The Presidents and Fellows of Harvard College. All rights reserved.
+@license: GPL v2.0
+'''
+import asyncio
+import logging
+import os
+import re
+from collections import deque
+
+TAIL_LINES = int(os.getenv('ODYBCL2FASTQ_TAIL_LINES', 40))
+TAIL_BYTES = int(os.getenv('ODYBCL2FASTQ_TAIL_BYTES', 64 * 1024))
+TAIL_GREP = os.getenv('ODYBCL2FASTQ_TAIL_GREP', 'Error|Exception|exit')
+TAIL_GREP_LINES = int(os.getenv('ODYBCL2FASTQ_TAIL_GREP_LINES', 20))
+READ_SIZE = 64 * 1024
+# seconds a child is given to exit, and release its lock, before it is killed
+STOP_SECONDS = 60
+
+
+class OutputTail(object):
+    '''
+    ring buffer of the last lines of output within a line and byte limit, and
+    of the last lines matching pattern
+    '''
+
+    def __init__(self, max_lines=TAIL_LINES, max_bytes=TAIL_BYTES, pattern=TAIL_GREP, max_matches=TAIL_GREP_LINES):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.lines = deque()
+        self.size = 0
+        self.partial = b''
+        self.pattern = re.compile(pattern.encode()) if pattern else None
+        self.matches = deque(maxlen=max_matches)
+
+    def feed(self, data):
+        '''
+        add a chunk of output, which may end part way through a line
+        '''
+        data = self.partial + data
+        lines = data.split(b'\n')
+        self.partial = lines.pop()
+        # a line longer than the byte limit can't all be kept
+        if len(self.partial) > self.max_bytes:
+            self.partial = self.partial[-self.max_bytes:]
+        for line in lines:
+            self.add(line + b'\n')
+
+    def add(self, line):
+        line = line[-self.max_bytes:]
+        self.lines.append(line)
+        self.size += len(line)
+        while len(self.lines) > self.max_lines or self.size > self.max_bytes:
+            self.size -= len(self.lines.popleft())
+        if self.pattern and self.pattern.search(line):
+            self.matches.append(line)
+
+    def close(self):
+        if self.partial:
+            self.add(self.partial)
+            self.partial = b''
+
+    def tail(self):
+        return b''.join(self.lines).decode(errors='replace')
+
+    def grep(self):
+        return b''.join(self.matches).decode(errors='replace')
+
+
+def read_limit(path, default):
+    '''
+    return the number of concurrent runs written to path, default if the
+    file is missing or doesn't hold a number
+    '''
+    if os.path.isfile(path):
+        try:
+            with open(path, 'r') as f:
+                return int(f.read().strip())
+        except ValueError:
+            logging.warning('Ignoring invalid value in %s' % path)
+    return default
+
+
+async def drain(proc):
+    # discard the rest of the output so the child doesn't block writing it
+    while await proc.stdout.read(READ_SIZE):
+        pass
+    return await proc.wait()
+
+
+async def stop(proc, timeout=STOP_SECONDS):
+    '''
+    terminate proc, reading its output until it exits, kill it if it is
+    still running after timeout
+    '''
+    try:
+        proc.terminate()
+        await asyncio.wait_for(drain(proc), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+    except ProcessLookupError:
+        await proc.wait()
+
+
+class SnakemakeSupervisor(object):
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.running = {}
+        self.finished = []
+        self.wakeup = asyncio.Event()
+
+    def set_limit(self, limit):
+        if limit != self.limit:
+            logging.info('Changing concurrent run limit from %i to %i' % (self.limit, limit))
+            self.limit = limit
+
+    def has_capacity(self):
+        return len(self.running) < self.limit
+
+    def launch(self, run, argv, output_log):
+        '''
+        start a workflow for run, its output is appended to output_log
+        '''
+        self.running[run] = asyncio.ensure_future(self.run_snakemake(run, argv, output_log))
+
+    async def run_snakemake(self, run, argv, output_log):
+        # run cmd, stream out and error to the log, keep the last lines of out
+        tail = OutputTail()
+        proc = None
+        try:
+            with open(output_log, 'ab') as writer:
+                proc = await asyncio.create_subprocess_exec(*argv, stdout=asyncio.subprocess.PIPE,
+                        stderr=asyncio.subprocess.STDOUT)
+                while True:
+                    data = await proc.stdout.read(READ_SIZE)
+                    if not data:
+                        break
+                    writer.write(data)
+                    writer.flush()
+                    tail.feed(data)
+                ret_code = await proc.wait()
+            tail.close()
+        except Exception as e:
+            logging.exception(e)
+            ret_code = -1
+            tail.close()
+            tail.add(str(e).encode() + b'\n')
+            if proc is not None and proc.returncode is None:
+                await stop(proc)
+        del self.running[run]
+        self.finished.append((run, ret_code, tail))
+        self.wakeup.set()
+
+    async def wait(self, timeout, wake_fd=None):
+        '''
+        wait up to timeout for a run to finish or wake_fd to become readable,
+        returns a list of (run, ret_code, OutputTail) for finished runs
+        '''
+        loop = asyncio.get_running_loop()
+        if wake_fd is not None:
+            loop.add_reader(wake_fd, self.wakeup.set)
+        try:
+            if not self.finished:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if wake_fd is not None:
+                loop.remove_reader(wake_fd)
+        self.wakeup.clear()
+        finished = self.finished
+        self.finished = []
+        return finished
+
@@ -4,26 +4,57 @@ import shutil
 import json
 import re
 import stat
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
+CHMOD_WORKERS = int(os.getenv('ODYBCL2FASTQ_CHMOD_WORKERS', 16))
 
-def chmod_rec(path, d_permissions, f_permissions):
+
+def chmod_rec(path, d_permissions, f_permissions, workers=CHMOD_WORKERS):
     '''
-    chmod recursively assigning permissions by type
+    chmod recursively assigning permissions by type, entries that already have
+    them are skipped, returns a Counter of entries changed and skipped
     '''
-    for root, dirs, files in os.walk(path):
-        if d_permissions:
-            chmod_list(_join_root(root, dirs), d_permissions)
-        if f_permissions:
-            chmod_list(_join_root(root, files), f_permissions)
-
-
-def chmod_list(items, permissions):
-    for item in items:
-        os.chmod(item, permissions)
+    counts = Counter()
+    with ThreadPoolExecutor(workers) as pool:
+        pending = {pool.submit(_chmod_dir, path, d_permissions, f_permissions)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, dir_counts = future.result()
+                counts.update(dir_counts)
+                pending.update(pool.submit(_chmod_dir, d, d_permissions, f_permissions) for d in subdirs)
+    return counts
 
 
-def _join_root(root, items):
-    return [os.path.join(root, i) for i in items]
+def _chmod_dir(path, d_permissions, f_permissions):
+    '''
+    chmod the entries of one dir relative to its fd, returns the subdirs and a
+    Counter of entries changed and skipped
+    '''
+    counts = Counter()
+    subdirs = []
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        # entries of a scandir on an fd are stat-ed relative to it
+        for entry in os.scandir(fd):
+            if entry.is_symlink():
+                continue
+            if entry.is_dir():
+                subdirs.append(os.path.join(path, entry.name))
+                permissions = d_permissions
+            else:
+                permissions = f_permissions
+            if not permissions:
+                continue
+            if stat.S_IMODE(entry.stat().st_mode) == permissions:
+                counts['skipped'] += 1
+            else:
+                os.chmod(entry.name, permissions, dir_fd=fd)
+                counts['changed'] += 1
+    finally:
+        os.close(fd)
+    return subdirs, counts
 
 
 def copy(src, dest):
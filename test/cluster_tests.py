@@ -0,0 +1,58 @@
+import unittest
+from odybcl2fastq.cluster import AdmissionController
+
+
+class StandInOccupancy(object):
+
+    def __init__(self, pending=0, running=0):
+        self.counts = {'PENDING': pending, 'RUNNING': running}
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return dict(self.counts)
+
+
+class AdmissionControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.source = StandInOccupancy()
+        self.admission = AdmissionController(self.source, max_pending=2, max_running=10, sample_seconds=600)
+
+    def testAdmitsBelowThresholds(self):
+        self.assertTrue(self.admission.has_room())
+        decision = self.admission.admit('run1')
+        self.assertEqual(decision['decision'], 'admitted')
+        self.assertEqual(decision['waited'], 0)
+
+    def testAdmittedRunsCountUntilNextSample(self):
+        for name in ['run1', 'run2']:
+            self.assertTrue(self.admission.has_room())
+            self.admission.admit(name)
+        self.assertFalse(self.admission.has_room())
+        self.assertEqual(self.source.calls, 1)
+        self.admission.invalidate()
+        self.assertTrue(self.admission.has_room())
+        self.assertEqual(self.source.calls, 2)
+
+    def testHoldsWhenBusy(self):
+        self.source.counts['RUNNING'] = 10
+        self.assertFalse(self.admission.has_room())
+        self.admission.hold(['run1', 'run2'])
+        self.source.counts['RUNNING'] = 3
+        self.admission.invalidate()
+        self.assertTrue(self.admission.has_room())
+        decision = self.admission.admit('run1')
+        self.assertEqual(decision['decision'], 'admitted after hold')
+        self.assertEqual(decision['running'], 3)
+        self.assertIn('run2', self.admission.held)
+
+    def testAdmitsWhenSourceFails(self):
+        def broken():
+            raise OSError('squeue: error')
+        admission = AdmissionController(broken, max_pending=0, max_running=0)
+        self.assertTrue(admission.has_room())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+from odybcl2fastq.disk_usage import DiskUsageIndex
+
+RUN = '200101_A00794_0001_BHXXXXDSXX'
+
+
+class DiskUsageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.analysis = os.path.join(self.tmp.name, 'analysis')
+        self.published = os.path.join(self.tmp.name, 'published')
+        self.write(os.path.join(self.analysis, RUN, 'fastq', 'project', 's1_S1_R1_001.fastq.gz'), 8192)
+        self.write(os.path.join(self.analysis, RUN, 'QC', 'multiqc_report.html'), 4096)
+        self.write(os.path.join(self.analysis, '190101_D00365_0001_AHXXXXBCXX', 'RunInfo.xml'), 4096)
+        os.makedirs(os.path.join(self.published, RUN))
+        os.link(os.path.join(self.analysis, RUN, 'QC', 'multiqc_report.html'),
+                os.path.join(self.published, RUN, 'multiqc_report.html'))
+        self.index = DiskUsageIndex(os.path.join(self.tmp.name, 'disk_usage.db'))
+
+    def tearDown(self):
+        self.index.close()
+        self.tmp.cleanup()
+
+    def write(self, path, size):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+
+    def refresh(self):
+        counts = self.index.refresh_all(['analysis', 'published'],
+            {'analysis': self.analysis, 'published': self.published}, workers=2)
+        return counts['analysis'], counts['published']
+
+    def testIncrementalRefresh(self):
+        # the published run is seen after analysis was scanned, so its run is scanned again
+        self.assertEqual(self.refresh(), ((2, 9), (1, 1)))
+        # nothing changed, nothing scanned
+        self.assertEqual(self.refresh(), ((2, 0), (1, 0)))
+        self.write(os.path.join(self.analysis, RUN, 'fastq', 'project', 's1_S1_R2_001.fastq.gz'), 8192)
+        # the published copy of the run may have new links too
+        self.assertEqual(self.refresh(), ((2, 1), (1, 1)))
+
+    def testLinkedAfterRefresh(self):
+        fastq = os.path.join(self.analysis, RUN, 'fastq', 'project', 's1_S1_R1_001.fastq.gz')
+        blocks = os.stat(fastq).st_blocks * 512
+        self.refresh()
+        self.assertEqual(self.index.get_freed_bytes('analysis')[RUN], blocks)
+        # publishing links the fastq without changing the mtime of its analysis dir
+        os.makedirs(os.path.join(self.published, RUN, 'fastq'))
+        os.link(fastq, os.path.join(self.published, RUN, 'fastq', os.path.basename(fastq)))
+        self.refresh()
+        self.assertEqual(self.index.get_freed_bytes('analysis')[RUN], 0)
+        parts = {(v, p): size for v, p, size, apparent, inodes in self.index.get_parts(RUN)}
+        self.assertEqual(parts[('analysis', 'fastq')] + parts[('published', 'fastq')], blocks)
+        # and removing the published run frees the analysis files again
+        shutil.rmtree(os.path.join(self.published, RUN))
+        self.refresh()
+        self.assertEqual(self.index.get_freed_bytes('analysis')[RUN], blocks + os.stat(
+            os.path.join(self.analysis, RUN, 'QC', 'multiqc_report.html')).st_blocks * 512)
+
+    def testReports(self):
+        self.refresh()
+        largest = self.index.get_runs('analysis')
+        self.assertEqual([r['run'] for r in largest], [RUN, '190101_D00365_0001_AHXXXXBCXX'])
+        oldest = self.index.get_runs(order='date')
+        self.assertEqual(oldest[0]['run'], '190101_D00365_0001_AHXXXXBCXX')
+        parts = {(v, p): (size, apparent) for v, p, size, apparent, inodes in self.index.get_parts(RUN)}
+        # the hard-linked report is split between analysis and published
+        self.assertEqual(parts[('analysis', 'QC')][0] + parts[('published', '.')][0], parts[('analysis', 'QC')][1])
+        self.assertEqual(parts[('analysis', 'fastq')][0], parts[('analysis', 'fastq')][1])
+
+    def testFreedBytes(self):
+        self.refresh()
+        fastq = os.stat(os.path.join(self.analysis, RUN, 'fastq', 'project', 's1_S1_R1_001.fastq.gz'))
+        # the hard-linked report frees nothing
+        self.assertEqual(self.index.get_freed_bytes('analysis')[RUN], fastq.st_blocks * 512)
+        self.assertEqual(self.index.get_freed_bytes('published'), {RUN: 0})
+
+    def testOldIndex(self):
+        path = os.path.join(self.tmp.name, 'old.db')
+        db = sqlite3.connect(path)
+        with db:
+            db.execute('''create table dirs (path text primary key, volume text not null, run text not null,
+                part text not null, mtime real not null, bytes real not null, apparent_bytes integer not null,
+                inodes integer not null, subdirs text not null)''')
+            db.execute("insert into dirs values ('x', 'analysis', 'run', '.', 0, 1, 1, 1, '[]')")
+        db.close()
+        index = DiskUsageIndex(path)
+        # rows without freed_bytes are dropped so the next refresh scans again
+        self.assertEqual(index.get_freed_bytes('analysis'), {})
+        self.assertEqual(index.refresh('analysis', self.analysis, workers=2), (2, 5))
+        index.close()
+
+    def testRemovedRun(self):
+        self.refresh()
+        os.remove(os.path.join(self.published, RUN, 'multiqc_report.html'))
+        os.rmdir(os.path.join(self.published, RUN))
+        self.refresh()
+        self.assertEqual([r[0] for r in self.index.get_volume_totals()], ['analysis'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from odybcl2fastq.fastq_verify import verify_fastq, verify_run
+
+RECORDS = b'@r1\nACGT\n+\nII#?\n@r2\nAC\n+\n!I\n'
+
+
+class FastqVerifyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fastq_dir = os.path.join(self.tmp.name, 'fastq', 'project')
+        os.makedirs(self.fastq_dir)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_fastq(self, name, data):
+        path = os.path.join(self.fastq_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def testMultiMemberCounts(self):
+        data = gzip.compress(RECORDS[:17], mtime=0) + gzip.compress(RECORDS[17:], mtime=0)
+        result = verify_fastq(self.write_fastq('s1_S1_R1_001.fastq.gz', data))
+        self.assertIsNone(result['error'])
+        self.assertEqual(result['members'], 2)
+        self.assertEqual(result['md5'], hashlib.md5(data).hexdigest())
+        self.assertEqual((result['reads'], result['bases'], result['q30_bases']), (2, 6, 4))
+
+    def testTruncatedAndCorrupt(self):
+        data = gzip.compress(RECORDS, mtime=0)
+        self.assertEqual(verify_fastq(self.write_fastq('t_S1_R1_001.fastq.gz', data[:-3]))['error'],
+                'truncated gzip member')
+        corrupt = bytearray(data)
+        corrupt[-6] ^= 1
+        self.assertIn('incorrect data check', verify_fastq(self.write_fastq('c_S1_R1_001.fastq.gz', corrupt))['error'])
+        self.assertEqual(verify_fastq(self.write_fastq('r_S1_R1_001.fastq.gz', gzip.compress(RECORDS[:-3], mtime=0)))['error'],
+                'incomplete fastq record')
+
+    def testVerifyRun(self):
+        for name in ['b_S2_R1_001.fastq.gz', 'a_S1_R1_001.fastq.gz']:
+            self.write_fastq(name, gzip.compress(RECORDS, mtime=0))
+        self.assertEqual(verify_run(self.tmp.name, 2), [])
+        with open(os.path.join(self.tmp.name, 'md5sum.txt')) as f:
+            lines = f.read().splitlines()
+        md5 = hashlib.md5(gzip.compress(RECORDS, mtime=0)).hexdigest()
+        self.assertEqual(lines, ['%s  fastq/project/a_S1_R1_001.fastq.gz' % md5,
+            '%s  fastq/project/b_S2_R1_001.fastq.gz' % md5])
+        with open(os.path.join(self.tmp.name, 'verify', 'fastq', 'project', 'a_S1_R1_001.fastq.gz.json')) as f:
+            self.assertEqual(json.load(f)['reads'], 2)
+        self.write_fastq('c_S3_R1_001.fastq.gz', b'not gzip')
+        os.remove(os.path.join(self.tmp.name, 'md5sum.txt'))
+        self.assertEqual(len(verify_run(self.tmp.name, 2)), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, 'md5sum.txt')))
+
+
+if __name__ == '__main__':
+    unittest.main()
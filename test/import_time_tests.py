@@ -0,0 +1,112 @@
+import os
+import re
+import sys
+import subprocess
+import unittest
+from unittest import mock
+from odybcl2fastq.config import Config
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# modules loaded by the scheduler, the snakefiles and the slurm profile scripts
+MODULES = [
+    'odybcl2fastq',
+    'odybcl2fastq.parsers.samplesheet',
+    'odybcl2fastq.parsers.makebasemask',
+    'odybcl2fastq.run_plan',
+    'odybcl2fastq.status_db',
+    'odybcl2fastq.bauer_db',
+    'odybcl2fastq.emailbuilder.emailbuilder'
+]
+HEAVY_MODULES = ['numpy', 'mariadb', 'requests', 'jinja2']
+# cumulative import time allowed for MODULES, in ms, they take under 100 ms
+# so this only fails on a regression, not a busy node
+IMPORT_BUDGET_MS = int(os.getenv('ODYBCL2FASTQ_IMPORT_BUDGET_MS', 2000))
+ENV = {
+    'ODY_EMAIL_ADMIN': '["admin@example.com"]',
+    'ODY_EMAIL_FROM': 'ody@example.com',
+    'ODY_EMAIL_SMTP': 'localhost',
+    'ODY_EMAIL_TO': '["to@example.com"]',
+    'ODY_GLOBUS_URL': 'https://globus.example.com/',
+    'ODY_PUBLISHED_CLUSTER_PATH': '/n/ngsdata',
+    'ODY_ANALYSIS_DIR': '/sequencing/analysis'
+}
+
+
+def import_modules(modules):
+    '''
+    return (the heavy modules loaded, the -X importtime report) of importing
+    modules in a new interpreter without any ODY_* settings
+    '''
+    env = {k: v for k, v in os.environ.items() if not k.startswith('ODY_')}
+    env['PYTHONPATH'] = ROOT_DIR
+    code = 'import sys\n%s\nprint(",".join(m for m in %r if m in sys.modules))' % (
+        '\n'.join('import %s' % m for m in modules), HEAVY_MODULES)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, cwd=ROOT_DIR,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return [m for m in proc.stdout.strip().split(',') if m], proc.stderr
+
+
+def get_import_ms(report, modules):
+    '''
+    return the cumulative ms of the top level imports of modules in an
+    -X importtime report
+    '''
+    total = 0
+    for line in report.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| (\S+)$', line)
+        if match and match.group(2) in modules:
+            total += int(match.group(1))
+    return total / 1000
+
+
+class ImportTimeTest(unittest.TestCase):
+
+    def testNoHeavyImports(self):
+        heavy, report = import_modules(MODULES)
+        self.assertEqual(heavy, [])
+
+    def testImportBudget(self):
+        heavy, report = import_modules(MODULES)
+        import_ms = get_import_ms(report, MODULES)
+        self.assertGreater(import_ms, 0)
+        self.assertLess(import_ms, IMPORT_BUDGET_MS)
+
+    def testNoLogging(self):
+        # logging is set up by the entry points, not on import
+        code = 'import logging, odybcl2fastq\nprint(len(logging.getLogger().handlers))'
+        proc = subprocess.run([sys.executable, '-c', code], env=dict(os.environ, PYTHONPATH=ROOT_DIR),
+            cwd=ROOT_DIR, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        self.assertEqual(proc.stdout.strip(), '0')
+
+
+class ConfigTest(unittest.TestCase):
+
+    def testLazy(self):
+        with mock.patch.dict(os.environ, clear=True):
+            config = Config()
+            # settings are only read on first use
+            with self.assertRaises(KeyError):
+                config.EMAIL_FROM
+        with mock.patch.dict(os.environ, ENV, clear=True):
+            self.assertEqual(config.EMAIL_FROM, 'ody@example.com')
+            self.assertEqual(config['EMAIL_TO'], ['to@example.com'])
+            self.assertFalse(config.TEST)
+            self.assertIsNone(config.UNKNOWN)
+        # and kept once read
+        with mock.patch.dict(os.environ, clear=True):
+            self.assertIn('EMAIL_SMTP', config)
+
+    def testValidate(self):
+        with mock.patch.dict(os.environ, ENV, clear=True), \
+                mock.patch('os.path.isdir', return_value=False):
+            config = Config()
+            with self.assertRaisesRegex(Exception, 'path does not exist: /sequencing/source'):
+                config.validate()
+        with mock.patch.dict(os.environ, ENV, clear=True), \
+                mock.patch('os.path.isdir', return_value=True), \
+                mock.patch('os.access', return_value=True):
+            self.assertIs(config.validate(), config)
+
+
+if __name__ == '__main__':
+    unittest.main()
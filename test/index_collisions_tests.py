@@ -0,0 +1,79 @@
+import unittest
+import random
+import time
+from collections import OrderedDict
+from odybcl2fastq import UserException
+from odybcl2fastq.parsers.index_collisions import get_barcode_mismatches
+
+
+def get_data(samples):
+    data = OrderedDict()
+    for lane, sample, index, index2 in samples:
+        data['%s:%s' % (lane, sample)] = {'Lane': lane, 'Sample_ID': sample, 'index': index, 'index2': index2}
+    return data
+
+
+class IndexCollisionsTest(unittest.TestCase):
+
+    def testSafeMismatches(self):
+        data = get_data([
+            ('1', 'a', 'AAAAAAAA', 'CCCCCCCC'),
+            ('1', 'b', 'AAAAAATT', 'CCCCCCGG'),
+            ('2', 'c', 'ACGTACGT', 'TTTTTTTT'),
+            ('2', 'd', 'TGCATGCA', 'TTTTTTTA')])
+        # a and b are 2 mismatches apart in both indexes, only one can allow a mismatch
+        self.assertEqual(get_barcode_mismatches(data), '1,0')
+        data['1:b']['index2'] = 'GGGGGGGG'
+        self.assertEqual(get_barcode_mismatches(data), '1,1')
+        self.assertEqual(get_barcode_mismatches(data, max_mismatches=2), '2,2')
+
+    def testSingleIndex(self):
+        data = get_data([('1', 'a', 'AAAAAAAA', ''), ('1', 'b', 'AAAAATTT', ''), ('2', 'c', 'AAAAAAAA', '')])
+        self.assertEqual(get_barcode_mismatches(data), '1')
+        data['2:d'] = {'Lane': '2', 'Sample_ID': 'd', 'index': 'AAAAAAAT', 'index2': ''}
+        self.assertEqual(get_barcode_mismatches(data), '0')
+
+    def testMixedLanes(self):
+        # the i5 value applies to the dual indexed lane even if another lane is single indexed
+        data = get_data([('1', 'a', 'AAAAAAAA', 'CCCCCCCC'), ('1', 'b', 'AAAAAATT', 'CCCCCCGG'),
+            ('2', 'c', 'AAAAAAAA', ''), ('2', 'd', 'TTTTTTTT', '')])
+        self.assertEqual(get_barcode_mismatches(data), '1,0')
+        data['1:b']['index2'] = 'GGGGGGGG'
+        self.assertEqual(get_barcode_mismatches(data), '1,1')
+        data['2:d']['index'] = 'AAAAAAAT'
+        self.assertEqual(get_barcode_mismatches(data), '0,1')
+
+    def testRecipe(self):
+        # indexes are compared as truncated by Recipe
+        data = get_data([('1', 'a', 'AAAAAAAA', 'CCCCCCCC'), ('1', 'b', 'AAAAAATT', 'GGGGGGGG')])
+        self.assertEqual(get_barcode_mismatches(data), '1,1')
+        for row in data.values():
+            row['Recipe'] = '6_0'
+        with self.assertRaisesRegex(UserException, 'identical indexes for a \\(AAAAAA\\) and b \\(AAAAAA\\)'):
+            get_barcode_mismatches(data)
+
+    def testCollisions(self):
+        data = get_data([('1', 'a', 'AAAAAAAA', 'CCCCCCCC'), ('1', 'b', 'AAAAAAAA', 'CCCCCCCC'),
+            ('2', 'c', 'ACGTACGT', 'TTTTTTTT'), ('2', 'd', 'ACGTACGA', 'TTTTTTTA')])
+        with self.assertRaises(UserException) as e:
+            get_barcode_mismatches(data, '1')
+        self.assertIn('lane 1: identical indexes for a (AAAAAAAA+CCCCCCCC) and b (AAAAAAAA+CCCCCCCC)', str(e.exception))
+        self.assertIn('lane 2: with --barcode-mismatches 1, c', str(e.exception))
+
+    def testRequested(self):
+        data = get_data([('1', 'a', 'AAAAAAAA', 'CCCCCCCC'), ('1', 'b', 'TTTTTTTT', 'GGGGGGGG')])
+        self.assertEqual(get_barcode_mismatches(data, '0'), '0')
+
+    def test384Plex(self):
+        random.seed(1)
+        samples = set()
+        while len(samples) < 384:
+            samples.add((''.join(random.choice('ACGT') for i in range(10)), ''.join(random.choice('ACGT') for i in range(10))))
+        data = get_data([('1', 's%i' % n, i7, i5) for n, (i7, i5) in enumerate(sorted(samples))])
+        start = time.time()
+        get_barcode_mismatches(data)
+        self.assertLess(time.time() - start, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import os
+import tempfile
+from odybcl2fastq import job_history
+from odybcl2fastq.job_history import JobHistory, escalate, parse_minutes, parse_mem_mb
+from odybcl2fastq.parsers.parse_time import parse_time_v, get_totals
+
+TIME_V = '''
+\tCommand being timed: "bcl2fastq --runfolder-dir /sequencing/source/run"
+\tUser time (seconds): 3000.50
+\tSystem time (seconds): 100.25
+\tPercent of CPU this job got: 1550%
+\tElapsed (wall clock) time (h:mm:ss or m:ss): 0:03:20
+\tMaximum resident set size (kbytes): 2048000
+\tFile system inputs: 800
+\tFile system outputs: 1200
+\tExit status: 0
+'''
+
+
+class ParseTimeTest(unittest.TestCase):
+
+    def testParse(self):
+        reports = parse_time_v('some output\n' + TIME_V + TIME_V.replace('Exit status: 0', 'Exit status: 2'))
+        self.assertEqual(len(reports), 2)
+        self.assertEqual(reports[0]['command'], 'bcl2fastq --runfolder-dir /sequencing/source/run')
+        self.assertEqual(reports[0]['wall_seconds'], 200)
+        self.assertEqual(reports[0]['cpu_percent'], 1550)
+        totals = get_totals(reports)
+        self.assertEqual(totals['wall_seconds'], 400)
+        self.assertEqual(totals['max_rss_kb'], 2048000)
+        self.assertEqual(totals['fs_outputs'], 2400)
+        self.assertEqual(totals['exit_status'], 2)
+
+
+class JobHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.history = JobHistory(os.path.join(self.tmp.name, 'history.db'), min_history=2)
+
+    def tearDown(self):
+        self.history.close()
+        self.tmp.cleanup()
+
+    def add_job(self, jobid, size, tasks=0, opts=None):
+        err_path = os.path.join(self.tmp.name, 'demultiplex-%j.err')
+        with open(err_path.replace('%j', jobid), 'w') as f:
+            f.write(TIME_V)
+        self.history.submitted(jobid, 'demultiplex', 'run', 'hiseq', size, 'script.sh',
+                opts or {'mem': '4G', 'time': '1:00:00'}, err_path, tasks)
+
+    def testParseSlurmValues(self):
+        self.assertEqual(parse_minutes('4-20:00:00'), (4 * 24 + 20) * 60)
+        self.assertEqual(parse_minutes('1:30:00'), 90)
+        self.assertEqual(parse_minutes('45'), 45)
+        self.assertEqual(parse_mem_mb('4G'), 4096)
+        self.assertEqual(parse_mem_mb(0), 0)
+
+    def testPredictFromHistory(self):
+        self.add_job('1', 100)
+        self.assertIsNone(self.history.predict('demultiplex', 'hiseq', 100))
+        self.history.collect('1', 'COMPLETED')
+        self.add_job('2', 200)
+        self.history.collect('2', 'COMPLETED')
+        self.assertEqual(self.history.get('2')['max_rss_kb'], 2048000)
+        predicted = self.history.predict('demultiplex', 'novaseq', 400)
+        self.assertEqual(predicted['cpus-per-task'], 16)
+        self.assertEqual(predicted['mem'], '2500M')
+        # 2 seconds per unit at the 95th percentile for 400 units with headroom
+        self.assertEqual(predicted['time'], '0-00:20:00')
+
+    def testEscalate(self):
+        opts = {'mem': '4G', 'time': '2:00:00'}
+        self.assertEqual(escalate(opts, ['OUT_OF_MEMORY']), {'mem': '8192M', 'time': '2:00:00'})
+        self.assertEqual(escalate(opts, ['TIMEOUT'])['time'], '0-04:00:00')
+        self.assertIsNone(escalate({'mem': 0}, ['OUT_OF_MEMORY']))
+        self.assertIsNone(escalate({'time': '4-20:00:00'}, ['TIMEOUT']))
+
+    def testResubmitFailedArrayTasks(self):
+        submitted = []
+        def sbatch(script, opts):
+            submitted.append(opts)
+            return '9'
+        self.add_job('5', 10, tasks=3, opts={'mem': '1G', 'array': '0-2%2'})
+        original = job_history.sbatch
+        job_history.sbatch = sbatch
+        try:
+            tasks = [('5_0', 'COMPLETED'), ('5_1', 'OUT_OF_MEMORY'), ('5_2', 'OUT_OF_MEMORY')]
+            self.assertEqual(self.history.resubmit('5', 'OUT_OF_MEMORY', tasks), '9')
+            self.assertIsNone(self.history.resubmit('5', 'OUT_OF_MEMORY', tasks))
+        finally:
+            job_history.sbatch = original
+        self.assertEqual(submitted, [{'mem': '2048M', 'array': '1,2%2'}])
+        self.assertEqual(self.history.current('5'), '9')
+        self.assertEqual(self.history.get('9')['attempt'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import unittest
+import json
+import os
+import sys
+import tempfile
+import subprocess
+from odybcl2fastq.job_status import JobStatusCache, FileSlurm
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLUSTER_STATUS = os.path.join(ROOT_DIR, 'odybcl2fastq', 'profiles', 'rc_slurm', 'cluster_status.py')
+
+
+class CountingSlurm(FileSlurm):
+
+    def __init__(self, path):
+        super(CountingSlurm, self).__init__(path)
+        self.calls = []
+
+    def __call__(self, jobids):
+        self.calls.append(list(jobids))
+        return super(CountingSlurm, self).__call__(jobids)
+
+
+class JobStatusCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.states_file = os.path.join(self.tmp.name, 'slurm.json')
+        self.set_states({})
+        self.slurm = CountingSlurm(self.states_file)
+        self.cache = JobStatusCache(os.path.join(self.tmp.name, 'status.db'), self.slurm, stale_seconds=600)
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp.cleanup()
+
+    def set_states(self, states):
+        with open(self.states_file, 'w') as f:
+            json.dump(states, f)
+
+    def testRefreshChecksAllJobsAtOnce(self):
+        for jobid in ['1', '2', '3']:
+            self.cache.submitted(jobid)
+        self.set_states({'1': 'RUNNING', '2': 'COMPLETED', '3': 'OUT_OF_MEMORY'})
+        self.assertEqual(self.cache.refresh(), 3)
+        self.assertEqual(len(self.slurm.calls), 1)
+        self.assertEqual([self.cache.status(j) for j in ['1', '2', '3']], ['running', 'success', 'failed'])
+        self.assertEqual(len(self.slurm.calls), 1)
+        # finished jobs are not checked again
+        self.assertEqual(self.cache.refresh(), 1)
+        self.assertEqual(self.slurm.calls[-1], ['1'])
+
+    def testStaleStateIsQueriedDirectly(self):
+        self.cache.stale_seconds = 0
+        self.cache.submitted('1')
+        self.set_states({'1': 'TIMEOUT'})
+        self.assertEqual(self.cache.status('1'), 'failed')
+        self.assertEqual(self.slurm.calls, [['1']])
+        self.assertEqual(self.cache.get('1')[0], 'TIMEOUT')
+
+    def testUnknownJobIsRunning(self):
+        self.assertEqual(self.cache.status('9'), 'running')
+        self.assertEqual(self.cache.refresh(), 1)
+
+    def testArrayJobStateFromTasks(self):
+        self.cache.submitted('5')
+        self.set_states({'5_0': 'COMPLETED', '5_1': 'RUNNING', '5_[2-9%2]': 'PENDING'})
+        self.cache.refresh()
+        self.assertEqual(self.cache.status('5'), 'running')
+        self.set_states({'5_0': 'COMPLETED', '5_1': 'FAILED', '5_2': 'COMPLETED'})
+        self.cache.refresh()
+        self.assertEqual(self.cache.status('5'), 'failed')
+        self.assertEqual(self.cache.tasks('5'), [('5_0', 'COMPLETED'), ('5_1', 'FAILED'), ('5_2', 'COMPLETED')])
+        # tasks are looked up with their job
+        self.assertEqual(self.slurm.calls[-1], ['5'])
+
+    def testBackendFailureKeepsState(self):
+        def broken(jobids):
+            raise OSError('sacct: error')
+        self.cache.record({'1': 'RUNNING'}, checked=0)
+        self.cache.backend = broken
+        self.assertEqual(self.cache.status('1'), 'running')
+
+    def testRetry(self):
+        self.cache.submitted('1')
+        self.cache.retried('1', '2')
+        self.cache.retried('2', '3')
+        self.assertEqual(self.cache.current('1'), '3')
+        self.assertEqual(self.cache.current('4'), '4')
+        self.assertEqual(self.cache.get('3')[0], 'SUBMITTED')
+        # kept while either job is in the table
+        self.cache.record({'1': 'OUT_OF_MEMORY', '2': 'TIMEOUT'}, checked=0)
+        self.set_states({'3': 'RUNNING'})
+        self.cache.refresh()
+        self.assertEqual(self.cache.current('1'), '3')
+        self.cache.record({'3': 'COMPLETED'}, checked=0)
+        self.cache.refresh()
+        self.assertEqual(self.cache.current('1'), '1')
+
+    def testClusterStatus(self):
+        history_db = os.path.join(self.tmp.name, 'history.db')
+        env = dict(os.environ, ODYBCL2FASTQ_JOB_STATUS_DB=self.cache.path, ODYBCL2FASTQ_JOB_HISTORY_DB=history_db,
+            ODYBCL2FASTQ_SLURM_BACKEND='file:' + self.states_file, PYTHONPATH=ROOT_DIR)
+        def cluster_status(jobid):
+            return subprocess.run([sys.executable, CLUSTER_STATUS, '', '', '', jobid], env=env,
+                stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout.strip()
+        self.cache.retried('1', '2')
+        self.set_states({'2': 'RUNNING'})
+        # a running job is answered from the status cache alone
+        self.assertEqual(cluster_status('1'), 'running')
+        self.assertFalse(os.path.exists(history_db))
+        self.set_states({'2': 'COMPLETED'})
+        self.cache.record({'2': 'COMPLETED'})
+        self.assertEqual(cluster_status('1'), 'success')
+        self.assertTrue(os.path.exists(history_db))
+
+
+if __name__ == '__main__':
+    unittest.main()
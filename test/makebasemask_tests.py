@@ -0,0 +1,58 @@
+import os
+import unittest
+from collections import OrderedDict
+from odybcl2fastq import UserException
+from odybcl2fastq.parsers.makebasemask import extract_basemasks, plan_basemasks
+
+# y51,i8,i8
+RUNINFO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_samplesheets',
+    '5_zerorecipe_RunInfo_HiSeq_SE_dualindex_170620_D00365_0950_AHL32JBCXY.xml')
+
+
+def get_data(samples):
+    data = OrderedDict()
+    for lane, sample, index, index2, recipe in samples:
+        data['%s:%s' % (lane, sample)] = {'Lane': lane, 'Sample_ID': sample, 'index': index, 'index2': index2,
+            'Recipe': recipe}
+    return data
+
+
+class MakeBasemaskTest(unittest.TestCase):
+
+    def testSignatures(self):
+        data = get_data([
+            ('1', 'a', 'ACGTACGT', 'TTTTAAAA', ''),
+            ('1', 'b', 'ACGTACGT', 'TTTTAAAA', '6_0'),
+            ('2', 'c', 'CCGTACGT', 'GTTTAAAA', ''),
+            ('2', 'd', 'ACGTAC', '', '')])
+        mask_lists, mask_samples, table = plan_basemasks(data, RUNINFO, 'hiseq', '', False)
+        self.assertEqual(list(table.items()), [
+            (('1', 8, 8), ('y51,i8,i8', 1)),
+            (('1', 6, None), ('y51,i6nn,nnnnnnnn', 1)),
+            (('2', 8, 8), ('y51,i8,i8', 1)),
+            (('2', 6, None), ('y51,i6nn,nnnnnnnn', 1))])
+        self.assertEqual(mask_lists, {
+            'y51,i8,i8': ['1:y51,i8,i8', '2:y51,i8,i8'],
+            'y51,i6nn,nnnnnnnn': ['1:y51,i6nn,nnnnnnnn', '2:y51,i6nn,nnnnnnnn']})
+        self.assertEqual([r['Sample_ID'] for r in mask_samples['y51,i6nn,nnnnnnnn']], ['b', 'd'])
+        # the recipe truncates the indexes written to the new sample sheet, not the rows given
+        self.assertEqual([(r['index'], r['index2']) for r in mask_samples['y51,i6nn,nnnnnnnn']],
+            [('ACGTAC', ''), ('ACGTAC', '')])
+        self.assertEqual((data['1:b']['index'], data['1:b']['index2']), ('ACGTACGT', 'TTTTAAAA'))
+
+    def testNextSeq(self):
+        data = get_data([
+            ('1', 'a', 'ACGTACGT', 'TTTTAAAA', ''),
+            ('2', 'b', 'ACGTACGT', 'TTTTAAAA', ''),
+            ('3', 'c', 'ACGTACGT', 'TTTT', '')])
+        mask_lists, mask_samples = extract_basemasks(data, RUNINFO, 'nextseq', '', False)
+        self.assertEqual(mask_lists, {'y51,i8,i8': ['y51,i8,i8'], 'y51,i8,i4nnnn': ['y51,i8,i4nnnn']})
+        self.assertEqual([r['Sample_ID'] for r in mask_samples['y51,i8,i8']], ['a', 'b'])
+
+    def testZeroBases(self):
+        data = get_data([
+            ('1', 'a', 'ACGTACGT', 'TTTTAAAA', ''),
+            ('1', 'b', '--', 'TTTTAAAA', ''),
+            ('1', 'c', '-', 'TTTTAAAA', '')])
+        with self.assertRaisesRegex(UserException, 'sample 1:b index has zero bases'):
+            extract_basemasks(data, RUNINFO, 'hiseq', '', False)
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+from odybcl2fastq.parsers import metadata_cache
+from odybcl2fastq.parsers.metadata_cache import MetadataCache, stat_key, get_sample_sheet
+from odybcl2fastq.parsers.makebasemask import get_basemasks
+
+# y51,i8,i8
+RUNINFO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_samplesheets',
+    '5_zerorecipe_RunInfo_HiSeq_SE_dualindex_170620_D00365_0950_AHL32JBCXY.xml')
+SHEET = '''[Header]
+IEMFileVersion,4
+Instrument Type,HiSeq
+
+[Reads]
+51
+
+[Data]
+Lane,Sample_ID,Sample_Name,index,index2,Sample_Project,Recipe
+1,a,a,ACGTACGT,TTTTAAAA,proj1,
+1,b,b,CCGTACGT,GTTTAAAA,proj1,6_0
+'''
+
+
+class MetadataCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'SampleSheet.csv')
+        with open(self.path, 'w') as f:
+            f.write(SHEET)
+        metadata_cache.cache.clear()
+
+    def tearDown(self):
+        metadata_cache.cache.clear()
+        shutil.rmtree(self.tmp)
+
+    def testStatKey(self):
+        key = stat_key(self.path)
+        self.assertEqual(key[:2], (self.path, len(SHEET)))
+        os.utime(self.path, ns=(0, key[2] + 1000))
+        self.assertEqual(stat_key(self.path)[2], key[2] + 1000)
+        sheet = get_sample_sheet(self.path)
+        self.assertIs(get_sample_sheet(self.path), sheet)
+        # an edit the same second with the same size is parsed again
+        with open(self.path, 'w') as f:
+            f.write(SHEET.replace('proj1', 'proj2'))
+        os.utime(self.path, ns=(0, key[2] + 2000))
+        self.assertIsNot(get_sample_sheet(self.path), sheet)
+        self.assertEqual(get_sample_sheet(self.path).sections['Data']['1:a']['Sample_Project'], 'proj2')
+        self.assertEqual(metadata_cache.cache.stats(), {'hits': 2, 'misses': 2, 'size': 2})
+
+    def testEviction(self):
+        cache = MetadataCache(max_size=2)
+        loads = []
+        load = lambda key: cache.get(key, lambda: loads.append(key) or key)
+        load('a')
+        load('b')
+        # a is now the most recently used so b is evicted
+        load('a')
+        load('c')
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+        load('b')
+        self.assertEqual(loads, ['a', 'b', 'c', 'b'])
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 4, 'size': 2})
+
+    def testRowsNotChanged(self):
+        rows = [dict(r) for r in get_sample_sheet(self.path).sections['Data'].values()]
+        mask_lists, mask_samples = get_basemasks(self.path, RUNINFO, 'hiseq', '')
+        self.assertEqual(sorted(mask_lists), ['y51,i6nn,nnnnnnnn', 'y51,i8,i8'])
+        self.assertEqual(mask_samples['y51,i6nn,nnnnnnnn'][0]['index'], 'CCGTAC')
+        # the cached sample sheet still has the indexes as written
+        self.assertEqual([dict(r) for r in get_sample_sheet(self.path).sections['Data'].values()], rows)
+        self.assertEqual(rows[1]['index'], 'CCGTACGT')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import unittest
+from odybcl2fastq.parsers import parse_runinfoxml
+from odybcl2fastq.parsers.parse_runinfoxml import get_runinfo_model, get_readinfo_from_runinfo, get_flowcell_layout
+
+TEST_SAMPLESHEETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_samplesheets')
+
+
+class RunInfoTest(unittest.TestCase):
+
+    def testNextSeq(self):
+        run_info = get_runinfo_model(os.path.join(TEST_SAMPLESHEETS, 'nextseq_dualpolyA_runinfo.xml'))
+        self.assertEqual((run_info.name, run_info.number, run_info.flowcell, run_info.instrument),
+            ('170425_NS500422_0486_AHLVNFBGX2', 486, 'HLVNFBGX2', 'NS500422'))
+        self.assertEqual([(r.number, r.num_cycles, r.is_indexed) for r in run_info.reads],
+            [(1, 61, False), (2, 8, True), (3, 8, True), (4, 14, False)])
+        self.assertEqual((run_info.lane_count, run_info.surface_count, run_info.swath_count, run_info.tile_count),
+            (4, 2, 3, 12))
+        self.assertEqual((run_info.tile_naming, run_info.tiles[0], len(run_info.tiles)), ('FiveDigit', '1_11101', 864))
+        self.assertEqual(run_info.total_cycles, 91)
+
+    def testViews(self):
+        path = os.path.join(TEST_SAMPLESHEETS, '1_RunInfo_HiSeq_PE_singleindex_1_170504_D00365_0934_BHGLCMBCXY.xml')
+        reads = get_readinfo_from_runinfo(path)
+        self.assertEqual(reads['read2'], {'NumCycles': '7', 'IsIndexedRead': 'Y'})
+        self.assertEqual(get_flowcell_layout(path), {'LaneCount': '2', 'SurfaceCount': '2', 'SwathCount': '2',
+            'TileCount': '16'})
+        # views are copies of the shared RunInfo
+        reads['read2']['NumCycles'] = '8'
+        self.assertEqual(get_readinfo_from_runinfo(path)['read2']['NumCycles'], '7')
+
+    def testParsedOncePerVersion(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'RunInfo.xml')
+            shutil.copy(os.path.join(TEST_SAMPLESHEETS, 'nextseq_dualpolyA_runinfo.xml'), path)
+            run_info = get_runinfo_model(path)
+            self.assertIs(get_runinfo_model(path), run_info)
+            with open(path) as f:
+                xml = f.read()
+            with open(path, 'w') as f:
+                f.write(xml.replace('NumCycles="61"', 'NumCycles="151"'))
+            os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+            self.assertEqual(get_runinfo_model(path).total_cycles, 181)
+        finally:
+            shutil.rmtree(tmp)
+            parse_runinfoxml.load_runinfo.cache_clear()
@@ -0,0 +1,100 @@
+import unittest
+import json
+import os
+import tempfile
+import time
+import numpy
+from odybcl2fastq.parsers import parse_stats
+
+STATS = {
+    'Flowcell': 'HXXXXDSXX',
+    'RunNumber': 12,
+    'ConversionResults': [
+        {'LaneNumber': lane, 'TotalClustersPF': 1000 + lane, 'Yield': 4000,
+            'DemuxResults': [
+                {'SampleId': 's1', 'IndexMetrics': [{'IndexSequence': 'ACGT'}], 'NumberReads': 100 * lane,
+                    'ReadMetrics': [{'Yield': 100, 'YieldQ30': 90}, {'Yield': 100, 'YieldQ30': 70}]},
+                {'SampleId': 's2', 'IndexMetrics': [{'IndexSequence': 'TTGG'}], 'NumberReads': 50,
+                    'ReadMetrics': [{'Yield': 0, 'YieldQ30': 0}, {'Yield': 0, 'YieldQ30': 0}]}],
+            'Undetermined': {'NumberReads': 7, 'ReadMetrics': [{'Yield': 10, 'YieldQ30': 5}]}}
+        for lane in [1, 2]],
+    'UnknownBarcodes': [{'Lane': lane, 'Barcodes': {'AAAA': 2000000 + lane, 'CCCC': 5}} for lane in [1, 2]]
+}
+
+
+def get_single_lane_stats(samples):
+    rows = [{'SampleId': 's%i' % i, 'SampleName': 's%i' % i,
+        'IndexMetrics': [{'IndexSequence': 'ACGTACGT+TTGGCCAA', 'MismatchCounts': {'0': i, '1': 1}}],
+        'NumberReads': i, 'Yield': 2 * i,
+        'ReadMetrics': [{'ReadNumber': r, 'Yield': i, 'YieldQ30': i // 2, 'QualityScoreSum': 3 * i, 'TrimmedBases': 0}
+            for r in [1, 2]]} for i in range(samples)]
+    return {'Flowcell': 'HXXXXDSXX', 'ConversionResults': [{'LaneNumber': 1, 'TotalClustersPF': 10, 'Yield': 10,
+        'Undetermined': {'NumberReads': 7, 'ReadMetrics': [{'Yield': 10, 'YieldQ30': 5}]}, 'DemuxResults': rows}],
+        'UnknownBarcodes': [{'Lane': 1, 'Barcodes': {'%08i' % i: i for i in range(20000)}}]}
+
+
+class ParseStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'Stats.json')
+        with open(self.path, 'w') as f:
+            json.dump(STATS, f, indent=2)
+        self.read_size = parse_stats.READ_SIZE
+        # values and keys are split across reads
+        parse_stats.READ_SIZE = 7
+
+    def tearDown(self):
+        parse_stats.READ_SIZE = self.read_size
+        self.tmp.cleanup()
+
+    def testReadStats(self):
+        lanes, unknown = parse_stats.read_stats(self.path)
+        self.assertEqual(unknown, STATS['UnknownBarcodes'])
+        self.assertEqual(list(lanes.keys()), [1, 2])
+        lane = lanes[2]
+        self.assertEqual(lane['samples'], ['s1', 's2', 'undetermined'])
+        self.assertEqual(lane['reads'].tolist(), [200, 50, 7])
+        self.assertEqual(lane['yieldq30'].tolist(), [[90, 70], [0, 0], [5, 0]])
+        self.assertEqual(lane['sam_num'], 2)
+
+    def testLargeLane(self):
+        # Undetermined is before DemuxResults and still the last sample
+        stats = get_single_lane_stats(8000)
+        with open(self.path, 'w') as f:
+            json.dump(stats, f, indent=2)
+        self.assertGreater(os.path.getsize(self.path), 5 * 1024 * 1024)
+        parse_stats.READ_SIZE = 64 * 1024
+        start = time.time()
+        with open(self.path) as f:
+            expected = parse_stats.get_stats(json.load(f))
+        load_secs = time.time() - start
+        start = time.time()
+        lanes, unknown = parse_stats.read_stats(self.path)
+        read_secs = time.time() - start
+        self.assertEqual(unknown, stats['UnknownBarcodes'])
+        self.assertEqual(lanes[1]['samples'][-1], 'undetermined')
+        self.assertEqual(lanes[1]['sam_num'], 8000)
+        for key in ['reads', 'yield', 'yieldq30']:
+            self.assertTrue(numpy.array_equal(lanes[1][key], expected[1][key]))
+        # a lane decoded again on each read takes tens of times longer
+        self.assertLess(read_secs, 5 * load_secs + 1)
+
+    def testLaneTables(self):
+        lanes, unknown = parse_stats.read_stats(self.path)
+        formatted, headers = parse_stats.format_lane_table(lanes)
+        self.assertEqual(headers, ['sample', 'index', 'clusters', '% >= Q30'])
+        self.assertEqual(formatted[1]['clusters'], '1001')
+        self.assertEqual(dict(formatted[1]['samples']['s1']),
+                {'sample': 's1', 'index': 'ACGT', 'clusters': '100', '% >= Q30': '80.00'})
+        self.assertEqual(formatted[1]['samples']['s2']['% >= Q30'], 'nan')
+        lane_sum = parse_stats.get_lane_sum(lanes)
+        self.assertEqual((lane_sum[0]['clusters'], lane_sum[0]['% Bases >= Q30']), ('157', '78.57'))
+        nextseq = parse_stats.aggregate_nextseq_lanes(lanes)
+        self.assertEqual(nextseq[1]['reads'].tolist(), [300, 100, 14])
+        self.assertEqual(nextseq[1]['clusters'], 414)
+        self.assertTrue(numpy.array_equal(nextseq[1]['yield'], lanes[1]['yield'] * 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
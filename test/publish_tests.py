@@ -0,0 +1,61 @@
+import unittest
+import os
+import stat
+import tempfile
+from odybcl2fastq.publish import publish_tree, READ_ONLY
+
+
+class PublishTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, 'analysis', 'run1')
+        self.dst = os.path.join(self.tmp.name, 'published', 'run1')
+        os.makedirs(os.path.join(self.src, 'fastq', 'project'))
+        os.makedirs(os.path.dirname(self.dst))
+        self.write('fastq/project/s1_S1_R1_001.fastq.gz', 'reads')
+        self.write('md5sum.txt', 'sums')
+        os.symlink('fastq/project', os.path.join(self.src, 'project'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, data):
+        with open(os.path.join(self.src, name), 'w') as f:
+            f.write(data)
+
+    def assertLinked(self, name):
+        src = os.stat(os.path.join(self.src, name))
+        dst = os.stat(os.path.join(self.dst, name))
+        self.assertEqual(src.st_ino, dst.st_ino)
+        self.assertEqual(stat.S_IMODE(dst.st_mode), READ_ONLY)
+
+    def testFirstPublish(self):
+        counts = publish_tree(self.src, self.dst, workers=2)
+        self.assertEqual((counts['linked'], counts['dirs'], counts['chmod']), (3, 2, 2))
+        self.assertLinked('md5sum.txt')
+        self.assertLinked('fastq/project/s1_S1_R1_001.fastq.gz')
+        self.assertEqual(os.readlink(os.path.join(self.dst, 'project')), 'fastq/project')
+        self.assertFalse(os.path.exists(self.dst + '.publishing'))
+
+    def testRepublishAppliesChanges(self):
+        publish_tree(self.src, self.dst)
+        counts = publish_tree(self.src, self.dst)
+        self.assertEqual(counts['unchanged'], 3)
+        self.assertFalse(counts['linked'] or counts['removed'] or counts['chmod'])
+
+        os.remove(os.path.join(self.src, 'md5sum.txt'))
+        self.write('md5sum.txt', 'new sums')
+        self.write('multiqc_report.html', 'report')
+        os.remove(os.path.join(self.src, 'project'))
+        with open(os.path.join(self.dst, 'stale.txt'), 'w') as f:
+            f.write('old')
+        counts = publish_tree(self.src, self.dst)
+        self.assertEqual((counts['linked'], counts['removed'], counts['unchanged']), (2, 2, 1))
+        self.assertLinked('md5sum.txt')
+        self.assertLinked('multiqc_report.html')
+        self.assertEqual(sorted(os.listdir(self.dst)), ['fastq', 'md5sum.txt', 'multiqc_report.html'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import os
+import tempfile
+from unittest import mock
+from odybcl2fastq import resources, job_history
+
+
+class ResourcesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fastq_dir = os.path.join(self.tmp.name, 'fastq', 'project')
+        os.makedirs(self.fastq_dir)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_fastq(self, name, size):
+        with open(os.path.join(self.fastq_dir, name), 'wb') as f:
+            f.truncate(size)
+
+    def testRunSize(self):
+        for sample in ['s1', 's2']:
+            for read in ['R1', 'R2']:
+                self.write_fastq('%s_S1_L001_%s_001.fastq.gz' % (sample, read), 100)
+        self.write_fastq('Undetermined_S0_L001_R1_001.fastq.gz', 50)
+        self.assertEqual(resources.get_run_size(self.tmp.name), (450, 5, 2))
+
+    def testCpusFollowSizeWithinLimits(self):
+        gb = resources.GB
+        self.assertEqual(resources.size_rule('fastqc', 0, 0, 0)[0], 2)
+        self.assertEqual(resources.size_rule('fastqc', 50 * gb, 100, 10)[0], 10)
+        # no more cpus than files
+        self.assertEqual(resources.size_rule('fastqc', 50 * gb, 4, 2)[0], 4)
+        self.assertEqual(resources.size_rule('fastqc', 5000 * gb, 1000, 10)[0], 32)
+        minutes = resources.size_rule('checksum', 5000 * gb, 1000, 10)[2]
+        self.assertLessEqual(minutes, resources.MAX_MINUTES)
+
+    def testSbatchOpts(self):
+        self.write_fastq('s1_S1_R1_001.fastq.gz', 0)
+        self.assertIsNone(resources.get_sbatch_opts('demultiplex', self.tmp.name))
+        opts = resources.get_sbatch_opts('checksum', self.tmp.name)
+        self.assertEqual(opts, {'cpus-per-task': 2, 'mem': '3G', 'time': '0-00:45:00'})
+        opts = resources.get_sbatch_opts('post_demux', self.tmp.name)
+        self.assertEqual(opts['cpus-per-task'], 4)
+        self.assertIn('ODY_FASTQC_CPUS=2', opts['export'])
+
+    def testRunSizeGiven(self):
+        # slurm_submit walks the fastq once for the profile and the history
+        self.write_fastq('s1_S1_R1_001.fastq.gz', 0)
+        run_size = resources.get_run_size(self.tmp.name)
+        with mock.patch.object(resources, 'get_run_size', side_effect=AssertionError), \
+                mock.patch.object(job_history, 'get_run_size', side_effect=AssertionError):
+            opts = resources.get_sbatch_opts('checksum', self.tmp.name, run_size)
+            self.assertEqual(opts['cpus-per-task'], 2)
+            self.assertEqual(job_history.get_job_size('checksum', self.tmp.name, run_size)[1], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
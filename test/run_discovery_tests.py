@@ -0,0 +1,103 @@
+import unittest
+import os
+import tempfile
+from odybcl2fastq.run_discovery import RunDiscovery, Inotify
+
+RUNS = ['200101_A00794_0001_BHXXXXDSXX', '200102_A00794_0002_AHXXXXDSXX']
+
+
+def inotify_available():
+    try:
+        Inotify().close()
+        return True
+    except OSError:
+        return False
+
+
+class Filter(object):
+    '''
+    a run filter that records the dirs it was called with
+    '''
+
+    def __init__(self, name, accept=()):
+        self.__name__ = name
+        self.accept = set(accept)
+        self.calls = []
+
+    def __call__(self, dir):
+        self.calls.append(os.path.basename(dir.rstrip('/')))
+        return os.path.basename(dir.rstrip('/')) in self.accept
+
+
+class RunDiscoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name + '/'
+        for run in RUNS:
+            os.makedirs(self.root + run)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def touch(self, run):
+        st = os.stat(self.root + run)
+        os.utime(self.root + run, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    def testScanPrunesByMtime(self):
+        discovery = RunDiscovery(self.root, rescan_seconds=3600, use_inotify=False)
+        filter = Filter('ready', [RUNS[0]])
+        self.assertEqual(discovery.find(filter), [self.root + RUNS[0] + '/'])
+        self.assertEqual(filter.calls, RUNS)
+        # the rejected run is not checked again until its mtime changes,
+        # the accepted one always is
+        filter.calls = []
+        discovery.find(filter)
+        self.assertEqual(filter.calls, [RUNS[0]])
+        filter.calls = []
+        self.touch(RUNS[1])
+        os.makedirs(self.root + '200103_A00794_0003_BHXXXXDSXX')
+        discovery.find(filter)
+        self.assertEqual(filter.calls, RUNS + ['200103_A00794_0003_BHXXXXDSXX'])
+
+    def testFullSweep(self):
+        discovery = RunDiscovery(self.root, rescan_seconds=0, use_inotify=False)
+        filter = Filter('ready')
+        discovery.find(filter)
+        filter.calls = []
+        # a sweep is due on every find, unchanged rejected runs are checked too
+        self.assertEqual(discovery.find(filter), [])
+        self.assertEqual(filter.calls, RUNS)
+
+    @unittest.skipUnless(inotify_available(), 'inotify not available')
+    def testEventsRoutedToEachFilter(self):
+        discovery = RunDiscovery(self.root, rescan_seconds=3600, use_inotify=True)
+        ready = Filter('ready')
+        incomplete = Filter('incomplete')
+        discovery.find(ready)
+        discovery.find(incomplete)
+        ready.calls, incomplete.calls = [], []
+        # no events, nothing is checked
+        self.assertEqual(discovery.find(ready), [])
+        self.assertEqual(ready.calls, [])
+        # a new run and a file written in a watched run
+        new_run = '200103_A00794_0003_BHXXXXDSXX'
+        os.makedirs(self.root + new_run)
+        with open(os.path.join(self.root, RUNS[0], 'RTAComplete.txt'), 'w') as f:
+            f.write('done')
+        ready.accept.add(RUNS[0])
+        self.assertEqual(discovery.find(ready), [self.root + RUNS[0] + '/'])
+        self.assertEqual(sorted(ready.calls), [RUNS[0], new_run])
+        # the events are still pending for the filter that has not looked
+        self.assertEqual(discovery.pending['incomplete'], {self.root + RUNS[0] + '/', self.root + new_run + '/'})
+        self.assertEqual(discovery.pending['ready'], set())
+        discovery.find(incomplete)
+        self.assertEqual(sorted(incomplete.calls), [RUNS[0], new_run])
+        self.assertEqual(discovery.pending['incomplete'], set())
+        # nothing is left to wake the scheduler
+        self.assertFalse(discovery.drain())
+        discovery.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from odybcl2fastq import run_plan
+
+TEST_SAMPLESHEETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_samplesheets')
+RUN = '170425_NS500422_0486_AHLVNFBGX2'
+MASK_SUFFIX = 'y61_i8_i8_y14'
+
+
+class RunPlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.source_dir, RUN))
+        shutil.copy(os.path.join(TEST_SAMPLESHEETS, 'nextseq_dualpolyA_mixedindex_samplesheet.csv'),
+            os.path.join(self.source_dir, RUN, 'SampleSheet.csv'))
+        shutil.copy(os.path.join(TEST_SAMPLESHEETS, 'nextseq_dualpolyA_runinfo.xml'),
+            os.path.join(self.source_dir, RUN, 'RunInfo.xml'))
+        self.args = (RUN, '_' + MASK_SUFFIX, MASK_SUFFIX, 'status/' + MASK_SUFFIX, self.source_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.source_dir)
+
+    def testCompileMask(self):
+        plan = run_plan.compile_plan(run_plan.NON_10X, *self.args)
+        self.assertEqual((plan['instrument'], plan['mask'], plan['mask_opt_list'], plan['masks']),
+            ('nextseq', 'y61,i8,i8,y14', ['y61,i8,i8,y14'], 2))
+        # the samples of the mask are written to their own sample sheet
+        self.assertEqual(plan['sample_sheet_path'],
+            os.path.join(self.source_dir, RUN, 'SampleSheet_%s.csv' % MASK_SUFFIX))
+        self.assertTrue(os.path.exists(plan['sample_sheet_path']))
+        self.assertIn('--barcode-mismatches 1,1', plan['bcl_params'])
+        self.assertIn('--no-lane-splitting', plan['bcl_params'])
+
+    def testLoad(self):
+        path = run_plan.get_plan_path(RUN, 'status/' + MASK_SUFFIX, '_' + MASK_SUFFIX, self.source_dir)
+        plan = run_plan.compile_plan(run_plan.NON_10X, *self.args)
+        plan['bcl_params'] = 'from the scheduler'
+        run_plan.write_plan(plan, path)
+        self.assertEqual(run_plan.load_plan(run_plan.NON_10X, *self.args)['bcl_params'], 'from the scheduler')
+        # a plan of another version is compiled again and replaced
+        plan['version'] = run_plan.PLAN_VERSION - 1
+        run_plan.write_plan(plan, path)
+        self.assertNotEqual(run_plan.load_plan(run_plan.NON_10X, *self.args)['bcl_params'], 'from the scheduler')
+        with open(path) as f:
+            self.assertEqual(json.load(f)['version'], run_plan.PLAN_VERSION)
+
+    def testChangedSampleSheet(self):
+        path = run_plan.get_plan_path(RUN, 'status/' + MASK_SUFFIX, '_' + MASK_SUFFIX, self.source_dir)
+        plan = run_plan.load_plan(run_plan.NON_10X, *self.args)
+        self.assertIn('--barcode-mismatches 1,1', plan['bcl_params'])
+        self.assertEqual(run_plan.load_plan(run_plan.NON_10X, *self.args)['created'], plan['created'])
+        # a value added to the Header after the plan was written
+        sheet = os.path.join(self.source_dir, RUN, 'SampleSheet.csv')
+        with open(sheet) as f:
+            text = f.read()
+        with open(sheet, 'w') as f:
+            f.write(text.replace('[Reads]', 'barcode-mismatches,0\n[Reads]', 1))
+        mask_sheet = os.stat(plan['sample_sheet_path'])
+        os.utime(sheet, ns=(mask_sheet.st_atime_ns, mask_sheet.st_mtime_ns + 10 ** 9))
+        plan = run_plan.load_plan(run_plan.NON_10X, *self.args)
+        self.assertIn('--barcode-mismatches 0', plan['bcl_params'])
+        with open(path) as f:
+            self.assertEqual(json.load(f)['bcl_params'], plan['bcl_params'])
+
+    def testCompile10x(self):
+        plan = run_plan.compile_plan(run_plan.TENX, RUN, '', '', 'status', self.source_dir)
+        self.assertEqual(plan['samples'], ['SP_ME_cortex_combined_3', 'SP_ME_cortex_combined_x'])
+        self.assertEqual(plan['projects'], [])
+        self.assertNotIn('bcl_params', plan)
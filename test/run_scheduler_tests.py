@@ -0,0 +1,57 @@
+import unittest
+import json
+import os
+import tempfile
+from odybcl2fastq.run_scheduler import RunScheduler
+
+
+class RunSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.priority_file = tempfile.NamedTemporaryFile('w', suffix='.priority', delete=False).name
+        os.unlink(self.priority_file)
+        self.scheduler = RunScheduler({'hiseq': 2, 'miseq': 1, '10x': 1}, 3600, self.priority_file)
+
+    def tearDown(self):
+        if os.path.exists(self.priority_file):
+            os.unlink(self.priority_file)
+
+    def drain(self):
+        order = []
+        while len(self.scheduler) > 0:
+            order.append(self.scheduler.pop()['run'])
+        return order
+
+    def testShortestFirstWithinQueue(self):
+        self.scheduler.add('big', {'run': 'big'}, 'hiseq', 1000)
+        self.scheduler.add('small', {'run': 'small'}, 'hiseq', 10)
+        self.assertEqual(self.drain(), ['small', 'big'])
+
+    def testQueuesShareByWeight(self):
+        for i in range(4):
+            self.scheduler.add('h%i' % i, {'run': 'h%i' % i}, 'hiseq', 100)
+            self.scheduler.add('m%i' % i, {'run': 'm%i' % i}, 'miseq', 100)
+        order = self.drain()
+        # hiseq has twice the weight so gets two runs for each miseq run
+        self.assertEqual([r[0] for r in order[:6]], ['h', 'm', 'h', 'h', 'm', 'h'])
+
+    def testDuplicatesIgnored(self):
+        self.assertTrue(self.scheduler.add('a', {'run': 'a'}, 'hiseq', 1))
+        self.assertFalse(self.scheduler.add('a', {'run': 'a'}, 'hiseq', 1))
+        self.assertEqual(len(self.scheduler), 1)
+        self.assertIn('a', self.scheduler)
+
+    def testPriorityFile(self):
+        self.scheduler.add('small', {'run': 'small'}, 'hiseq', 10)
+        self.scheduler.add('urgent', {'run': 'urgent'}, 'miseq', 1000)
+        with open(self.priority_file, 'w') as f:
+            json.dump({'urgent': 1}, f)
+        self.assertEqual(self.drain(), ['urgent', 'small'])
+
+    def test10xWeight(self):
+        self.assertEqual(self.scheduler.get_weight('hiseq_10x'), 1)
+        self.assertEqual(self.scheduler.get_weight('nextseq'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+import os
+import time
+import sqlite3
+import tempfile
+from unittest import mock
+from pathlib import Path
+from odybcl2fastq.run_state import RunStateDB
+
+RUN = '200101_A00794_0001_BHXXXXDSXX'
+MASK = 'y151_i8_i8_y151'
+
+
+class RunStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.run_dir = os.path.join(self.tmp.name, RUN)
+        os.makedirs(self.run_dir)
+        self.state = RunStateDB(os.path.join(self.tmp.name, 'run_state.db'), 'mirror')
+
+    def tearDown(self):
+        self.state.close()
+        self.tmp.cleanup()
+
+    def touch(self, marker):
+        path = Path(self.run_dir, marker)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+
+    def testMarkerPaths(self):
+        for marker, parsed in [
+                ('status/ody.processed', ('', 'processed')),
+                ('status/%s/ody.complete' % MASK, (MASK, 'complete')),
+                ('status/%s/demultiplex.processed' % MASK, (MASK, 'demultiplex')),
+                ('odybcl2fastq.skip', ('', 'skip'))]:
+            self.assertEqual(self.state.parse_marker(marker), parsed)
+            self.assertEqual(self.state.marker_path(parsed[1], parsed[0]), marker)
+        with self.assertRaises(ValueError):
+            self.state.parse_marker('status/SampleSheet.csv')
+
+    def testMirrorAnswersFromDb(self):
+        self.touch('status/ody.processed')
+        # the markers of a run not seen before are imported
+        self.assertTrue(self.state.marker_exists(self.run_dir, 'status/ody.processed'))
+        self.assertFalse(self.state.marker_exists(self.run_dir, 'odybcl2fastq.skip'))
+        # then answered from the db while the run and status dirs are unchanged
+        with mock.patch.object(self.state, 'import_markers', side_effect=AssertionError):
+            self.assertTrue(self.state.marker_exists(self.run_dir, 'status/ody.processed'))
+        # a marker removed or added by hand is seen on the next check
+        os.remove(os.path.join(self.run_dir, 'status', 'ody.processed'))
+        self.assertFalse(self.state.marker_exists(self.run_dir, 'status/ody.processed'))
+        self.touch('odybcl2fastq.skip')
+        self.assertTrue(self.state.marker_exists(self.run_dir, 'odybcl2fastq.skip'))
+        # touches write the file and the row
+        self.state.touch_marker(self.run_dir, 'status/%s/ody.processed' % MASK)
+        self.assertTrue(os.path.isfile(os.path.join(self.run_dir, 'status', MASK, 'ody.processed')))
+        self.assertTrue(self.state.has(RUN, 'processed', MASK))
+        # imported runs are remembered across connections
+        self.state.import_markers(self.run_dir)
+        state = RunStateDB(self.state.path, 'mirror')
+        self.assertEqual(state.imported[RUN], state.get_mtimes(self.run_dir))
+        state.close()
+
+    def testOldImportedTable(self):
+        # runs imported before the mtimes were kept are imported again
+        path = os.path.join(self.tmp.name, 'old.db')
+        db = sqlite3.connect(path)
+        db.execute('create table imported (run text primary key, updated real not null)')
+        db.execute('insert into imported values (?, ?)', (RUN, 0))
+        db.commit()
+        db.close()
+        self.touch('odybcl2fastq.skip')
+        state = RunStateDB(path, 'mirror')
+        self.assertEqual(state.imported[RUN], (None, None))
+        self.assertTrue(state.marker_exists(self.run_dir, 'odybcl2fastq.skip'))
+        state.close()
+
+    def testAllMasksComplete(self):
+        other = 'y151_i8_y151'
+        for mask in [MASK, other]:
+            self.touch('status/%s/ody.processed' % mask)
+        self.touch('status/%s/ody.complete' % MASK)
+        self.state.import_markers(self.run_dir)
+        self.assertEqual(sorted(self.state.get_masks(RUN)), sorted([MASK, other]))
+        self.assertFalse(self.state.all_masks_complete(RUN))
+        self.touch('status/%s/ody.complete' % other)
+        self.state.import_markers(self.run_dir)
+        self.assertTrue(self.state.all_masks_complete(RUN))
+        # a run without masks only has the run level marker
+        self.assertTrue(self.state.all_masks_complete('200102_A00794_0002_AHXXXXDSXX'))
+
+    def testStuck(self):
+        now = time.time()
+        self.state.set(RUN, 'processed', MASK, updated=now - 7200)
+        self.state.set(RUN, 'demultiplex', MASK, updated=now - 3600)
+        self.state.set('other', 'demultiplex', updated=now - 3600)
+        self.state.set('other', 'complete', updated=now - 60)
+        self.state.set('recent', 'demultiplex', updated=now)
+        self.assertEqual([tuple(r[:2]) for r in self.state.get_stuck('demultiplex', 0.5)], [(RUN, MASK)])
+        # processed was followed by demultiplex
+        self.assertEqual(self.state.get_stuck('processed', 0.5), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+from odybcl2fastq.parsers.samplesheet import SampleSheet
+
+SHEET = '''[Header]
+IEMFileVersion,4
+Chemistry,Amplicon
+
+[Reads]
+151
+151
+
+[Data]
+Lane,Sample_ID,Sample_Name,index,I5_Index_ID,index2,Sample_Project,Description,Type
+1,a,a,ACGTACGT,,,proj1,SUB1,
+1,b,b,CCGTACGT,,,proj2,SUB2,10x single cell
+2,c,c,GCGTACGT,,,proj1,SUB1,
+2,d,d,TCGTACGT,,,proj1,,standard
+'''
+
+
+class SampleSheetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, '200101_A00794_0001_XX', 'SampleSheet.csv')
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write(SHEET.replace('\n', '\r\n'))
+        self.sample_sheet = SampleSheet(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testRows(self):
+        data = self.sample_sheet.sections['Data']
+        self.assertEqual(list(data), ['1:a', '1:b', '2:c', '2:d'])
+        self.assertEqual(self.sample_sheet.lanes, ['1', '2'])
+        row = data['1:a']
+        self.assertEqual(list(row.keys())[:4], ['Lane', 'Sample_ID', 'Sample_Name', 'index'])
+        self.assertEqual(dict(row)['index'], 'ACGTACGT')
+        self.assertIn(('index2', ''), row.items())
+        # changes to one row are not seen by the others read under the same header
+        row['index'] = 'ACGTAC'
+        row['Recipe'] = '6_0'
+        del row['index2']
+        self.assertEqual((row['index'], row['Recipe'], 'index2' in row), ('ACGTAC', '6_0', False))
+        self.assertEqual(list(data['1:b']), list(data['2:c']))
+        self.assertNotIn('Recipe', data['1:b'])
+        self.assertEqual(data['1:b']['index2'], '')
+
+    def testIndexes(self):
+        self.assertEqual(self.sample_sheet.get_index('Lane'), {'1': ['1:a', '1:b'], '2': ['2:c', '2:d']})
+        self.assertEqual(self.sample_sheet.get_submissions(), ['SUB1', 'SUB2'])
+        self.assertEqual(self.sample_sheet.get_sample_projects(), {'proj1': ['a', 'c', 'd'], 'proj2': ['b']})
+        self.assertEqual(self.sample_sheet.get_sample_types(), {'b': '10x single cell', 'd': 'standard'})
+        self.assertEqual(self.sample_sheet.get_samples(), ['a', 'b', 'c', 'd'])
+
+    def testValidate(self):
+        self.sample_sheet.get_index('Sample_Project')
+        self.sample_sheet.validate()
+        # the empty index2 column is removed and the indexes rebuilt
+        corrected = SampleSheet(self.path)
+        self.assertNotIn('index2', corrected.sections['Data']['1:a'])
+        self.assertNotIn('I5_Index_ID', corrected.sections['Data']['1:a'])
+        self.assertEqual(self.sample_sheet.indexes, {})
+        self.assertTrue(os.path.exists(self.path + '.orig-uncorrected'))
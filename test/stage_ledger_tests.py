@@ -0,0 +1,66 @@
+import unittest
+import os
+import shutil
+import tempfile
+from odybcl2fastq.stage_ledger import StageLedger
+
+RUN = '170504_D00365_0934_BHGLCMBCXY'
+RUN_INFO = os.path.join(os.path.dirname(__file__), 'test_samplesheets',
+        '1_RunInfo_HiSeq_PE_singleindex_1_170504_D00365_0934_BHGLCMBCXY.xml')
+TIME_V = '''
+\tCommand being timed: "%s"
+\tUser time (seconds): 7200.00
+\tSystem time (seconds): 0.00
+\tPercent of CPU this job got: 200%%
+\tElapsed (wall clock) time (h:mm:ss or m:ss): %s
+\tMaximum resident set size (kbytes): 1048576
+\tFile system inputs: 10
+\tFile system outputs: 20
+\tExit status: %i
+'''
+
+
+class StageLedgerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.analysis_dir = os.path.join(self.tmp.name, RUN + '_custom')
+        for d in ['log', 'fastq']:
+            os.makedirs(os.path.join(self.analysis_dir, d))
+        shutil.copy(RUN_INFO, os.path.join(self.analysis_dir, 'RunInfo.xml'))
+        with open(os.path.join(self.analysis_dir, 'fastq', 's1_S1_L001_R1_001.fastq.gz'), 'wb') as f:
+            f.truncate(2 * 1024 ** 3)
+        self.write_log('demultiplex-100.err', 'bcl2fastq', '1:00:00', 0)
+        self.write_log('fastqc-101.err', 'fastqc', '0:30:00', 0)
+        self.write_log('count_10x.s1-102.err', 'cellranger count', '1:00:00', 1)
+        self.write_log('checksum-103.out', 'md5sum', '1:00:00', 0)
+        self.ledger = StageLedger(os.path.join(self.tmp.name, 'ledger.db'))
+
+    def tearDown(self):
+        self.ledger.close()
+        self.tmp.cleanup()
+
+    def write_log(self, name, command, wall, exit_status):
+        with open(os.path.join(self.analysis_dir, 'log', name), 'w') as f:
+            f.write('tool output\n' + TIME_V % (command, wall, exit_status))
+
+    def testCollectAndReport(self):
+        self.assertEqual(self.ledger.collect_run(self.analysis_dir), 3)
+        # collecting again replaces the rows
+        self.assertEqual(self.ledger.collect_run(self.analysis_dir), 3)
+        run = self.ledger.db.execute('select * from runs').fetchone()
+        self.assertEqual(run['run'], RUN)
+        self.assertEqual(run['instrument'], 'hiseq')
+        self.assertEqual(run['samples'], 1)
+        count = self.ledger.db.execute("select sample, exit_status from stages where rule = 'count_10x'").fetchone()
+        self.assertEqual(tuple(count), ('s1', 1))
+        report = dict((r[0], r) for r in self.ledger.stage_report())
+        self.assertEqual(sorted(report.keys()), ['demultiplex', 'fastqc'])
+        self.assertEqual(report['fastqc'][2], 0.5)
+        self.assertEqual(report['demultiplex'][4], 2)
+        throughput = self.ledger.throughput_report()
+        self.assertEqual(throughput, [('hiseq', 1, 2, 2.5, 0.8)])
+
+
+if __name__ == '__main__':
+    unittest.main()
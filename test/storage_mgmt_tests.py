@@ -4,6 +4,9 @@ from odybcl2fastq import config
 import datetime
 import shutil
 import os
+import tempfile
+from odybcl2fastq import storage_mgmt
+from odybcl2fastq.disk_usage import DiskUsageIndex
 
 
 def run_cmd(cmd):
@@ -128,3 +131,48 @@ class StorageMgmtTest(unittest.TestCase):
             self.assertTrue(code == 0, 'Error running command %s, %s' % (cmd, err))
             self.assertTrue('Deleting 1 runs' in err, 'Incorrect output: %s' % err)
             self.assertFalse(os.path.exists(testrunpath))
+
+
+class ReclaimTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.runs = []
+        for n, size in enumerate([8192, 4096, 4096]):
+            run = os.path.join(self.tmp.name, '_'.join(['20010%i' % (n + 1), 'D00742', '0197', 'BCBH04ANXX']))
+            os.makedirs(os.path.join(run, 'fastq'))
+            with open(os.path.join(run, 'fastq', 'reads.fastq.gz'), 'wb') as f:
+                f.write(b'x' * size)
+            self.runs.append(run)
+        # a file hard-linked elsewhere frees nothing
+        os.link(os.path.join(self.runs[1], 'fastq', 'reads.fastq.gz'), os.path.join(self.tmp.name, 'published'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def testSelectOldestUntilTarget(self):
+        expired = storage_mgmt.find_expired_runs(reversed(self.runs), '200104')
+        self.assertEqual(expired, self.runs)
+        sizes = [storage_mgmt.get_tree_size(r) for r in self.runs]
+        self.assertEqual(sizes[1], 0)
+        selected = storage_mgmt.select_runs(expired, sizes[0] + 1)
+        self.assertEqual([r for r, s in selected], self.runs)
+        self.assertEqual(storage_mgmt.select_runs(expired, 0), [])
+
+    def testLinkedAfterIndex(self):
+        index = DiskUsageIndex(os.path.join(self.tmp.name, 'disk_usage.db'))
+        index.refresh('analysis', self.tmp.name)
+        # published after the index was refreshed, the index still counts the run as freeing its size
+        os.link(os.path.join(self.runs[0], 'fastq', 'reads.fastq.gz'), os.path.join(self.tmp.name, 'published0'))
+        self.assertGreater(index.get_freed_bytes('analysis')[os.path.basename(self.runs[0])], 0)
+        index.close()
+        # runs are walked so the target is met
+        selected = storage_mgmt.select_runs(self.runs, 1)
+        self.assertEqual(selected, [(self.runs[0], 0), (self.runs[1], 0), (self.runs[2], 4096)])
+
+    def testDeleteRuns(self):
+        size = storage_mgmt.get_tree_size(self.runs[0])
+        reclaimed = storage_mgmt.delete_runs(self.runs[:2], 2)
+        self.assertEqual(reclaimed, {self.runs[0]: size, self.runs[1]: 0})
+        self.assertFalse(os.path.exists(self.runs[0]) or os.path.exists(self.runs[1]))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, 'published')))
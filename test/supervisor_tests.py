@@ -0,0 +1,131 @@
+import unittest
+import asyncio
+import os
+import sys
+import tempfile
+from odybcl2fastq.supervisor import OutputTail, SnakemakeSupervisor, read_limit, stop
+
+
+class OutputTailTest(unittest.TestCase):
+
+    def testLineLimit(self):
+        tail = OutputTail(max_lines=3, max_bytes=1024, pattern=None)
+        # lines are split across chunks
+        tail.feed(b'one\ntw')
+        tail.feed(b'o\nthree\nfour\nfi')
+        self.assertEqual(tail.tail(), 'two\nthree\nfour\n')
+        tail.close()
+        self.assertEqual(tail.tail(), 'three\nfour\nfi')
+
+    def testByteLimit(self):
+        tail = OutputTail(max_lines=100, max_bytes=10, pattern=None)
+        tail.feed(b'aaaa\nbbbb\ncccc\n')
+        self.assertEqual(tail.tail(), 'bbbb\ncccc\n')
+        self.assertEqual(tail.size, 10)
+        # a line over the limit keeps its end
+        tail.feed(b'x' * 20 + b'yyyyy\n')
+        self.assertEqual(tail.tail(), 'xxxxyyyyy\n')
+        # as does a partial line over the limit
+        tail.feed(b'z' * 50)
+        self.assertEqual(len(tail.partial), 10)
+
+    def testGrep(self):
+        tail = OutputTail(max_lines=2, max_bytes=1024, pattern='Error', max_matches=2)
+        tail.feed(b'Error 1\nok\nError 2\nok\nError 3\nok\nok\n')
+        self.assertEqual(tail.tail(), 'ok\nok\n')
+        # matches are kept after they leave the tail
+        self.assertEqual(tail.grep(), 'Error 2\nError 3\n')
+
+
+class SnakemakeSupervisorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.tmp.name, 'run.log')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_all(self, supervisor, launches):
+        async def run():
+            for run, argv in launches:
+                supervisor.launch(run, argv, self.log)
+            finished = []
+            while supervisor.running or supervisor.finished:
+                finished.extend(await supervisor.wait(5))
+            return finished
+        return asyncio.run(run())
+
+    def testOutputStreamed(self):
+        supervisor = SnakemakeSupervisor(2)
+        finished = self.run_all(supervisor, [
+            ('ok', [sys.executable, '-c', 'print("line 1"); print("Error 2")']),
+            ('fail', [sys.executable, '-c', 'import sys; sys.exit(3)'])])
+        results = {run: (ret_code, tail) for run, ret_code, tail in finished}
+        self.assertEqual(results['fail'][0], 3)
+        self.assertEqual(results['ok'][0], 0)
+        self.assertEqual(results['ok'][1].tail(), 'line 1\nError 2\n')
+        self.assertEqual(results['ok'][1].grep(), 'Error 2\n')
+        with open(self.log) as f:
+            self.assertEqual(f.read(), 'line 1\nError 2\n')
+
+    def testLaunchError(self):
+        supervisor = SnakemakeSupervisor(1)
+        missing = os.path.join(self.tmp.name, 'missing')
+        with self.assertLogs(level='ERROR'):
+            finished = self.run_all(supervisor, [('run', [missing])])
+        run, ret_code, tail = finished[0]
+        self.assertEqual(ret_code, -1)
+        # the error is a whole line of the tail
+        self.assertIn(missing, tail.tail())
+        self.assertTrue(tail.tail().endswith('\n'))
+
+    @unittest.skipUnless(os.path.exists('/dev/full'), 'needs /dev/full')
+    def testLogWriteError(self):
+        # a child whose output can't be written to the log is stopped rather than left blocked on the pipe
+        supervisor = SnakemakeSupervisor(1)
+        pid_file = os.path.join(self.tmp.name, 'pid')
+        argv = [sys.executable, '-c', 'import os\nopen(%r, "w").write(str(os.getpid()))\n'
+            'while True: print("x" * 1000, flush=True)' % pid_file]
+        async def run():
+            supervisor.launch('run', argv, '/dev/full')
+            return await asyncio.wait_for(supervisor.wait(30), 30)
+        with self.assertLogs(level='ERROR'):
+            finished = asyncio.run(run())
+        run, ret_code, tail = finished[0]
+        self.assertEqual(ret_code, -1)
+        self.assertIn('No space left on device', tail.tail())
+        self.assertEqual(supervisor.running, {})
+        with open(pid_file) as f:
+            pid = int(f.read())
+        with self.assertRaises(ProcessLookupError):
+            os.kill(pid, 0)
+
+    def testStopKills(self):
+        async def run():
+            proc = await asyncio.create_subprocess_exec(sys.executable, '-c',
+                'import signal, time\nsignal.signal(signal.SIGTERM, signal.SIG_IGN)\nprint("ready", flush=True)\ntime.sleep(60)',
+                stdout=asyncio.subprocess.PIPE)
+            await proc.stdout.readline()
+            await stop(proc, 0.5)
+            return proc.returncode
+        self.assertEqual(asyncio.run(run()), -9)
+
+    def testLimitFromFile(self):
+        path = os.path.join(self.tmp.name, 'proc_num')
+        supervisor = SnakemakeSupervisor(read_limit(path, 1))
+        self.assertEqual(supervisor.limit, 1)
+        supervisor.running['run1'] = None
+        self.assertFalse(supervisor.has_capacity())
+        with open(path, 'w') as f:
+            f.write('2\n')
+        supervisor.set_limit(read_limit(path, 1))
+        self.assertTrue(supervisor.has_capacity())
+        with open(path, 'w') as f:
+            f.write('two')
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(read_limit(path, 1), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
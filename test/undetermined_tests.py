@@ -0,0 +1,51 @@
+import unittest
+from odybcl2fastq.parsers.undetermined import top_barcodes, diagnose, get_causes, reverse_complement, encode, mismatches
+
+SAMPLES = [('s1', 'AAAACCCC', 'GGGGTTTT'), ('s2', 'ACGTACGT', 'TTGGCCAA'), ('s3', 'CAGTCAGT', 'GATCGATC')]
+
+
+class UndeterminedTest(unittest.TestCase):
+
+    def testTopBarcodes(self):
+        barcodes = {'A': 5, 'C': 50, 'G': 20, 'T': 1}
+        self.assertEqual(top_barcodes(barcodes, 2), [('C', 50), ('G', 20)])
+        self.assertEqual(top_barcodes(barcodes, 10, 10), [('C', 50), ('G', 20)])
+
+    def testMismatches(self):
+        a = encode(['ACGTNA', 'ACG'], 6)
+        b = encode(['ACGTAA', 'TTTTTT'], 6)
+        # N and bases past the end never match
+        self.assertEqual(mismatches(a, b).tolist(), [[1, 5], [3, 6]])
+
+    def testDiagnose(self):
+        barcodes = top_barcodes({
+            'AAAACCCC+' + reverse_complement('GGGGTTTT'): 9000,
+            'TTGGCCAA+ACGTACGT': 800,
+            reverse_complement('CAGTCAGT') + '+GATCGATC': 700,
+            'AAAACCCC+TTGGCCAA': 600,
+            'AAAACCCC+ACACACAC': 500,
+            'GGGGGGGG+GGGGGGGG': 300,
+            'TATATATA+CGCGCGCG': 200,
+            'AAAACCCA+GGGGTTTT': 100
+        })
+        diagnosis = diagnose(barcodes, SAMPLES)
+        self.assertEqual([(cause, sample) for count, cause, sample, d in diagnosis.values()], [
+            ('i5 reverse complemented', 's1'),
+            ('i7 and i5 swapped', 's2'),
+            ('i7 reverse complemented', 's3'),
+            ('index hopping, i7 and i5 of different samples', 's1, s2'),
+            ('i7 of a sample, i5 not in sample sheet', 's1'),
+            ('no index read (poly-G)', ''),
+            ('not in sample sheet', 's1'),
+            ('close to sample indexes', 's1')])
+        self.assertEqual(diagnosis['AAAACCCA+GGGGTTTT'][3], 1)
+        self.assertEqual(get_causes(diagnosis)[0], ('i5 reverse complemented', 1, 9000))
+
+    def testSingleIndex(self):
+        diagnosis = diagnose([('ACGTACGA', 50), ('TTTTGGGG', 40)], [('a', 'ACGTACGT', ''), ('b', 'CCCCAAAA', '')])
+        self.assertEqual(list(diagnosis.values()), [(50, 'close to sample indexes', 'a', 1),
+            (40, 'i7 reverse complemented', 'b', 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+import os
+import stat
+import tempfile
+from odybcl2fastq import util
+
+
+class ChmodRecTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.outs = os.path.join(self.tmp.name, 'count', 's1', 'outs')
+        os.makedirs(os.path.join(self.outs, 'filtered'), mode=0o700)
+        for name in ['outs/web_summary.html', 'outs/filtered/matrix.mtx.gz']:
+            path = os.path.join(self.tmp.name, 'count', 's1', name)
+            with open(path, 'w') as f:
+                f.write('x')
+            os.chmod(path, 0o600)
+        os.symlink('web_summary.html', os.path.join(self.outs, 'summary.html'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def mode(self, *names):
+        return stat.S_IMODE(os.stat(os.path.join(self.tmp.name, 'count', *names)).st_mode)
+
+    def testChangedThenSkipped(self):
+        os.chmod(os.path.join(self.tmp.name, 'count', 's1'), 0o775)
+        counts = util.chmod_rec(os.path.join(self.tmp.name, 'count'), 0o775, 0o664, workers=2)
+        # s1 already had the mode, the symlink is left alone
+        self.assertEqual((counts['changed'], counts['skipped']), (4, 1))
+        self.assertEqual(self.mode('s1', 'outs', 'filtered'), 0o775)
+        self.assertEqual(self.mode('s1', 'outs', 'filtered', 'matrix.mtx.gz'), 0o664)
+        counts = util.chmod_rec(os.path.join(self.tmp.name, 'count'), 0o775, 0o664)
+        self.assertEqual((counts['changed'], counts['skipped']), (0, 5))
+
+    def testDirsOnly(self):
+        counts = util.chmod_rec(os.path.join(self.tmp.name, 'count'), 0o775, None)
+        self.assertEqual(counts['changed'], 3)
+        self.assertEqual(self.mode('s1', 'outs', 'web_summary.html'), 0o600)
+
+
+if __name__ == '__main__':
+    unittest.main()